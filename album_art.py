@@ -0,0 +1,249 @@
+import base64
+import colorsys
+import hashlib
+import importlib.util
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+from kivy.clock import Clock
+
+log = logging.getLogger("player")
+
+# Album art is optional, the background just stays procedural without Pillow
+HAVE_PILLOW = importlib.util.find_spec("PIL") is not None
+
+# Longest side of a thumbnail in pixels, about what the center of the main screen shows
+THUMBNAIL_SIZE = 320
+# Thumbnails kept decoded in memory (RGBA, 400 KB each at most), and files kept on disk
+MEMORY_ITEMS = 24
+DISK_ITEMS = 5000
+# Every this many new files the disk cache gets checked against DISK_ITEMS
+TRIM_EVERY = 100
+
+# Picked from a tiny copy of the thumbnail, a few colours are plenty for a gradient
+PALETTE_SAMPLE = 64
+PALETTE_COLORS = 6
+
+# Next to the track when there is nothing embedded
+FOLDER_ART = ("cover.jpg", "cover.png", "folder.jpg", "folder.png", "front.jpg", "front.png")
+
+# pixels are RGBA rows from the top, colors the two background gradient colours
+Art = namedtuple("Art", ["size", "pixels", "colors"])
+
+
+def art_file_name(path):
+    # Same idea as the peak files, a changed file gets a new name
+    stat = os.stat(path)
+    key = f"{path}|{stat.st_mtime}|{stat.st_size}".encode()
+    return hashlib.sha1(key).hexdigest()
+
+
+def embedded_art(path):
+    # Raw image bytes of the front cover (any picture if there is no front cover), None without one
+    from mutagen import File
+    try:
+        audio = File(path)
+    except Exception:
+        return None
+    if audio is None:
+        return None
+
+    # (picture type, data), type 3 is the front cover
+    pictures = [(picture.type, picture.data) for picture in getattr(audio, "pictures", [])]
+    tags = audio.tags
+    try:
+        if hasattr(tags, "getall"):
+            # ID3
+            pictures += [(frame.type, frame.data) for frame in tags.getall("APIC")]
+        elif tags:
+            # MP4 covers, then Vorbis comments (Ogg) with FLAC picture blocks in base64
+            pictures += [(3, bytes(cover)) for cover in tags.get("covr", [])]
+            from mutagen.flac import Picture
+            for block in tags.get("metadata_block_picture", []):
+                picture = Picture(base64.b64decode(block))
+                pictures.append((picture.type, picture.data))
+    except Exception:
+        pass
+
+    if not pictures:
+        return None
+    pictures.sort(key=lambda picture: picture[0] != 3)
+    return pictures[0][1]
+
+
+def folder_art(path):
+    folder = os.path.dirname(path)
+    for name in FOLDER_ART:
+        try:
+            with open(os.path.join(folder, name), 'rb') as f:
+                return f.read()
+        except OSError:
+            continue
+    return None
+
+
+def dim(color, brightness):
+    # Darker version of an (r, g, b) colour, so white text stays readable on top of it
+    top = max(color)
+    scale = brightness / top if top > brightness else 1.0
+    return [c * scale for c in color] + [1]
+
+
+def background_colors(image):
+    # The most common colour for the bottom of the gradient, the most colourful of the rest for the top
+    small = image.convert("RGB").resize((PALETTE_SAMPLE, PALETTE_SAMPLE))
+    quantized = small.quantize(colors=PALETTE_COLORS)
+    palette = quantized.getpalette()
+    counts = sorted(quantized.getcolors(), reverse=True)
+    colors = [tuple(c / 255 for c in palette[index * 3:index * 3 + 3]) for count, index in counts]
+    dominant = colors[0]
+    accent = max(colors[1:] or colors, key=lambda color: colorsys.rgb_to_hsv(*color)[1])
+    return dim(dominant, 0.2), dim(accent, 0.4)
+
+
+def load_art(image):
+    image = image.convert("RGBA")
+    return Art(image.size, image.tobytes(), background_colors(image))
+
+
+def art_texture(art):
+    # Kivy thread only
+    from kivy.graphics.texture import Texture
+    texture = Texture.create(size=art.size, colorfmt="rgba")
+    texture.blit_buffer(art.pixels, colorfmt="rgba", bufferfmt="ubyte")
+    texture.flip_vertical()
+    return texture
+
+
+class ArtCache:
+    """
+    Album art thumbnails and the background colours that go with them.
+
+    The picture comes from the tags (or a cover.jpg next to the track) and gets decoded, shrunk and turned into a palette on one worker thread. The thumbnail is saved as a small JPEG, so the next time only that gets read. The last MEMORY_ITEMS thumbnails stay decoded in memory, going back and forth between a few songs never touches the disk.
+    Only the latest request counts, skipping through ten songs doesn't decode ten covers.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.enabled = HAVE_PILLOW
+        self._memory = OrderedDict()  # path -> Art, least recently used first
+        self._lock = threading.Lock()
+        self._wanted = None  # (path, callback) of the latest request
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._written = 0
+        if self.enabled:
+            os.makedirs(folder, exist_ok=True)
+
+    def cached(self, path):
+        # Art already in memory, None otherwise. Cheap enough to call on every track change
+        with self._lock:
+            art = self._memory.get(path)
+            if art is not None:
+                self._memory.move_to_end(path)
+            return art
+
+    def request(self, path, callback):
+        # callback(path, Art) is called on the Kivy thread once the art is there, never for tracks without art
+        if not self.enabled:
+            return
+        with self._lock:
+            self._wanted = (path, callback)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def shutdown(self):
+        self._stopped = True
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopped:
+                return
+            with self._lock:
+                wanted, self._wanted = self._wanted, None
+            if wanted is None:
+                continue
+
+            path, callback = wanted
+            try:
+                art = self._load(path)
+            except Exception as e:
+                log.warning(f"Art: could not load the art of {path}: {e}")
+                art = None
+            if art is None:
+                continue
+            self._remember(path, art)
+            # Bound now, the loop has moved on to the next request by the time the Kivy thread gets to this
+            Clock.schedule_once(lambda dt, path=path, art=art, callback=callback: callback(path, art), 0)
+
+    def _remember(self, path, art):
+        with self._lock:
+            self._memory[path] = art
+            self._memory.move_to_end(path)
+            while len(self._memory) > MEMORY_ITEMS:
+                self._memory.popitem(last=False)
+
+    def _load(self, path):
+        art = self.cached(path)
+        if art is not None:
+            return art
+        from PIL import Image
+
+        try:
+            base = os.path.join(self.folder, art_file_name(path))
+        except OSError:
+            return None
+
+        # 1. Done before, either a thumbnail or a note that there is no art
+        if os.path.exists(base + ".none"):
+            return None
+        try:
+            with Image.open(base + ".jpg") as image:
+                art = load_art(image)
+            os.utime(base + ".jpg")
+            return art
+        except OSError:
+            pass
+
+        # 2. First time, from the tags or the folder
+        data = embedded_art(path) or folder_art(path)
+        if data is None:
+            open(base + ".none", 'wb').close()
+            self._written += 1
+            return None
+        with Image.open(io.BytesIO(data)) as image:
+            image.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))  # JPEGs get decoded at a lower resolution right away
+            image = image.convert("RGB")
+        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        # Written under a temporary name first, a half written file never looks like a finished one
+        image.save(base + ".tmp", "JPEG", quality=88)
+        os.replace(base + ".tmp", base + ".jpg")
+        self._written += 1
+        if self._written % TRIM_EVERY == 0:
+            self._trim_disk()
+        return load_art(image)
+
+    def _trim_disk(self):
+        # Oldest files go first, reading a thumbnail touches it
+        try:
+            with os.scandir(self.folder) as it:
+                files = [(entry.stat().st_mtime, entry.path) for entry in it if entry.is_file()]
+        except OSError:
+            return
+        if len(files) <= DISK_ITEMS:
+            return
+        files.sort()
+        for mtime, file_path in files[:len(files) - DISK_ITEMS]:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
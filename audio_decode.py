@@ -0,0 +1,183 @@
+import os
+from bisect import bisect_left
+
+# Decoding for background worker processes only. Each worker gets its own mixer
+# on SDL's dummy driver, so nothing ever competes with the real playback device.
+MIXER_FREQUENCY = 44100
+MIXER_CHANNELS = 2
+
+# decode_chunks() hands out this much audio at a time, about 5 MB of samples however long the track is
+CHUNK_SECONDS = 30
+# Frames the pieces of a spliced file are lined up by, and how many places that could fit get a closer look
+ALIGN_FRAMES = 256
+ALIGN_TRIES = 64
+
+_mixer_ready = False
+
+
+def init_worker_mixer():
+    global _mixer_ready
+    if _mixer_ready:
+        return
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    from pygame import mixer
+    mixer.init(frequency=MIXER_FREQUENCY, size=-16, channels=MIXER_CHANNELS)
+    _mixer_ready = True
+
+
+def decode_pcm(path):
+    # Returns (int16 array shaped (frames, channels), sample rate).
+    # pygame does the actual decoding, sndarray hands us the samples without copying them.
+    # The whole track at once, decode_chunks() is the way for anything that can be long
+    init_worker_mixer()
+    import numpy as np
+    from pygame import mixer, sndarray
+
+    sound = mixer.Sound(path)
+    samples = np.asarray(sndarray.samples(sound))
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    return samples, mixer.get_init()[0]
+
+
+def decode_chunks(path, seconds=None):
+    """
+    Yields the track as (int16 array shaped (frames, channels), sample rate) pieces of about CHUNK_SECONDS, in order. With seconds it stops after that much audio.
+
+    A 3 hour mix is 1.9 GB of samples, decoded in one go that is what every worker would hold. 16 bit WAV at the mixer's rate is read as it is. MP3 and FLAC get cut at the points of their seek table (seek_index.py) and every piece goes through pygame on its own. Other formats (Ogg, ...) have no seek table, they are still decoded whole, with seconds only about that much of the file is handed to the decoder.
+    """
+    init_worker_mixer()
+    import numpy as np
+
+    pieces = _wav_chunks(path) or _spliced_chunks(path) or _whole(path, seconds)
+    left = None  # Frames still wanted, counted whole (seconds minus float seconds never quite reaches 0)
+    for samples, rate in pieces:
+        if seconds is not None:
+            if left is None:
+                left = round(seconds * rate)
+            samples = samples[:left]
+            left -= len(samples)
+        if len(samples):
+            yield np.asarray(samples), rate
+        if left is not None and left <= 0:
+            return
+
+
+def _wav_chunks(path):
+    # Plain 16 bit PCM at the mixer's rate, read straight from the file. None for anything pygame has to convert
+    import wave
+    if os.path.splitext(path)[1].lower() != ".wav":
+        return None
+    try:
+        reader = wave.open(path, 'rb')
+    except (wave.Error, EOFError, OSError):
+        return None
+    channels = reader.getnchannels()
+    if reader.getsampwidth() != 2 or reader.getframerate() != MIXER_FREQUENCY or channels not in (1, MIXER_CHANNELS):
+        reader.close()
+        return None
+    return _read_wav(reader, channels)
+
+
+def _read_wav(reader, channels):
+    import numpy as np
+    with reader:
+        rate = reader.getframerate()
+        while True:
+            data = reader.readframes(CHUNK_SECONDS * rate)
+            if not data:
+                return
+            samples = np.frombuffer(data, "<i2").reshape(-1, channels)
+            if channels != MIXER_CHANNELS:
+                # pygame plays mono on both sides, the analyses have always seen it like that
+                samples = np.repeat(samples, MIXER_CHANNELS, axis=1)
+            yield samples, rate
+
+
+def _spliced_chunks(path):
+    # MP3 and FLAC, piece by piece along the seek table. None when the file has none
+    from seek_index import build_seek_table
+    table = build_seek_table(path)
+    if table is None or len(table.times) < 2:
+        return None
+    return _decode_pieces(path, table)
+
+
+def _decode_pieces(path, table):
+    """
+    A piece starts one seek point early and ends one late, the extra bits get cut off again after decoding. Decoders don't start a spliced stream cleanly: an MP3 one needs a few frames to get going (the bit reservoir reaches back into earlier frames), a FLAC one drops the first frames. So the piece is lined up by finding the last samples of the previous one in its lead in, the first piece starts at the top of the file like playback does.
+    """
+    from seek_index import SpliceReader
+    from pygame import mixer, sndarray
+    rate = mixer.get_init()[0]
+    times, offsets = table.times, table.offsets
+    count = len(times)
+    start = 0
+    tail = None
+    while start < count:
+        end = max(start + 1, bisect_left(times, times[start] + CHUNK_SECONDS))
+        first = max(0, start - 1)
+        stop = offsets[end + 1] if end + 1 < count else None
+        if first:
+            reader = SpliceReader(table.header, path, offsets[first], stop)
+        else:
+            reader = SpliceReader(b"", path, 0, stop)
+        try:
+            sound = mixer.Sound(file=reader)
+        finally:
+            reader.close()
+        samples = sndarray.samples(sound)
+        if samples.ndim == 1:
+            samples = samples[:, None]
+        lead = round(times[start] * rate) - round(times[first] * rate)
+        if tail is not None:
+            lead = _find_end(samples, tail, lead)
+        if end < count:
+            piece = samples[lead:lead + round(times[end] * rate) - round(times[start] * rate)]
+        else:
+            piece = samples[lead:]
+        if len(piece) >= ALIGN_FRAMES:
+            tail = piece[-ALIGN_FRAMES:].copy()
+        yield piece, rate
+        start = end
+
+
+def _find_end(samples, tail, expected):
+    # Where tail ends in samples, the match closest to expected. expected itself when it isn't in there sample
+    # for sample (a resampled stream doesn't come out quite the same twice)
+    import numpy as np
+    size = len(tail)
+    column = samples[size - 1:expected * 2 + size, 0]
+    ends = np.nonzero(column == tail[-1, 0])[0] + size
+    for end in ends[np.argsort(np.abs(ends - expected), kind="stable")][:ALIGN_TRIES]:
+        if np.array_equal(samples[end - size:end], tail):
+            return int(end)
+    return expected
+
+
+def _whole(path, seconds):
+    # Formats without a seek table. With seconds only the share of the file that holds them (plus a margin, the
+    # bit rate isn't the same all the way through) goes to the decoder, it stops where the bytes do
+    duration = _duration(path) if seconds is not None else None
+    if not duration or seconds >= duration:
+        yield decode_pcm(path)
+        return
+    from pygame import mixer, sndarray
+    from seek_index import SpliceReader
+    size = os.path.getsize(path)
+    reader = SpliceReader(b"", path, 0, min(size, int(size * seconds * 1.5 / duration) + 65536))
+    try:
+        sound = mixer.Sound(file=reader)
+    finally:
+        reader.close()
+    samples = sndarray.samples(sound)
+    yield (samples[:, None] if samples.ndim == 1 else samples), mixer.get_init()[0]
+
+
+def _duration(path):
+    from mutagen import File
+    try:
+        audio = File(path)
+    except Exception:
+        return None
+    return getattr(getattr(audio, "info", None), "length", None)
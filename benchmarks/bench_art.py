@@ -0,0 +1,76 @@
+"""
+Album art cost: first load of a cover, the thumbnail from the disk cache, and the in-memory hit.
+
+    python benchmarks/bench_art.py [tracks]
+
+Every synthetic track gets its own folder with a 3000x3000 cover.jpg, the size big releases come with. All of
+this runs on the art worker thread in the app, except for the memory hit which is what a track change costs the
+UI thread when the art was shown recently.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+from album_art import MEMORY_ITEMS, ArtCache
+
+
+def make_track(folder, n):
+    os.makedirs(folder)
+    path = os.path.join(folder, "track.wav")
+    with wave.open(path, 'wb') as out:
+        out.setnchannels(2)
+        out.setsampwidth(2)
+        out.setframerate(44100)
+        out.writeframes(bytes(4 * 4410))
+    cover = Image.new("RGB", (3000, 3000), ((n * 40) % 256, 80, 160))
+    ImageDraw.Draw(cover).ellipse((600, 600, 2400, 2400), fill=(240, (n * 90) % 256, 40))
+    cover.save(os.path.join(folder, "cover.jpg"), quality=92)
+    return path
+
+
+def load(cache):
+    # What the worker thread does for one request, minus the hand over to the Kivy thread
+    def action(path):
+        cache._remember(path, cache._load(path))
+    return action
+
+
+def timed(action, paths):
+    samples = []
+    for path in paths:
+        started = time.perf_counter()
+        action(path)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def report(name, samples):
+    print(f"{name:<12} {statistics.mean(samples):>8.2f} ms mean {max(samples):>8.2f} ms max")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    with tempfile.TemporaryDirectory() as folder:
+        paths = [make_track(os.path.join(folder, f"album{n}"), n) for n in range(count)]
+        cache = ArtCache(os.path.join(folder, "art"))
+
+        report("first load", timed(load(cache), paths))
+        cache._memory.clear()
+        report("from disk", timed(load(cache), paths))
+        report("in memory", timed(cache.cached, paths[-MEMORY_ITEMS:]))
+
+        held = sum(len(art.pixels) for art in cache._memory.values())
+        on_disk = sum(entry.stat().st_size for entry in os.scandir(cache.folder))
+        print(f"\n{len(cache._memory)} thumbnails in memory ({held / 1e6:.1f} MB), {on_disk / 1e6:.1f} MB on disk "
+              f"for {count} tracks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Frame times of the app while scripts hammer the remote control (control_server.py).
+
+    python benchmarks/bench_control.py [--clients 4] [--requests 5000] [--seconds 3]
+
+Starts the app on an offscreen window (it needs a checkout with assets/) with a track of a synthetic library
+playing, then runs: nothing for --seconds, the volume changed every frame for --seconds (what dragging the slider
+costs, the labels next to it get drawn again), every client flooding status requests, every client flooding volume
+commands (pipelined, --requests per client), and the same commands as batches of 100. Every client is a process of
+its own, like a real script. Reported are the frame times (p50, p95, max in ms), the requests answered per second
+and how long the UI thread spent on commands per frame (the "control commands" span, DRAIN_BUDGET caps it). Audio
+goes to SDL's dummy driver. On a software renderer the max is mostly the renderer, it shows up when idle too.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+os.environ.setdefault("MUSICPLAYER_PERF", "1")
+if not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY"):
+    os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_library import make_library
+
+BATCH = 100
+
+
+def flood(address, requests, batch):
+    # One client, in a process of its own like a real script (a thread would fight the app for the GIL).
+    # Writes everything at once, then reads the answers
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--client", address, str(batch)],
+        input=json.dumps(requests), capture_output=True, text=True
+    )
+    return int(out.stdout or 0)
+
+
+def run_client(address, batch):
+    requests = json.load(sys.stdin)
+    client = socket.socket(socket.AF_UNIX)
+    client.connect(address)
+    stream = client.makefile('rwb')
+    lines = []
+    for start in range(0, len(requests), batch):
+        chunk = requests[start:start + batch]
+        lines.append(json.dumps(chunk if batch > 1 else chunk[0]).encode() + b"\n")
+
+    writer = threading.Thread(target=lambda: (stream.writelines(lines), stream.flush()), daemon=True)
+    writer.start()
+    answered = 0
+    for _ in lines:
+        response = json.loads(stream.readline())
+        answered += len(response) if isinstance(response, list) else 1
+    writer.join()
+    client.close()
+    print(answered)
+
+
+def frame_stats(frames):
+    frames = sorted(frames)
+    return statistics.median(frames), frames[int(len(frames) * 0.95)], frames[-1]
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--client":
+        run_client(sys.argv[2], int(sys.argv[3]))
+        return
+
+    parser = argparse.ArgumentParser(description="Remote control flood benchmark")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=5000, help="requests per client and case")
+    parser.add_argument("--seconds", type=float, default=3.0, help="length of the idle case")
+    args = parser.parse_args()
+    if not os.path.exists(os.path.join(ROOT, "assets")):
+        sys.exit("the app needs assets/ to start, run this from a full checkout")
+
+    paths = make_library(os.path.join(tempfile.gettempdir(), "musicplayer-bench", "wav-20-60"), 20, "wav", 60)
+    os.chdir(ROOT)
+    import main as player
+    import perf
+    from kivy.clock import Clock
+
+    data_dir = tempfile.mkdtemp()
+
+    class BenchApp(player.MusicPlayerApp):
+        user_data_dir = data_dir
+
+    app = BenchApp()
+    app.kv_file = os.path.join(ROOT, "MusicPlayerApp.kv")
+    frames = []
+    results = []
+
+    def drag(dt):
+        main_screen = app.root.get_screen("main")
+        main_screen.volume = 0.3 if main_screen.volume != 0.3 else 0.7
+
+    def run_case(name, requests, batch, dragging=False):
+        done = []
+        perf.recorder.clear()
+        del frames[:]
+        started = time.perf_counter()
+        if dragging:
+            Clock.schedule_interval(drag, 0)
+        if requests is None:
+            threads = [threading.Timer(args.seconds, lambda: done.append(0))]
+        else:
+            threads = [threading.Thread(target=lambda: done.append(flood(app.control.addresses[0], requests, batch)))
+                       for _ in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        while len(done) < len(threads):
+            yield 0
+        elapsed = time.perf_counter() - started
+        Clock.unschedule(drag)
+        drain = perf.recorder.summary().get("control commands", {})
+        results.append((name, frame_stats(frames), sum(done) / elapsed, drain.get("p95", 0.0)))
+
+    def script():
+        while not app.engine.ready or app.control is None or not app.control.addresses:
+            yield 0.05
+        # No loudness measuring in the background, its workers would take CPU time from the cases
+        app.engine.normalize = False
+        app.add_tracks(paths)
+        app.engine.play(0)
+        # The waveform, spectrum and seek table of the track are made in the background first
+        yield 8
+        Clock.schedule_interval(lambda dt: frames.append(dt * 1000), 0)
+        yield from run_case("idle", None, 1)
+        yield from run_case("slider drag, no requests", None, 1, dragging=True)
+        yield from run_case("status", [{"cmd": "status"}] * args.requests, 1)
+        volume = [{"cmd": "volume", "volume": (i % 10) / 10} for i in range(args.requests)]
+        yield from run_case("volume", volume, 1)
+        yield from run_case(f"volume, batches of {BATCH}", volume, BATCH)
+        app.stop()
+
+    steps = script()
+
+    def tick(dt):
+        try:
+            Clock.schedule_once(tick, next(steps))
+        except StopIteration:
+            pass
+
+    Clock.schedule_once(tick, 0.5)
+    app.run()
+
+    print(f"{args.clients} clients, {args.requests} requests each\n")
+    print(f"{'case':<26}{'frame p50':>10}{'p95':>8}{'max':>8}{'requests/s':>12}{'UI ms/frame p95':>17}")
+    for name, (p50, p95, worst), rate, drain in results:
+        print(f"{name:<26}{p50:>10.1f}{p95:>8.1f}{worst:>8.1f}{rate:>12.0f}{drain:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+What preparing a crossfade costs: time to decode the end of a track and the samples it keeps in memory.
+
+    python benchmarks/bench_crossfade.py [minutes]
+
+Writes a long synthetic WAV (default 30 minutes, about 300 MB) to a temporary folder and prepares fades of
+a few lengths out of it. The memory column is the Sound that waits for the crossfade, compare it with the size
+of the file, which is what decoding the whole track would hold.
+"""
+import os
+import sys
+import tempfile
+import time
+import wave
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from crossfade import load_tail
+
+RATE = 44100
+
+
+def write_wav(path, minutes):
+    # Written a minute at a time, the generator itself shouldn't need the whole track in memory either
+    t = np.arange(RATE * 60) / RATE
+    minute = (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16)
+    frames = np.stack([minute, minute], axis=1).tobytes()
+    with wave.open(path, 'wb') as out:
+        out.setnchannels(2)
+        out.setsampwidth(2)
+        out.setframerate(RATE)
+        for _ in range(minutes):
+            out.writeframes(frames)
+
+
+def main():
+    minutes = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    from pygame import mixer
+    mixer.init(frequency=RATE)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "long.wav")
+        write_wav(path, minutes)
+        size = os.path.getsize(path)
+        duration = minutes * 60.0
+        print(f"{minutes} minute WAV, {size / 1e6:.0f} MB on disk\n")
+        print(f"{'fade':>6} {'prepare':>10} {'memory':>10}")
+        for fade in (2, 6, 12):
+            started = time.perf_counter()
+            sound = load_tail(path, duration - fade, duration, None)
+            elapsed = (time.perf_counter() - started) * 1000
+            print(f"{fade:>5}s {elapsed:>8.1f}ms {sound.get_length() * RATE * 4 / 1e6:>8.1f}MB")
+            del sound
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Duplicate detection (duplicates.py) on a six-figure library, and on real audio.
+
+    python benchmarks/bench_duplicates.py [--tracks 100000] [--planted 1000] [--library 30]
+
+cheap: --tracks placeholder files (sparse, nothing to decode) with rows in a metadata database, --planted of
+them copies of another one (same size, length and tags). The DuplicateFinder runs its cheap checks over all of
+them, reported are the time per track and the copies found.
+index: --tracks fingerprints of random bits with lengths spread like a real collection (4 min, give or take one),
+--planted of them another track with a fifth of its bits flipped and shifted by a few frames, like a re-encode.
+Every track is looked up and then added, like the finder does. Reported are the time per track for every tenth
+of the way (it should stay flat), the memory of the postings, the planted copies found and the unrelated tracks
+taken for copies. Real fingerprints are less random than these, their keys bunch up a little more.
+library: a synthetic library of --library WAV tracks plus a few of them again, as an exact copy, without tags,
+quieter with noise and some silence in front, and low passed. The whole finder runs on it, worker processes and
+database included, reported are the time per track and what it found against what it should have.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import duplicates
+from duplicates import DuplicateFinder, FingerprintIndex, length_bucket, same_recording
+from metadata_index import MetadataIndex, TrackInfo
+from synthetic_library import RATE, make_library
+
+FRAMES = 645
+
+
+def lengths(count, rng):
+    return [max(30.0, rng.gauss(240, 60)) for _ in range(count)]
+
+
+def planted_pairs(count, planted, rng):
+    # copy -> original, copies among the tracks after their original. An original can be a copy itself
+    copies = rng.sample(range(1, count), planted)
+    return {copy: rng.randrange(copy) for copy in copies}
+
+
+def source_of(track, copies):
+    while track in copies:
+        track = copies[track]
+    return track
+
+
+def wait_for(finder, found):
+    # The finder publishes once the queue is empty and every fingerprint is in
+    while finder._thread.is_alive() and (finder._wake.is_set() or finder._queue):
+        time.sleep(0.05)
+    return found[-1] if found else frozenset()
+
+
+def run_cheap(count, planted):
+    rng = random.Random(1)
+    folder = tempfile.mkdtemp(prefix="musicplayer-dupes-")
+    durations = lengths(count, rng)
+    copies = planted_pairs(count, planted, rng)
+    paths = [os.path.join(folder, f"{i:06d}.mp3") for i in range(count)]
+    infos = []
+    for i, path in enumerate(paths):
+        source = source_of(i, copies)
+        with open(path, "wb") as out:
+            out.truncate(3_000_000 + source * 7)
+        stat = os.stat(path)
+        infos.append(TrackInfo(path, stat.st_mtime, stat.st_size, durations[source], f"Title {source}",
+                               f"Artist {source % 5000}", f"Album {source % 9000}", "MP3", 256000))
+    metadata = MetadataIndex(os.path.join(folder, "library.db"))
+    metadata.store_many(infos)
+
+    found = []
+    finder = DuplicateFinder(metadata, on_change=found.append)
+    # Cheap checks only, the placeholders have no sound to fingerprint
+    finder._fingerprints = None
+    started = time.perf_counter()
+    finder.add(paths)
+    result = wait_for(finder, found)
+    elapsed = time.perf_counter() - started
+    finder.shutdown()
+    metadata.close()
+    expected = {paths[copy] for copy in copies}
+    print(f"cheap: {count} tracks in {elapsed:.1f} s, {elapsed / count * 1e6:.0f} us per track, "
+          f"{len(result & expected)} of {len(expected)} copies found, {len(result - expected)} wrong")
+
+
+def random_prints(seed):
+    return np.random.default_rng(seed).integers(0, 1 << 32, FRAMES, dtype=np.uint32)
+
+
+def re_encoded(prints, seed):
+    # A fifth of the bits flipped, a few frames of shift
+    rng = np.random.default_rng(seed + 1_000_000)
+    flips = (rng.random((FRAMES, 32)) < 0.2).astype(np.uint32) << np.arange(32, dtype=np.uint32)
+    shift = int(rng.integers(0, 4))
+    noisy = prints ^ flips.sum(axis=1, dtype=np.uint32)
+    return np.concatenate([rng.integers(0, 1 << 32, shift, dtype=np.uint32), noisy])[:FRAMES]
+
+
+def run_index(count, planted):
+    rng = random.Random(2)
+    durations = lengths(count, rng)
+    copies = planted_pairs(count, planted, rng)
+
+    def prints_of(track):
+        if track in copies:
+            return re_encoded(prints_of(copies[track]), track)
+        return random_prints(track)
+
+    index = FingerprintIndex()
+    found = set()
+    wrong = 0
+    step = max(1, count // 10)
+    started = lap = time.perf_counter()
+    print(f"index: {count} tracks, {planted} planted copies")
+    for track in range(count):
+        prints = prints_of(track)
+        if track in copies:
+            durations[track] = durations[copies[track]] + rng.uniform(-0.5, 0.5)
+        bucket = length_bucket(durations[track])
+        for other, (offset, votes) in index.query(prints, bucket).items():
+            if abs(durations[other] - durations[track]) <= duplicates.DURATION_SLACK and \
+                    same_recording(prints, prints_of(other), offset):
+                # Two copies of one track find each other too
+                if source_of(track, copies) == source_of(other, copies):
+                    found.add(track)
+                else:
+                    wrong += 1
+        index.add(track, prints, bucket)
+        if (track + 1) % step == 0:
+            now = time.perf_counter()
+            print(f"  {track + 1:>7} tracks  {(now - lap) / step * 1000:.2f} ms per track")
+            lap = now
+    elapsed = time.perf_counter() - started
+    memory = index.nbytes / 2 ** 20
+    print(f"index: {elapsed:.1f} s, {len(index)} postings in {memory:.0f} MB, "
+          f"{len(found)} of {len(copies)} copies found, {wrong} wrong")
+
+
+def perturbed(samples, rng, kind):
+    x = samples.astype(np.float32)
+    if kind == "quieter, noise, 0.3 s in front":
+        x = x * 0.6 + rng.standard_normal(x.shape) * 100
+        x = np.concatenate([np.zeros((int(0.3 * RATE), 2), np.float32), x])
+    elif kind == "low passed":
+        spectrum = np.fft.rfft(x, axis=0)
+        spectrum[np.fft.rfftfreq(len(x), 1 / RATE) > 6000] = 0
+        x = np.fft.irfft(spectrum, len(x), axis=0)
+    return np.clip(x, -32768, 32767).astype(np.int16)
+
+
+def run_library(tracks):
+    import shutil
+    import wave
+    from synthetic_library import write_wav
+
+    folder = os.path.join(tempfile.gettempdir(), "musicplayer-bench", f"wav-{tracks}-40")
+    paths = make_library(folder, tracks, "wav", 40)
+    extra = tempfile.mkdtemp(prefix="musicplayer-dupes-")
+    rng = np.random.default_rng(3)
+    kinds = ["exact copy", "no tags", "quieter, noise, 0.3 s in front", "low passed"]
+    expected = set()
+    for number, kind in enumerate(kinds):
+        source = paths[number * 3]
+        path = os.path.join(extra, f"{number} {kind}.wav")
+        if kind == "exact copy":
+            shutil.copy(source, path)
+        else:
+            with wave.open(source) as original:
+                samples = np.frombuffer(original.readframes(original.getnframes()), np.int16).reshape(-1, 2)
+            if kind == "no tags":
+                with wave.open(path, 'wb') as out:
+                    out.setnchannels(2)
+                    out.setsampwidth(2)
+                    out.setframerate(RATE)
+                    out.writeframes(samples.tobytes())
+            else:
+                write_wav(path, perturbed(samples, rng, kind),
+                          {"title": kind, "artist": "Someone Else", "album": "Best Of", "track": "1"})
+        expected.add(path)
+
+    metadata = MetadataIndex(os.path.join(extra, "library.db"))
+    found = []
+    finder = DuplicateFinder(metadata, on_change=found.append)
+    everything = paths + sorted(expected)
+    started = time.perf_counter()
+    finder.add(everything)
+    result = wait_for(finder, found)
+    elapsed = time.perf_counter() - started
+    finder.shutdown()
+    metadata.close()
+    print(f"library: {len(everything)} tracks in {elapsed:.1f} s ({duplicates.FINGERPRINT_WORKERS} workers), "
+          f"{elapsed / len(everything) * 1000:.0f} ms per track")
+    for path in sorted(expected):
+        print(f"  {'found' if path in result else 'MISSED':<8}{os.path.basename(path)}")
+    for path in sorted(result - expected):
+        print(f"  {'WRONG':<8}{path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Duplicate detection benchmark")
+    parser.add_argument("--tracks", type=int, default=100_000, help="tracks for the cheap and the index case")
+    parser.add_argument("--planted", type=int, default=1000, help="copies among them")
+    parser.add_argument("--library", type=int, default=30, help="WAV tracks for the library case")
+    parser.add_argument("--only", choices=["cheap", "index", "library"])
+    args = parser.parse_args()
+
+    if args.only in (None, "cheap"):
+        run_cheap(args.tracks, args.planted)
+    if args.only in (None, "index"):
+        run_index(args.tracks, args.planted)
+    if args.only in (None, "library"):
+        run_library(args.library)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Track change, seek and gapless latency of the player engine, no Kivy and no window involved.
+
+    python benchmarks/bench_engine.py song1.mp3 song2.mp3 [more ...]
+
+Runs on SDL's dummy audio driver. The gapless part plays the last two files through, so keep those short.
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from player_engine import PlayerEngine
+
+
+def timed(action):
+    started = time.perf_counter()
+    action()
+    return (time.perf_counter() - started) * 1000
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:<14} {statistics.mean(samples):>8.2f} ms mean {p95:>8.2f} ms p95  ({len(samples)} runs)")
+
+
+def main():
+    paths = [path.replace('\\', '/') for path in sys.argv[1:]]
+    if len(paths) < 2:
+        print(__doc__)
+        return
+
+    engine = PlayerEngine()
+    engine.add(paths)
+    engine.start()
+
+    # 1. Track changes, back and forth through the whole list a few times
+    engine.play(0)
+    changes = []
+    for _ in range(5):
+        for _ in range(len(paths) - 1):
+            changes.append(timed(engine.next))
+        for _ in range(len(paths) - 1):
+            changes.append(timed(engine.previous))
+    report("track change", changes)
+
+    # 2. Seeks spread over the first track
+    seeks = []
+    for step in range(20):
+        engine.seek(engine.duration * step / 20)
+        seeks.append(engine.last_seek_ms)
+    report("seek", seeks)
+
+    # 3. Gapless: how long after the real end of a track the engine had switched over
+    switched = threading.Event()
+    engine.bind(on_track_end=lambda path: switched.set())
+    engine.play(len(paths) - 2)
+    engine.seek(max(0, engine.duration - 1))
+    if switched.wait(engine.duration + 5) and engine.index == len(paths) - 1:
+        report("gapless", [engine.last_track_change_ms])
+    else:
+        print("gapless        no switch (last track not queued in time?)")
+
+    engine.shutdown()
+
+
+if __name__ == "__main__":
+    main()
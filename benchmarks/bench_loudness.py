@@ -0,0 +1,66 @@
+"""
+Speed and accuracy of the loudness measurement.
+
+    python benchmarks/bench_loudness.py [song.mp3 ...]
+
+Measures a few EBU Tech 3341 style test signals (the expected loudness is known exactly) and how long a
+4 minute stereo track takes. Files given on the command line are analyzed the way the background worker does it,
+tags first and decoding only when there are none.
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from loudness import TARGET_LUFS, integrated_loudness, measure_gain, read_replaygain
+
+RATE = 48000
+
+
+def tone(level_db, seconds, freq=1000, rate=RATE):
+    t = np.arange(int(rate * seconds)) / rate
+    return np.sin(2 * np.pi * freq * t) * 10 ** (level_db / 20)
+
+
+def stereo(signal):
+    samples = (signal * 32767).astype(np.int16)
+    return np.stack([samples, samples], axis=1)
+
+
+def main():
+    cases = [
+        ("1 kHz at -23 dBFS", stereo(tone(-23, 20)), -23.0),
+        ("1 kHz at -33 dBFS", stereo(tone(-33, 20)), -33.0),
+        ("-36/-23/-36 dBFS", stereo(np.concatenate([tone(-36, 10), tone(-23, 60), tone(-36, 10)])), -23.0),
+        ("-72/-36/-72 dBFS", stereo(np.concatenate([tone(-72, 10), tone(-36, 60), tone(-72, 10)])), -36.0),
+    ]
+    print(f"{'signal':<20} {'expected':>9} {'measured':>9}")
+    for name, samples, expected in cases:
+        print(f"{name:<20} {expected:>9.2f} {integrated_loudness(samples, RATE):>9.2f}")
+
+    rng = np.random.default_rng(1)
+    samples = (rng.standard_normal((44100 * 240, 2)) * 3000).astype(np.int16)
+    runs = []
+    for _ in range(3):
+        started = time.perf_counter()
+        integrated_loudness(samples, 44100)
+        runs.append(time.perf_counter() - started)
+    print(f"\n4 minute stereo track at 44.1 kHz: {min(runs) * 1000:.0f} ms ({240 / min(runs):.0f}x real time)")
+
+    for path in sys.argv[1:]:
+        started = time.perf_counter()
+        gain = read_replaygain(path)
+        source = "tags"
+        if gain is None:
+            gain = measure_gain(path)
+            source = "decoded"
+        elapsed = (time.perf_counter() - started) * 1000
+        shown = "silent or unreadable" if gain is None else f"{gain:+.2f} dB to {TARGET_LUFS:.0f} LUFS"
+        print(f"{os.path.basename(path)}: {shown} ({source}, {elapsed:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
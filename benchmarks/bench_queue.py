@@ -0,0 +1,112 @@
+"""
+Cost of the play queue operations on a large playlist, plus a consistency run.
+
+    python benchmarks/bench_queue.py [tracks]
+
+The timings are per operation on a playlist of `tracks` entries, with shuffle off and on. The consistency run
+does a few thousand random operations on a small queue and compares it with a plain list after every one of them
+(positions, shuffle permutation, the cursor), so a broken invariant shows up as an AssertionError with the step.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from play_queue import REPEAT_ALL, REPEAT_MODES, PlayQueue
+
+
+def timed(action, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        action()
+        samples.append((time.perf_counter() - started) * 1_000_000)
+    return samples
+
+
+def report(name, samples):
+    samples.sort()
+    print(f"  {name:<14} {statistics.mean(samples):>8.1f} us mean {samples[int(len(samples) * 0.99)]:>8.1f} us p99")
+
+
+def bench(count, shuffle):
+    rng = random.Random(1)
+    queue = PlayQueue(seed=1)
+    started = time.perf_counter()
+    queue.add([f"/music/{n}.mp3" for n in range(count)])
+    print(f"\n{count} tracks, shuffle {'on' if shuffle else 'off'}: added in {(time.perf_counter() - started) * 1000:.0f} ms")
+    queue.set_shuffle(shuffle)
+    queue.set_repeat(REPEAT_ALL)
+    queue.jump(queue.id_at(count // 2))
+
+    report("next", timed(queue.next, 2000))
+    report("previous", timed(queue.previous, 2000))
+    report("position", timed(lambda: queue.position(queue.id_at(rng.randrange(len(queue)))), 2000))
+    report("play next", timed(lambda: queue.play_next(queue.id_at(rng.randrange(len(queue)))), 2000))
+    report("move", timed(lambda: queue.move(queue.id_at(rng.randrange(len(queue))), rng.randrange(len(queue))), 2000))
+    report("remove", timed(lambda: queue.remove(queue.id_at(rng.randrange(len(queue)))), 2000))
+    report("remove current", timed(lambda: queue.remove(queue.current), 200))
+
+
+def check(queue, model):
+    assert queue._ids == model
+    assert all(a < b for a, b in zip(queue._keys, queue._keys[1:]))
+    for position, track_id in enumerate(model):
+        assert queue.position(track_id) == position and queue.id_at(position) == track_id
+    assert queue.current is None or queue.current in queue
+    if queue.shuffle:
+        assert sorted(track_id for track_id in queue._order if track_id in queue) == sorted(model)
+        assert all(queue._order_index[track_id] == index for index, track_id in enumerate(queue._order))
+        if queue._anchor in queue:
+            assert queue._order[queue._cursor] == queue._anchor
+
+
+def consistency(runs=200, steps=300):
+    for seed in range(runs):
+        rng = random.Random(seed)
+        queue = PlayQueue(seed)
+        model = []
+        for step in range(steps):
+            op = rng.random()
+            if op < 0.2 or not model:
+                model += queue.add([str(rng.random()) for _ in range(rng.randint(1, 20))])
+            elif op < 0.35:
+                track_id = rng.choice(model)
+                queue.remove(track_id)
+                model.remove(track_id)
+            elif op < 0.45:
+                track_id = rng.choice(model)
+                position = rng.randrange(len(model))
+                queue.move(track_id, position)
+                model.remove(track_id)
+                model.insert(position, track_id)
+            elif op < 0.55:
+                queue.jump(rng.choice(model))
+            elif op < 0.7:
+                auto = rng.random() < 0.5
+                peeked = queue.peek_next(auto)
+                assert queue.next(auto) == peeked, f"seed {seed} step {step}: peek_next and next disagree"
+            elif op < 0.78:
+                queue.previous()
+            elif op < 0.85:
+                queue.play_next(rng.choice(model))
+            elif op < 0.92:
+                queue.set_shuffle(not queue.shuffle)
+            else:
+                queue.set_repeat(rng.choice(REPEAT_MODES))
+            check(queue, model)
+    print(f"\nconsistency: {runs * steps} random operations, queue and plain list agree")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    bench(count, shuffle=False)
+    bench(count, shuffle=True)
+    consistency()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Type-ahead latency of the playlist search index on a large synthetic playlist.
+
+    python benchmarks/bench_search.py [tracks]
+
+Builds the index from batches the way the list screen gets them, then types a few queries one key at a
+time and reports what every keystroke cost. A frame at 60 fps is 16.7 ms, and the filter also has to
+hand the rows to the RecycleView in that frame.
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metadata_index import TrackInfo
+from search_index import SearchIndex
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ra", "su", "to", "vi", "der", "bel", "mon", "tri", "ash", "zen", "qua"]
+QUERIES = ["m", "mo", "mon", "mone", "daft punk", "aro", "bea", "love 7", "zzzz", "beyonce", "mp3"]
+
+
+def fake_word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))
+
+
+def fake_library(count, seed=1):
+    rng = random.Random(seed)
+    artists = [" ".join(fake_word(rng).title() for _ in range(rng.randint(1, 2))) for _ in range(count // 40 + 1)]
+    artists += ["Daft Punk", "Beyoncé"]
+    albums = [" ".join(fake_word(rng).title() for _ in range(rng.randint(1, 3))) for _ in range(count // 10 + 1)]
+    tracks = []
+    for n in range(count):
+        title = " ".join(fake_word(rng) for _ in range(rng.randint(1, 4))).title()
+        if rng.random() < 0.05:
+            title += " Love"
+        path = f"/music/{rng.choice(artists)}/{n % 20 + 1:02d} - {title}.mp3"
+        tagged = rng.random() < 0.8
+        tracks.append((path, TrackInfo(
+            path, 0.0, 0, 200.0,
+            title if tagged else None, rng.choice(artists) if tagged else None, rng.choice(albums), "mp3", 320
+        )))
+    return tracks
+
+
+def timed(action):
+    started = time.perf_counter()
+    result = action()
+    return (time.perf_counter() - started) * 1000, result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    tracks = fake_library(count)
+
+    index = SearchIndex()
+    batch = 200
+    first = 0
+    batches = []
+    indexing = []
+    while first < count:
+        chunk = tracks[first:first + batch]
+        ms, _ = timed(lambda: index.add([path for path, _ in chunk], dict(chunk)))
+        batches.append((len(chunk), ms))
+        # The list screen indexes in slices of a few ms per frame, this is the same work in one go
+        ms, _ = timed(index.index_pending)
+        indexing.append(ms)
+        first += len(chunk)
+        batch *= 4
+    adding = sum(ms for _, ms in batches)
+    total = sum(indexing)
+    print(f"Added {count} tracks in {adding:.0f} ms (largest batch {max(batches)[0]} tracks in {max(batches)[1]:.1f} ms), "
+          f"indexed in {total:.0f} ms ({total * 1000 / count:.1f} us per track)")
+    report_queries(index, "after loading")
+
+    # Popping leaves gaps in the entry ids, positions have to be looked up from then on
+    rng = random.Random(2)
+    pops = [timed(lambda: index.pop(rng.randrange(len(index))))[0] for _ in range(200)]
+    print(f"\npop: mean {statistics.mean(pops):.3f} ms, max {max(pops):.3f} ms")
+    report_queries(index, "after 200 pops")
+
+
+def report_queries(index, label):
+    print(f"\n{label}")
+    print(f"{'query':<12} {'hits':>7} {'mean':>8} {'max':>8}   (per keystroke)")
+    every = []
+    for query in QUERIES:
+        keystrokes = []
+        hits = None
+        for end in range(1, len(query) + 1):
+            ms, hits = timed(lambda: index.search(query[:end]))
+            keystrokes.append(ms)
+        every.extend(keystrokes)
+        print(f"{query:<12} {len(hits or ()):>7} {statistics.mean(keystrokes):>6.2f}ms {max(keystrokes):>6.2f}ms")
+
+    every.sort()
+    print(f"all keystrokes: median {statistics.median(every):.2f} ms, "
+          f"p95 {every[int(len(every) * 0.95)]:.2f} ms, max {every[-1]:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Seek latency against position in the file, plain play(start=...) vs. the seek table.
+
+    python benchmarks/bench_seek.py path/to/long_mix.mp3 [steps]
+
+Runs without a window or a sound card, SDL's dummy audio driver does the decoding.
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pygame import mixer
+
+from seek_index import SpliceReader, build_seek_table
+
+
+def timed(action):
+    started = time.perf_counter()
+    action()
+    return (time.perf_counter() - started) * 1000
+
+
+def plain_seek(path, position):
+    mixer.music.load(path)
+    mixer.music.play(start=position)
+    mixer.music.stop()
+
+
+def table_seek(table, path, position):
+    point, offset = table.find(position)
+    mixer.music.load(SpliceReader(table.header, path, offset), table.kind)
+    mixer.music.play(start=position - point)
+    mixer.music.stop()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+    path = sys.argv[1]
+    steps = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    mixer.init()
+
+    table = None
+
+    def build():
+        nonlocal table
+        table = build_seek_table(path)
+
+    build_ms = timed(build)
+    if table is None:
+        print("No seek table for this file (only MP3 and FLAC with a SEEKTABLE are supported)")
+        return
+
+    duration = table.times[-1]
+    print(f"{path}: {duration:.0f}s, {len(table.times)} seek points, built in {build_ms:.0f} ms "
+          f"({len(table.to_bytes()) / 1024:.0f} KiB cached)")
+    print(f"{'position':>10} {'play(start)':>14} {'seek table':>12}")
+
+    for step in range(steps):
+        position = duration * step / steps
+        plain = timed(lambda: plain_seek(path, position))
+        indexed = timed(lambda: table_seek(table, path, position))
+        print(f"{position:>9.0f}s {plain:>12.1f}ms {indexed:>10.1f}ms")
+
+    mixer.quit()
+
+
+if __name__ == "__main__":
+    main()
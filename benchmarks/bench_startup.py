@@ -0,0 +1,96 @@
+"""
+Cold start of the app, broken down per phase.
+
+    python benchmarks/bench_startup.py [runs]
+
+First the import cost of every heavy dependency on its own (each in a fresh interpreter), then the whole app
+started `runs` times. The app phases come from MusicPlayerApp.mark_startup() and are measured from the moment
+main.py starts importing:
+    imports -> build -> first frame -> mixer ready / session restored
+Run it from a checkout where the app itself starts (assets/ present). Audio goes to SDL's dummy driver.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["kivy.app", "kivy.core.window", "pygame.mixer", "numpy", "mutagen", "tkinter"]
+
+
+def import_cost(module):
+    code = f"import time; t = time.perf_counter(); import {module}; print((time.perf_counter() - t) * 1000)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=child_env(), cwd=ROOT)
+    lines = out.stdout.strip().splitlines()
+    return float(lines[-1]) if out.returncode == 0 and lines else None
+
+
+def child_env():
+    return dict(os.environ, SDL_AUDIODRIVER="dummy", KIVY_NO_ARGS="1", KIVY_NO_CONSOLELOG="1")
+
+
+def run_child(spawned):
+    # Runs inside the child process: start the app, quit as soon as every phase is in
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import main
+    from kivy.clock import Clock
+
+    app = main.MusicPlayerApp()
+    if not os.path.exists(os.path.join(ROOT, "musicplayer.kv")):
+        # Kivy looks for musicplayer.kv by default
+        app.kv_file = os.path.join(ROOT, "MusicPlayerApp.kv")
+
+    def check(dt):
+        times = app.startup_times or {}
+        if "session restored" in times and "mixer ready" in times:
+            app.stop()
+            return False
+
+    Clock.schedule_interval(check, 0.01)
+    Clock.schedule_once(lambda dt: app.stop(), 30)
+    app.run()
+
+    # Interpreter start up, from spawning the process until main.py started importing
+    started_wall = time.time() - (time.perf_counter() - main.STARTED)
+    times = dict(app.startup_times, interpreter=(started_wall - spawned) * 1000)
+    print("STARTUP " + json.dumps(times))
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        run_child(float(sys.argv[2]))
+        return
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print("Import cost, fresh interpreter each")
+    for module in MODULES:
+        cost = import_cost(module)
+        print(f"  {module:<18} {'failed' if cost is None else f'{cost:8.1f} ms'}")
+
+    results = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", repr(time.time())],
+            capture_output=True, text=True, env=child_env(), cwd=ROOT
+        )
+        for line in out.stdout.splitlines():
+            if line.startswith("STARTUP "):
+                results.append(json.loads(line[len("STARTUP "):]))
+        if out.returncode != 0:
+            print(out.stderr[-2000:])
+            return
+
+    print(f"\nApp start up over {len(results)} runs (ms after main.py started importing)")
+    print(f"  {'phase':<18} {'median':>8} {'min':>8} {'max':>8}")
+    phases = sorted(results[0], key=lambda phase: statistics.median(r[phase] for r in results))
+    for phase in phases:
+        values = [r[phase] for r in results if phase in r]
+        print(f"  {phase:<18} {statistics.median(values):8.1f} {min(values):8.1f} {max(values):8.1f}")
+
+
+if __name__ == "__main__":
+    main()
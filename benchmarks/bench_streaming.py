@@ -0,0 +1,117 @@
+"""
+Time to first audio and read stalls when tracks come from a slow place.
+
+    python benchmarks/bench_streaming.py [--latency 0.03] [--rate 4] [--seconds 6]
+
+Part one starts tracks of a synthetic library on the headless PlayerEngine three ways: from the local files, over
+HTTP from media_server.py, and over HTTP with the latency and bandwidth cap of a slow NAS (default 30 ms per
+request and 4 MB/s). Reported is the time from play() until the mixer had played the first bit of the track.
+Part two reads one track through StreamSource at the pace the decoder does, over the slow server and with a few
+prefetch windows, and counts the reads that had to wait for data. Audio goes to SDL's dummy driver.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import perf
+from media_server import MediaServer
+from player_engine import PlayerEngine
+from streaming import BLOCK_SIZE, StreamSource
+from synthetic_library import make_library
+
+# 16 bit stereo at 44.1 kHz, what the decoder eats per second of a WAV
+BYTE_RATE = 44100 * 4
+# One decoder read, and a read slower than STALL had to wait for the source
+READ_SIZE = 16 * 1024
+STALL = 0.005
+
+
+def first_audio(paths, prefetch):
+    perf.recorder.clear()
+    perf.recorder.enabled = True
+    engine = PlayerEngine()
+    engine.prefetch_bytes = prefetch
+    engine.add(paths)
+    engine.start()
+    times = []
+    for index in range(len(paths)):
+        engine.play(index)
+        deadline = time.perf_counter() + 5
+        while engine._awaiting_audio is not None and time.perf_counter() < deadline:
+            time.sleep(0.001)
+        times.append(engine.last_first_audio_ms)
+    engine.shutdown()
+    perf.recorder.enabled = False
+    # The first start also waits for the mixer to open, it isn't about the source
+    return times[1:]
+
+
+def paced_read(url, prefetch, seconds):
+    # Reads like the decoder: READ_SIZE at a time, never faster than the track plays
+    source = StreamSource(url, prefetch)
+    stalls = 0
+    worst = 0.0
+    peak = 0
+    started = time.perf_counter()
+    done = 0
+    while done < BYTE_RATE * seconds:
+        before = time.perf_counter()
+        data = source.read(READ_SIZE)
+        waited = time.perf_counter() - before
+        if not data:
+            break
+        if waited > STALL:
+            stalls += 1
+        worst = max(worst, waited)
+        peak = max(peak, source.buffered())
+        done += len(data)
+        ahead = started + done / BYTE_RATE - time.perf_counter()
+        if ahead > 0:
+            time.sleep(ahead)
+    source.close()
+    return stalls, worst * 1000, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming benchmark")
+    parser.add_argument("--latency", type=float, default=0.03, help="seconds per request of the slow server")
+    parser.add_argument("--rate", type=float, default=4.0, help="MB/s of the slow server")
+    parser.add_argument("--seconds", type=float, default=6.0, help="playback time per prefetch window in part two")
+    args = parser.parse_args()
+
+    folder = os.path.join(tempfile.gettempdir(), "musicplayer-bench", "streaming")
+    paths = make_library(folder, 6, "wav", seconds=60)
+    fast = MediaServer(folder).start()
+    slow = MediaServer(folder, latency=args.latency, rate=args.rate * 1e6).start()
+
+    print(f"Time to first audio, {os.path.getsize(paths[0]) / 1e6:.0f} MB WAV files (ms)")
+    print(f"  {'source':<30} {'median':>8} {'max':>8}")
+    cases = [
+        ("local file", paths),
+        ("http", [fast.url(path) for path in paths]),
+        (f"http, {args.latency * 1000:.0f} ms + {args.rate:g} MB/s", [slow.url(path) for path in paths]),
+    ]
+    for name, sources in cases:
+        times = first_audio(sources, 4 * 1024 * 1024)
+        print(f"  {name:<30} {statistics.median(times):>8.1f} {max(times):>8.1f}")
+
+    print(f"\nReading {args.seconds:g} s of a track at playback speed from the slow server")
+    print(f"  {'prefetch':>10} {'stalls':>8} {'worst wait':>12} {'peak memory':>12}")
+    url = slow.url(paths[0])
+    for prefetch in (BLOCK_SIZE, 1024 * 1024, 4 * 1024 * 1024):
+        stalls, worst, peak = paced_read(url, prefetch, args.seconds)
+        print(f"  {prefetch / 1024:>8.0f}KB {stalls:>8} {worst:>10.1f}ms {peak / 1e6:>10.1f}MB")
+
+    fast.shutdown()
+    slow.shutdown()
+
+
+if __name__ == "__main__":
+    main()
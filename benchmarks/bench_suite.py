@@ -0,0 +1,270 @@
+"""
+The player's hot paths on a generated library, headless, with a check against an earlier run.
+
+    python benchmarks/bench_suite.py [--tracks 200] [--format wav] [--seconds 8] [--no-ui]
+                                     [--save results.json] [--baseline results.json] [--tolerance 0.25]
+
+Cases:
+    scan    folder import into an empty metadata index, then the same folder again with everything indexed
+    engine  track changes and seeks on the headless PlayerEngine (mixer.music.load, play(start=...))
+    ui      the app itself on an offscreen window: add_tracks, refresh_list, search, and the per frame callbacks
+            (update_slider, spectrum, animations) while a track plays. Needs a checkout where the app starts
+            (assets/ present), it is skipped otherwise
+
+The numbers come from the same perf spans the F12 overlay shows, medians and p95 in ms. The library is made by
+synthetic_library.py in the temp folder and reused by later runs with the same arguments. With --baseline, every
+number more than --tolerance slower than the saved run (and at least MIN_REGRESSION_MS) is listed and the exit
+status is 1. Audio goes to SDL's dummy driver, the window (ui case) to the offscreen one when there is no display.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import perf
+from synthetic_library import FORMATS, make_library
+
+# Slower than the baseline by less than this is noise, whatever the percentage
+MIN_REGRESSION_MS = 0.5
+# Spans the ui case reports, the engine ones show up there too but have their own case
+UI_SPANS = ("add_tracks", "refresh_list", "apply_filter", "update_slider", "spectrum frame", "redraw_waveform",
+            "animation", "frame")
+ENGINE_SPANS = ("track change", "music.load", "music.play", "seek", "music.play(start)")
+QUERIES = ["a", "as", "ash", "mon", "zen qua", "01", "zzzz"]
+
+
+def library_folder(args):
+    return os.path.join(tempfile.gettempdir(), "musicplayer-bench", f"{args.format}-{args.tracks}-{args.seconds:g}")
+
+
+def percentiles(name, summary, into, prefix):
+    stats = summary.get(name)
+    if stats:
+        into[f"{prefix}/{name} p50"] = stats["p50"]
+        into[f"{prefix}/{name} p95"] = stats["p95"]
+
+
+# Cases
+
+def bench_scan(library, paths):
+    from kivy.clock import Clock
+
+    from library_scanner import LibraryScanner
+    from metadata_index import MetadataIndex
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        index = MetadataIndex(os.path.join(folder, "library.db"))
+        for run in ("cold", "warm"):
+            got = []
+            first = []
+            finished = []
+            scanner = LibraryScanner(
+                index,
+                on_batch=lambda infos: (first or first.append(time.perf_counter()), got.extend(infos)),
+                on_done=lambda cancelled: finished.append(time.perf_counter())
+            )
+            started = time.perf_counter()
+            scanner.start(library)
+            # No window, the scanner's batches come in through Clock ticks we run ourselves
+            while not finished:
+                Clock.tick()
+            if len(got) != len(paths):
+                raise RuntimeError(f"scan found {len(got)} of {len(paths)} tracks")
+            results[f"scan/{run} import"] = (finished[0] - started) * 1000
+            results[f"scan/{run} first batch"] = (first[0] - started) * 1000
+        index.close()
+    return results
+
+
+def bench_engine(paths, rng):
+    from metadata_index import MetadataIndex
+    from player_engine import PlayerEngine
+    from seek_index import SeekIndex
+
+    perf.recorder.clear()
+    perf.recorder.enabled = True
+    with tempfile.TemporaryDirectory() as folder:
+        index = MetadataIndex(os.path.join(folder, "library.db"))
+        engine = PlayerEngine(index, SeekIndex(index))
+        engine.add(paths)
+        engine.start()
+        engine.play(0)
+        for _ in range(min(len(paths) - 1, 100)):
+            engine.next()
+        for _ in range(100):
+            engine.seek(rng.uniform(0, max(engine.duration - 1, 0)))
+        engine.shutdown()
+        index.close()
+    perf.recorder.enabled = False
+
+    summary = perf.recorder.summary()
+    results = {}
+    for name in ENGINE_SPANS:
+        percentiles(name, summary, results, "engine")
+    return results
+
+
+def bench_ui(paths):
+    if not os.path.exists(os.path.join(ROOT, "assets")):
+        print("ui: skipped, the app needs assets/ to start")
+        return {}
+    env = dict(os.environ, MUSICPLAYER_PERF="1")
+    if not env.get("DISPLAY") and not env.get("WAYLAND_DISPLAY"):
+        env.setdefault("SDL_VIDEODRIVER", "offscreen")
+    with tempfile.TemporaryDirectory() as folder:
+        list_file = os.path.join(folder, "paths.json")
+        with open(list_file, 'w') as f:
+            json.dump(paths, f)
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--ui-child", folder, list_file],
+            capture_output=True, text=True, env=env, cwd=ROOT
+        )
+    for line in out.stdout.splitlines():
+        if line.startswith("SUITE "):
+            summary = json.loads(line[len("SUITE "):])
+            results = {}
+            for name in UI_SPANS:
+                percentiles(name, summary, results, "ui")
+            return results
+    print("ui: the app didn't report back")
+    print(out.stderr[-3000:])
+    return {}
+
+
+def run_ui_child(data_dir, list_file):
+    # Runs inside the child process, the real app with its data (session, config, caches) in a temporary folder
+    os.chdir(ROOT)
+    import main
+    from kivy.clock import Clock
+
+    with open(list_file) as f:
+        paths = json.load(f)
+
+    class BenchApp(main.MusicPlayerApp):
+        user_data_dir = data_dir
+
+    app = BenchApp()
+    app.kv_file = os.path.join(ROOT, "MusicPlayerApp.kv")
+
+    def script():
+        while not app.engine.ready:
+            yield 0.05
+        lists = app.root.get_screen("list")
+        app.root.current = "list"
+        for start in range(0, len(paths), 500):
+            app.add_tracks(paths[start:start + 500])
+            yield 0
+        for _ in range(5):
+            lists.refresh_list()
+            yield 0
+        for query in QUERIES:
+            for end in range(1, len(query) + 1):
+                lists.ids["search_input"].text = query[:end]
+                yield 0
+        lists.ids["search_input"].text = ""
+        lists.select_song(0)
+        yield 3
+        main_screen = app.root.get_screen("main")
+        for step in range(5):
+            main_screen.seek_music(app.engine.duration * step / 6)
+            yield 0.3
+        print("SUITE " + json.dumps(perf.recorder.summary()))
+        app.stop()
+
+    steps = script()
+
+    def tick(dt):
+        try:
+            Clock.schedule_once(tick, next(steps))
+        except StopIteration:
+            pass
+
+    Clock.schedule_once(tick, 0.5)
+    Clock.schedule_once(lambda dt: app.stop(), 120)
+    app.run()
+
+
+# Reporting
+
+def compare(results, baseline, tolerance):
+    # Names of the numbers that got slower than the baseline allows
+    slower = []
+    for name, value in results.items():
+        before = baseline.get(name)
+        if before is not None and value > before * (1 + tolerance) and value - before > MIN_REGRESSION_MS:
+            slower.append(name)
+    return slower
+
+
+def report(results, baseline):
+    print(f"\n{'':<34}{'ms':>10}" + (f"{'baseline':>10}{'change':>9}" if baseline else ""))
+    for name, value in results.items():
+        line = f"{name:<34}{value:>10.2f}"
+        before = baseline.get(name) if baseline else None
+        if before is not None:
+            line += f"{before:>10.2f}{(value - before) / max(before, 1e-6) * 100:>+8.0f}%"
+        print(line)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--ui-child":
+        run_ui_child(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark suite on a synthetic library")
+    parser.add_argument("--tracks", type=int, default=200)
+    parser.add_argument("--format", choices=FORMATS, default="wav")
+    parser.add_argument("--seconds", type=float, default=8.0)
+    parser.add_argument("--no-ui", action="store_true", help="skip the case that starts the app")
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 is 25%%")
+    args = parser.parse_args()
+
+    library = library_folder(args)
+    started = time.perf_counter()
+    try:
+        paths = make_library(library, args.tracks, args.format, args.seconds)
+    except (RuntimeError, subprocess.CalledProcessError) as e:
+        sys.exit(str(e))
+    print(f"{len(paths)} {args.format} tracks in {library} ({time.perf_counter() - started:.1f} s)")
+
+    results = {}
+    results.update(bench_scan(library, paths))
+    results.update(bench_engine(paths, random.Random(1)))
+    if not args.no_ui:
+        results.update(bench_ui(paths))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        if saved["library"] != [args.tracks, args.format, args.seconds]:
+            print(f"baseline was made on a different library {saved['library']}, the numbers won't compare")
+        baseline = saved["results"]
+    report(results, baseline)
+
+    if args.save:
+        perf.write_json(args.save, {"library": [args.tracks, args.format, args.seconds], "results": results})
+    if baseline:
+        slower = compare(results, baseline, args.tolerance)
+        if slower:
+            print(f"\n{len(slower)} slower than the baseline allows: {', '.join(slower)}")
+            sys.exit(1)
+        print(f"\nnothing more than {args.tolerance:.0%} slower than the baseline")
+
+
+if __name__ == "__main__":
+    main()
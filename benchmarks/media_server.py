@@ -0,0 +1,122 @@
+"""
+A stand-in for a media server or a slow NAS: serves a folder over HTTP with Range requests, and can add latency
+and a bandwidth cap to every request.
+
+    python benchmarks/media_server.py folder [--port 8800] [--latency 0.03] [--rate 4]
+
+--latency is seconds per request, --rate MB/s per connection (0 is unlimited). Tracks play from it as
+http://127.0.0.1:8800/<path inside folder>, in an M3U playlist for example. bench_streaming.py runs it in a thread.
+"""
+import argparse
+import email.utils
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+
+CHUNK = 64 * 1024
+RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # Keep alive, like every real media server
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes, with Nagle on that costs a delayed ACK (40 ms) per request
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        relative = unquote(urlsplit(self.path).path).lstrip("/")
+        path = os.path.realpath(os.path.join(server.folder, relative))
+        if not path.startswith(server.folder + os.sep) or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        stat = os.stat(path)
+        size = stat.st_size
+        start, end = 0, size - 1
+        status = 200
+
+        wanted = RANGE.match(self.headers.get("Range", ""))
+        if wanted:
+            first, last = wanted.groups()
+            if first:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            elif last:
+                start = max(0, size - int(last))
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        if server.latency:
+            time.sleep(server.latency)
+        self.send_response(status)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Last-Modified", email.utils.formatdate(stat.st_mtime, usegmt=True))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(CHUNK, remaining))
+                if not data:
+                    break
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(data)
+                if server.rate:
+                    time.sleep(len(data) / server.rate)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class MediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, folder, port=0, latency=0.0, rate=0.0, verbose=False):
+        super().__init__(("127.0.0.1", port), RangeHandler)
+        self.folder = os.path.realpath(folder)
+        self.latency = latency
+        self.rate = rate
+        self.verbose = verbose
+
+    def url(self, path):
+        relative = os.path.relpath(path, self.folder).replace(os.sep, "/")
+        return f"http://127.0.0.1:{self.server_address[1]}/{quote(relative)}"
+
+    def start(self):
+        # In a thread of its own, for the benchmarks
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a folder with Range requests, latency and a bandwidth cap")
+    parser.add_argument("folder")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--rate", type=float, default=0.0, help="MB/s per connection, 0 is unlimited")
+    args = parser.parse_args()
+    server = MediaServer(args.folder, args.port, args.latency, args.rate * 1e6, verbose=True)
+    print(f"Serving {server.folder} on http://127.0.0.1:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+A generated music library for the benchmarks, the same files every time for the same arguments.
+
+    python benchmarks/synthetic_library.py folder [tracks] [--format wav|flac|ogg|mp3] [--seconds 8]
+
+Tracks are laid out like a real collection, Artist/Album/NN - Title.ext with ten tracks per album, and carry
+title, artist, album and track number tags. The audio is a few seeded tones over noise at a different level per
+track, so loudness and the spectrum have something to chew on. WAV is written directly, the compressed formats
+are encoded from it with ffmpeg, which has to be on the PATH for those.
+"""
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import wave
+
+import numpy as np
+
+RATE = 44100
+FORMATS = ("wav", "flac", "ogg", "mp3")
+TRACKS_PER_ALBUM = 10
+SYLLABLES = ["ka", "lo", "mi", "ne", "ra", "su", "to", "vi", "der", "bel", "mon", "tri", "ash", "zen", "qua"]
+
+# Written last, a library without it was interrupted and gets generated again
+COMPLETE = ".complete"
+
+
+def fake_name(rng, words):
+    return " ".join(
+        "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3))).title() for _ in range(rng.randint(*words))
+    )
+
+
+def synth(rng, seconds):
+    # Three tones with a slow wobble over quiet noise, int16 stereo
+    t = np.arange(int(RATE * seconds)) / RATE
+    signal = np.zeros_like(t)
+    for _ in range(3):
+        freq = rng.uniform(80, 2000)
+        signal += np.sin(2 * np.pi * freq * t) * (1 + 0.3 * np.sin(2 * np.pi * rng.uniform(0.1, 2) * t))
+    noise = np.random.default_rng(rng.randrange(1 << 32)).standard_normal(len(t)) * 0.2
+    level = 10 ** (rng.uniform(-24, -6) / 20)
+    left = (signal / 3 + noise) * level
+    right = np.roll(left, rng.randint(0, 200))
+    return (np.clip(np.stack([left, right], axis=1), -1, 1) * 32767).astype(np.int16)
+
+
+def write_wav(path, samples, tags):
+    with wave.open(path, 'wb') as out:
+        out.setnchannels(2)
+        out.setsampwidth(2)
+        out.setframerate(RATE)
+        out.writeframes(samples.tobytes())
+    from mutagen.id3 import TALB, TIT2, TPE1, TRCK
+    from mutagen.wave import WAVE
+    audio = WAVE(path)
+    audio.add_tags()
+    audio.tags.add(TIT2(encoding=3, text=tags["title"]))
+    audio.tags.add(TPE1(encoding=3, text=tags["artist"]))
+    audio.tags.add(TALB(encoding=3, text=tags["album"]))
+    audio.tags.add(TRCK(encoding=3, text=tags["track"]))
+    audio.save()
+
+
+def encode(wav_path, path, tags):
+    metadata = []
+    for key, value in tags.items():
+        metadata += ["-metadata", f"{key}={value}"]
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-i", wav_path, *metadata, path],
+        check=True, stdin=subprocess.DEVNULL
+    )
+
+
+def library_paths(folder, tracks, fmt, seed=1):
+    # (path, tags) for every track, in folder order, nothing gets written
+    rng = random.Random(seed)
+    entries = []
+    for album_number in range((tracks + TRACKS_PER_ALBUM - 1) // TRACKS_PER_ALBUM):
+        artist = fake_name(rng, (1, 2))
+        album = fake_name(rng, (1, 3))
+        for number in range(1, min(TRACKS_PER_ALBUM, tracks - len(entries)) + 1):
+            title = fake_name(rng, (1, 4))
+            name = f"{number:02d} - {title}.{fmt}"
+            path = os.path.join(folder, f"{artist} {album_number:04d}", album, name)
+            entries.append((path, {"title": title, "artist": artist, "album": album, "track": str(number)}))
+    return entries
+
+
+def make_library(folder, tracks, fmt="wav", seconds=8.0, seed=1):
+    """
+    Writes the library into folder and returns the paths in folder order. An existing complete library with the
+    same arguments is reused as it is.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format has to be one of {', '.join(FORMATS)}, not {fmt!r}")
+    if fmt != "wav" and shutil.which("ffmpeg") is None:
+        raise RuntimeError(f"{fmt} files are encoded with ffmpeg, and there is no ffmpeg on the PATH")
+
+    entries = library_paths(folder, tracks, fmt, seed)
+    marker = os.path.join(folder, COMPLETE)
+    stamp = f"{tracks} {fmt} {seconds} {seed}"
+    try:
+        with open(marker) as f:
+            if f.read() == stamp:
+                return [path for path, tags in entries]
+    except OSError:
+        pass
+
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    rng = random.Random(seed)
+    for path, tags in entries:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        samples = synth(rng, seconds)
+        if fmt == "wav":
+            write_wav(path, samples, tags)
+            continue
+        wav_path = path + ".tmp.wav"
+        with wave.open(wav_path, 'wb') as out:
+            out.setnchannels(2)
+            out.setsampwidth(2)
+            out.setframerate(RATE)
+            out.writeframes(samples.tobytes())
+        try:
+            encode(wav_path, path, tags)
+        finally:
+            os.remove(wav_path)
+
+    with open(marker, 'w') as f:
+        f.write(stamp)
+    return [path for path, tags in entries]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic music library")
+    parser.add_argument("folder")
+    parser.add_argument("tracks", type=int, nargs="?", default=100)
+    parser.add_argument("--format", choices=FORMATS, default="wav")
+    parser.add_argument("--seconds", type=float, default=8.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    try:
+        paths = make_library(args.folder, args.tracks, args.format, args.seconds, args.seed)
+    except (RuntimeError, subprocess.CalledProcessError) as e:
+        sys.exit(str(e))
+    size = sum(os.path.getsize(path) for path in paths)
+    print(f"{len(paths)} {args.format} tracks, {size / 1e6:.0f} MB in {args.folder}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,551 @@
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+
+from kivy.clock import Clock
+
+import perf
+from metadata_index import display_title
+from play_queue import REPEAT_MODES
+from player_engine import PAUSED, STOPPED
+
+log = logging.getLogger("player")
+
+# Name of the socket in the app's data folder
+SOCKET_NAME = "control.sock"
+# Seconds of commands the UI thread runs per frame at most, the rest waits for the next frame
+DRAIN_BUDGET = 0.004
+# Commands waiting for the UI thread, past that requests are answered with "busy" right away
+MAX_PENDING = 2000
+# Requests one connection can have in flight before we stop reading from it
+PIPELINE = 64
+# Bytes waiting to go out to a subscriber before its events get dropped, it doesn't read fast enough
+MAX_BACKLOG = 256 * 1024
+# Longest request line or HTTP body
+MAX_REQUEST = 1024 * 1024
+
+# What can be subscribed to
+EVENTS = ("state", "track", "position", "end", "status")
+# Everything else is answered on the network thread
+COMMANDS = ("play", "pause", "toggle", "stop", "next", "previous", "seek", "skip", "volume", "shuffle", "repeat",
+            "enqueue", "status")
+
+HTTP_REQUEST = re.compile(rb"(GET|HEAD|POST|PUT|DELETE|OPTIONS) (\S+) HTTP/1\.[01]\r?\n$")
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found", 413: "Payload Too Large"}
+
+
+def answer(request, result=None, error=None):
+    # {"id": ..., "ok": true, "result": ...}, the id only when the request had one
+    response = {"ok": error is None}
+    if isinstance(request, dict) and "id" in request:
+        response["id"] = request["id"]
+    if error is not None:
+        response["error"] = error
+    elif result is not None:
+        response["result"] = result
+    return response
+
+
+def number(request, key):
+    value = request.get(key)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{key} has to be a number, not {value!r}")
+    return value
+
+
+class ControlClient:
+    # One open connection and the events it subscribed to
+    def __init__(self, writer):
+        self.writer = writer
+        self.events = set()
+        self.dropped = 0
+
+    def send(self, message, event=False):
+        if self.writer.is_closing():
+            return
+        if event and self.writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+            # Events for a client that stopped reading are dropped instead of piling up in our memory
+            self.dropped += 1
+            return
+        self.writer.write(json.dumps(message).encode() + b"\n")
+
+
+class ControlServer:
+    """
+    Remote control for scripts and unattended machines: a Unix socket in the app's data folder, and a port on 127.0.0.1 when one is set (Windows has no sockets in asyncio).
+
+    Every connection speaks JSON lines or HTTP, told apart by its first line.
+    JSON lines: one request per line, {"cmd": "seek", "position": 30, "id": 1} gets {"id": 1, "ok": true} back. A JSON array is a batch, its commands run in order and the answers come back as one array. {"cmd": "subscribe", "events": ["state", "track"]} adds event lines ({"event": "state", "state": "playing"}) to the connection.
+    HTTP: GET /status, POST /command with the same JSON, GET /events?events=state,track streams event lines until the client hangs up. Requests with an Origin header come from a web page and are refused.
+    The network side is an asyncio loop on its own thread. Commands that touch the player queue up for the UI thread, which works through them for at most DRAIN_BUDGET per frame, so a flood of requests makes commands wait but never frames. Status requests and events never get to the UI thread at all, they come from a snapshot the UI thread refreshes when something changes.
+    """
+
+    def __init__(self, app, socket_path=None, port=0):
+        self.app = app
+        self.socket_path = socket_path
+        self.port = port
+        # Where we really listen, the socket gets another name when a second player runs on the machine
+        self.addresses = []
+
+        self._pending = deque()  # (request, future) for the UI thread
+        self._drain_trigger = Clock.create_trigger(self._drain)
+        self._status_trigger = Clock.create_trigger(self._refresh_status)
+        self._status = self._make_status()
+        self._clients = set()  # subscribers
+        self._wanted = set()  # events anybody subscribed to
+        self._position_bound = False
+
+        self._loop = None
+        self._stopping = None
+        self._started = threading.Event()
+        self._thread = None
+
+    @property
+    def main_screen(self):
+        return self.app.root.get_screen("main")
+
+    # Lifetime, on the UI thread
+
+    def start(self):
+        engine = self.app.engine
+        engine.bind(on_ready=self._drain_trigger, on_state=self._on_state, on_track=self._on_track,
+                    on_track_end=self._on_track_end)
+        self.main_screen.bind(volume=self._status_trigger, shuffle=self._status_trigger, repeat=self._status_trigger)
+        self.app.bind(playlist=self._status_trigger)
+        self._thread = threading.Thread(target=self._run, daemon=True, name="control server")
+        self._thread.start()
+
+    def stop(self):
+        engine = self.app.engine
+        engine.unbind(on_ready=self._drain_trigger, on_state=self._on_state, on_track=self._on_track,
+                      on_track_end=self._on_track_end, on_position=self._on_position)
+        self.main_screen.unbind(volume=self._status_trigger, shuffle=self._status_trigger,
+                                repeat=self._status_trigger)
+        self.app.unbind(playlist=self._status_trigger)
+        self._drain_trigger.cancel()
+        self._status_trigger.cancel()
+        if self._thread is None:
+            return
+        if self._started.wait(1):
+            self._loop.call_soon_threadsafe(self._stopping.set)
+        self._thread.join(1)
+        self._thread = None
+
+    # Commands, on the UI thread
+
+    @perf.timed("control commands")
+    def _drain(self, *args):
+        if not self.app.engine.ready:
+            # Commands would wait for the mixer right here on the UI thread, on_ready brings us back
+            return
+        deadline = time.perf_counter() + DRAIN_BUDGET
+        answers = []
+        while self._pending:
+            request, future = self._pending.popleft()
+            answers.append((future, self._execute(request)))
+            if time.perf_counter() > deadline:
+                break
+        if self._pending:
+            self._drain_trigger()
+        # Status requests after these commands see what they did
+        self._refresh_status()
+        # One hop to the network thread for all of them
+        self._call_soon(self._resolve, answers)
+
+    def _execute(self, request):
+        try:
+            return answer(request, getattr(self, "do_" + request["cmd"])(request))
+        except ValueError as e:
+            return answer(request, error=str(e))
+        except Exception as e:
+            log.error(f"Control: {request['cmd']} failed: {e}")
+            return answer(request, error=f"{type(e).__name__}: {e}")
+
+    def _index(self, request):
+        index = request.get("index")
+        if isinstance(index, bool) or not isinstance(index, int) or not 0 <= index < len(self.app.playlist):
+            raise ValueError(f"index has to be a playlist position from 0 to {len(self.app.playlist) - 1}, not {index!r}")
+        return index
+
+    def do_play(self, request):
+        # Resumes or starts, never restarts what is already playing. With an index, that track from the start
+        engine = self.app.engine
+        if "index" in request:
+            engine.play(self._index(request))
+        elif engine.state == PAUSED:
+            engine.resume()
+        elif engine.state == STOPPED:
+            engine.play()
+
+    def do_pause(self, request):
+        self.app.engine.pause()
+
+    def do_toggle(self, request):
+        self.app.engine.toggle()
+
+    def do_stop(self, request):
+        self.app.engine.stop()
+
+    def do_next(self, request):
+        self.main_screen.next_song()
+
+    def do_previous(self, request):
+        self.main_screen.prev_song()
+
+    def do_seek(self, request):
+        self.main_screen.seek_music(max(number(request, "position"), 0))
+
+    def do_skip(self, request):
+        self.app.engine.skip(number(request, "seconds"))
+        self.main_screen.update_slider(0)
+
+    def do_volume(self, request):
+        # The slider follows, and hands it to the engine like a drag would
+        self.main_screen.volume = min(max(number(request, "volume"), 0.0), 1.0)
+
+    def do_shuffle(self, request):
+        # Without "on" it flips, like the button
+        on = request.get("on", not self.main_screen.shuffle)
+        if not isinstance(on, bool):
+            raise ValueError(f"on has to be true or false, not {on!r}")
+        self.main_screen.shuffle = on
+
+    def do_repeat(self, request):
+        if "mode" not in request:
+            self.main_screen.cycle_repeat()
+        elif request["mode"] in REPEAT_MODES:
+            self.main_screen.repeat = request["mode"]
+        else:
+            raise ValueError(f"mode has to be one of {REPEAT_MODES}, not {request['mode']!r}")
+
+    def do_enqueue(self, request):
+        # {"paths": [...]} (or "path") at the end of the playlist. "next": true plays them after the current track,
+        # "play": true starts the first one right away
+        paths = request.get("paths", [request["path"]] if "path" in request else None)
+        if not paths or not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            raise ValueError("paths has to be a list of file paths or URLs")
+        engine = self.app.engine
+        first = len(self.app.playlist)
+        self.app.add_tracks([path.replace('\\', '/') for path in paths])
+        play = bool(request.get("play"))
+        if play:
+            engine.play(first)
+        if request.get("next"):
+            # "Play next" puts every track in front of the others, backwards keeps them in order
+            for index in reversed(range(first + play, first + len(paths))):
+                engine.play_next(index)
+        return {"index": first, "count": len(paths)}
+
+    def do_status(self, request):
+        # Inside a batch, in order with the other commands
+        self._refresh_status()
+        return self.status()
+
+    # Status and events
+
+    def _make_status(self):
+        engine = self.app.engine
+        main_screen = self.main_screen
+        loaded = bool(engine.path)
+        return {
+            "state": engine.state,
+            "index": engine.index if loaded else None,
+            "path": engine.path or None,
+            "title": display_title(engine.info, engine.path) if loaded else None,
+            "duration": engine.duration,
+            "volume": main_screen.volume,
+            "shuffle": main_screen.shuffle,
+            "repeat": main_screen.repeat,
+            "tracks": len(self.app.playlist),
+        }
+
+    def _refresh_status(self, *args):
+        status = self._make_status()
+        if status != self._status:
+            # A new dict, the network thread may be reading the old one right now
+            self._status = status
+            self._emit("status", **status)
+
+    def status(self):
+        # Any thread. The snapshot with the position of right now
+        return dict(self._status, position=round(self.app.engine.position(), 3))
+
+    def _emit(self, event, **data):
+        # UI thread -> subscribers. Nothing crosses over for events nobody asked for
+        if event in self._wanted:
+            self._call_soon(self._publish, dict(event=event, **data))
+
+    def _on_state(self, state):
+        self._emit("state", state=state)
+        self._status_trigger()
+
+    def _on_track(self, index, path, info):
+        self._emit("track", index=index, path=path, title=display_title(info, path),
+                   duration=info.duration if info else 0)
+        self._status_trigger()
+
+    def _on_position(self, seconds):
+        self._emit("position", position=round(seconds, 3))
+
+    def _on_track_end(self, path):
+        self._emit("end", path=path)
+
+    def _call_soon(self, callback, *args):
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # The loop is closed, we are shutting down
+            pass
+
+    # Network thread
+
+    def _run(self):
+        # asyncio is a noticeable import as well, it comes in here and not at start up
+        import asyncio
+        self._asyncio = asyncio
+        self._loop = asyncio.new_event_loop()
+        self._stopping = asyncio.Event()
+        self._started.set()
+        try:
+            self._loop.run_until_complete(self._serve())
+        except Exception as e:
+            log.error(f"Control: the server stopped: {e}")
+        finally:
+            self._loop.close()
+
+    async def _serve(self):
+        asyncio = self._asyncio
+        servers = []
+        socket_path = None
+        if self.socket_path and hasattr(asyncio, "start_unix_server"):
+            try:
+                socket_path = self._free_socket_path(self.socket_path)
+                servers.append(await asyncio.start_unix_server(self._connection, socket_path, limit=MAX_REQUEST))
+                # Only our own user gets to drive the player
+                os.chmod(socket_path, 0o600)
+                self.addresses.append(socket_path)
+            except OSError as e:
+                log.error(f"Control: could not listen on {self.socket_path}: {e}")
+                socket_path = None
+        if self.port:
+            try:
+                servers.append(await asyncio.start_server(self._connection, "127.0.0.1", self.port, limit=MAX_REQUEST))
+                self.addresses.append(f"127.0.0.1:{self.port}")
+            except OSError as e:
+                log.error(f"Control: could not listen on port {self.port}, another player on it? {e}")
+        if self.addresses:
+            log.info(f"Control: listening on {', '.join(self.addresses)}")
+
+        await self._stopping.wait()
+        for server in servers:
+            server.close()
+        for client in list(self._clients):
+            client.writer.close()
+        for server in servers:
+            await server.wait_closed()
+        # Connections that are still open end here, closing the loop under them leaves their tasks hanging
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if socket_path:
+            try:
+                os.remove(socket_path)
+            except OSError:
+                pass
+
+    def _free_socket_path(self, path):
+        # A socket file is either left behind by a player that crashed (it goes) or has another player behind it,
+        # then that one keeps it and we add our process id to the name
+        if not os.path.exists(path):
+            return path
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.remove(path)
+            return path
+        finally:
+            probe.close()
+        root, extension = os.path.splitext(path)
+        return f"{root}-{os.getpid()}{extension}"
+
+    async def _connection(self, reader, writer):
+        try:
+            first = await reader.readline()
+            request = HTTP_REQUEST.match(first)
+            if request:
+                await self._serve_http(reader, writer, request.group(1).decode(), request.group(2).decode("latin-1"))
+            else:
+                await self._serve_lines(reader, writer, first)
+        except (ConnectionError, EOFError, ValueError, self._asyncio.CancelledError):
+            # Hung up, a line longer than MAX_REQUEST, or the server stopping. Cancelled connections end quietly,
+            # asyncio logs the ones that don't as errors
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_lines(self, reader, writer, line):
+        client = ControlClient(writer)
+        # Requests are read (and queued up) while earlier ones are still waiting for the UI thread,
+        # the answers go out in order. A full queue stops the reading, the sender feels it as a full socket
+        answers = self._asyncio.Queue(PIPELINE)
+        sender = self._loop.create_task(self._send_answers(client, answers))
+        try:
+            while line:
+                if line.strip():
+                    await answers.put(self._submit(line, client))
+                line = await reader.readline()
+            await answers.put(None)
+            await sender
+        finally:
+            sender.cancel()
+            self._unsubscribe(client)
+
+    async def _send_answers(self, client, answers):
+        try:
+            while True:
+                future = await answers.get()
+                if future is None:
+                    return
+                client.send(await future)
+                await client.writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _serve_http(self, reader, writer, method, target):
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+            if len(headers) > 100:
+                raise ValueError("too many headers")
+        if "origin" in headers:
+            # A web page in a browser on this machine, not a script. Pages don't get to drive the player
+            await self._http_answer(writer, 403, answer(None, error="requests from web pages are refused"))
+            return
+
+        url = urlsplit(target)
+        if method == "GET" and url.path == "/status":
+            await self._http_answer(writer, 200, answer(None, self.status()))
+        elif method == "POST" and url.path == "/command":
+            length = int(headers.get("content-length", 0))
+            if length > MAX_REQUEST:
+                await self._http_answer(writer, 413, answer(None, error="request too long"))
+                return
+            response = await self._submit(await reader.readexactly(length), None)
+            await self._http_answer(writer, 200 if isinstance(response, list) or response["ok"] else 400, response)
+        elif method == "GET" and url.path == "/events":
+            events = parse_qs(url.query).get("events", [",".join(EVENTS)])[0].split(",")
+            client = ControlClient(writer)
+            response = self._subscribe({"events": events}, client, True)
+            if not response["ok"]:
+                await self._http_answer(writer, 400, response)
+                return
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+            client.send(response)
+            try:
+                # Events go out until the client hangs up
+                while await reader.read(4096):
+                    pass
+            finally:
+                self._unsubscribe(client)
+        else:
+            await self._http_answer(writer, 404, answer(None, error=f"no {method} {url.path}"))
+
+    async def _http_answer(self, writer, status, response):
+        body = json.dumps(response).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    def _done(self, response):
+        future = self._loop.create_future()
+        future.set_result(response)
+        return future
+
+    def _submit(self, data, client):
+        # A future with the answer to one line (or HTTP body): an object, or an array for a batch
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return self._done(answer(None, error="not JSON"))
+        if not isinstance(message, list):
+            return self._request(message, client)
+        if len(self._pending) + len(message) > MAX_PENDING:
+            # All of a batch or nothing
+            return self._done([answer(request, error="busy") for request in message])
+        return self._asyncio.gather(*[self._request(request, client, batch=True) for request in message])
+
+    def _request(self, request, client, batch=False):
+        if not isinstance(request, dict) or not isinstance(request.get("cmd"), str):
+            return self._done(answer(request, error='a request is an object with a "cmd"'))
+        command = request["cmd"]
+        if command in ("subscribe", "unsubscribe"):
+            if client is None:
+                return self._done(answer(request, error="subscriptions need a connection that stays open, GET /events"))
+            return self._done(self._subscribe(request, client, command == "subscribe"))
+        if command == "status" and not batch:
+            return self._done(answer(request, self.status()))
+        if command not in COMMANDS:
+            return self._done(answer(request, error=f"no command {command!r}"))
+        if len(self._pending) >= MAX_PENDING:
+            return self._done(answer(request, error="busy"))
+        future = self._loop.create_future()
+        self._pending.append((request, future))
+        self._drain_trigger()
+        return future
+
+    def _resolve(self, answers):
+        for future, response in answers:
+            # A client that hung up doesn't wait for its answer anymore
+            if not future.done():
+                future.set_result(response)
+
+    def _subscribe(self, request, client, on):
+        events = request.get("events", list(EVENTS) if on else list(client.events))
+        if isinstance(events, str):
+            events = [events]
+        if not isinstance(events, list) or any(event not in EVENTS for event in events):
+            return answer(request, error=f"events has to be a list out of {EVENTS}")
+        if on:
+            client.events.update(events)
+            self._clients.add(client)
+        else:
+            client.events.difference_update(events)
+        self._update_listeners()
+        return answer(request, {"events": sorted(client.events), "status": self.status()})
+
+    def _unsubscribe(self, client):
+        if client in self._clients:
+            self._clients.discard(client)
+            self._update_listeners()
+
+    def _update_listeners(self):
+        self._wanted = set().union(*(client.events for client in self._clients))
+        # The engine only reports the position while somebody listens
+        if ("position" in self._wanted) != self._position_bound:
+            self._position_bound = not self._position_bound
+            if self._position_bound:
+                self.app.engine.bind(on_position=self._on_position)
+            else:
+                self.app.engine.unbind(on_position=self._on_position)
+
+    def _publish(self, data):
+        for client in list(self._clients):
+            if data["event"] in client.events:
+                client.send(data, event=True)
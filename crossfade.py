@@ -0,0 +1,110 @@
+import importlib.util
+import os
+import struct
+import wave
+
+from seek_index import SpliceReader
+
+# The fade-out is baked into the samples, that needs NumPy. Without it tracks just change gaplessly
+HAVE_NUMPY = importlib.util.find_spec("numpy") is not None
+
+# Longest crossfade the settings allow, in seconds
+MAX_CROSSFADE = 12.0
+
+# The fade curve is worked out this many frames at a time, so the float temporaries stay small
+CURVE_BLOCK = 1 << 16
+
+
+def fade_out(x):
+    # Equal power: fade_out(x)² + fade_in(x)² == 1, the two tracks together stay as loud as one
+    import numpy as np
+    return np.cos(x * (np.pi / 2))
+
+
+def fade_in(x):
+    import math
+    return math.sin(min(max(x, 0.0), 1.0) * (math.pi / 2))
+
+
+def wav_tail(path, position):
+    # PCM WAV needs no seek table, the byte offset of any frame is plain arithmetic.
+    # The header in front gets the size of what is left, so the decoder doesn't expect more
+    with open(path, 'rb') as f:
+        reader = wave.open(f)
+        channels, width, rate, frames = reader.getnchannels(), reader.getsampwidth(), reader.getframerate(), reader.getnframes()
+        data_start = f.tell()
+    frame = min(int(position * rate), frames)
+    block = channels * width
+    size = (frames - frame) * block
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + size, b"WAVE", b"fmt ", 16, 1, channels, rate, rate * block, block, width * 8, b"data", size
+    )
+    return SpliceReader(header, path, data_start + frame * block), frame / rate
+
+
+def open_tail(path, position, seek_index):
+    # (file object starting at or a little before position, the time it starts at), None if we can't get there
+    # without decoding the whole file
+    if os.path.splitext(path)[1].lower() == ".wav":
+        try:
+            return wav_tail(path, position)
+        except (OSError, EOFError, wave.Error):
+            return None
+    spliced = seek_index.open_at(path, position) if seek_index else None
+    if spliced is None:
+        return None
+    source, point, namehint = spliced
+    return source, point
+
+
+def load_tail(path, start, end, seek_index):
+    """
+    The end of a track from `start` to `end` (seconds) as a pygame Sound, with an equal power fade out over it.
+
+    Only the part after the nearest seek point gets decoded, so a crossfade out of an hour long FLAC holds a few seconds
+    of samples, not the whole file. Returns None when that isn't possible (no seek table for the file, no NumPy, decoder
+    errors), the caller then changes tracks without a fade.
+    """
+    if not HAVE_NUMPY:
+        return None
+    opened = open_tail(path, start, seek_index)
+    if opened is None:
+        return None
+    source, point = opened
+
+    import numpy as np
+    from pygame import mixer, sndarray
+    try:
+        sound = mixer.Sound(file=source)
+    except Exception:
+        return None
+    finally:
+        source.close()
+
+    rate = mixer.get_init()[0]
+    samples = sndarray.samples(sound)
+    length = int((end - start) * rate)
+    skip = max(0, int((start - point) * rate))
+    samples = samples[skip:skip + length]
+    if not len(samples) or length <= 0:
+        return None
+
+    # Straight into the decoded samples, block by block
+    for first in range(0, len(samples), CURVE_BLOCK):
+        block = samples[first:first + CURVE_BLOCK]
+        curve = fade_out(np.arange(first, first + len(block)) / length)
+        if block.ndim > 1:
+            curve = curve[:, None]
+        block[...] = block * curve
+    return sndarray.make_sound(np.ascontiguousarray(samples))
+
+
+def skip_start(sound, seconds):
+    # The same Sound without its first `seconds`, None when nothing is left. A copy of what is left, a few seconds
+    import numpy as np
+    from pygame import mixer, sndarray
+    samples = sndarray.samples(sound)[int(seconds * mixer.get_init()[0]):]
+    if not len(samples):
+        return None
+    return sndarray.make_sound(np.ascontiguousarray(samples))
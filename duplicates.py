@@ -0,0 +1,599 @@
+import hashlib
+import importlib.util
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from loudness import lower_priority
+from streaming import is_url
+
+log = logging.getLogger("player")
+
+# Without NumPy only the cheap checks run: the same file twice, and copies with the same size, length and tags
+HAVE_NUMPY = importlib.util.find_spec("numpy") is not None
+
+# Tracks whose lengths differ by more than this (seconds) are not the same recording, they never get compared
+DURATION_SLACK = 2.0
+
+# Fingerprint: one 32 bit number per FRAME_STEP (46 ms) of the first FINGERPRINT_SECONDS, from the spectrum
+# between LOW_HZ and HIGH_HZ of a mono FINGERPRINT_RATE signal. 30 s make 2.6 KB per track in the database
+FINGERPRINT_RATE = 11025
+FINGERPRINT_SECONDS = 30
+FRAME_SIZE = 4096
+FRAME_STEP = 512
+BANDS = 33
+LOW_HZ = 300
+HIGH_HZ = 2000
+
+# Index: every track adds ANCHORS of its frames (every ANCHOR_STEP-th from ANCHOR_START on, after the intro)
+# to KEY_TABLES tables, keyed by KEY_BITS bits of the frame. Re-encodes get about a fifth of the bits wrong, so
+# a 10 bit key comes through about every tenth time and 128 keys give a dozen votes. A query looks at
+# MAX_SHIFT frames (1.5 s) either side, that much silence more or less in front is still the same track
+ANCHORS = 32
+ANCHOR_STEP = 2
+ANCHOR_START = 64
+KEY_BITS = 10
+KEY_TABLES = 4
+TABLE_BITS = 2
+MAX_SHIFT = 32
+# Fingerprints are shorter than 1 << FRAME_BITS frames, a posting is track << FRAME_BITS | frame
+FRAME_BITS = 10
+# Length buckets (DURATION_SLACK wide) share the 32 bit keys with the table and the frame bits
+MAX_BUCKET = (1 << (32 - KEY_BITS - TABLE_BITS)) - 1
+
+# Bits of a frame that make up its key in each table. A few tables, so a frame is found as long as one of its
+# bit sets came through. Seeded, the same in every process and every session
+KEY_BIT_SETS = [random.Random(table).sample(range(32), KEY_BITS) for table in range(KEY_TABLES)]
+
+# A (track, offset) pair needs this many votes to get compared bit by bit, unrelated tracks hardly ever get 2
+MIN_VOTES = 5
+# Keys with more postings than this (silence, a drone half the library shares) say nothing and are skipped
+STOP_POSTINGS = 2048
+# Best voted tracks that get compared per query
+MAX_CANDIDATES = 8
+# Unrelated tracks disagree on about half the bits, re-encodes of one recording on 5 to 25%
+MATCH_BER = 0.35
+# Frames two fingerprints have to overlap by (3 s), shorter tracks don't get one
+MIN_FRAMES = ANCHORS * ANCHOR_STEP
+
+# Index levels: the last one takes new postings until it has LEVEL_SIZE of them, a level is merged into the one
+# before it once it's more than 1/LEVEL_FANOUT of its size
+LEVEL_SIZE = 1 << 14
+LEVEL_FANOUT = 8
+
+# Bytes from the middle of two files that agree on size, length and tags compared before calling them copies.
+# Untagged WAVs of the same length have the same size too
+SAMPLE_BYTES = 64 * 1024
+
+# Paths the background thread takes off the queue at once, checked against the database in one query
+QUEUE_CHUNK = 64
+# Decoding is the expensive part, a big library is worth a few processes. One core stays for the player
+FINGERPRINT_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+# Seconds between two on_change calls while a big batch is worked through
+PUBLISH_INTERVAL = 1.0
+
+
+def copy_key(info):
+    # Size, length and tags. Files that agree on all three are most likely copies of one file, content_sample()
+    # tells for sure without decoding anything
+    tags = "\0".join((value or "").strip().lower() for value in (info.artist, info.title, info.album))
+    return info.size, round(info.duration, 1), hashlib.sha1(tags.encode("utf-8")).digest()[:8]
+
+
+def content_sample(path):
+    # Hash of SAMPLE_BYTES from the middle of the file, None if it can't be read
+    try:
+        with open(path, 'rb') as file:
+            file.seek(max(0, os.fstat(file.fileno()).st_size // 2 - SAMPLE_BYTES // 2))
+            return hashlib.sha1(file.read(SAMPLE_BYTES)).digest()
+    except OSError:
+        return None
+
+
+def length_bucket(duration):
+    return min(int(duration // DURATION_SLACK), MAX_BUCKET)
+
+
+def fingerprint(samples, rate):
+    """
+    Fingerprint of int16 samples shaped (frames, channels) as a uint32 array, None if there are less than MIN_FRAMES.
+
+    The Philips (and chromaprint) idea: the spectrum of every frame is cut into BANDS bands on a log scale, and every bit says whether the energy difference of two neighbouring bands grew or shrank since the previous frame. Re-encoding, another bit rate, volume and EQ leave most bits alone, two unrelated tracks agree on about half of them.
+    """
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+    factor = max(1, rate // FINGERPRINT_RATE)
+    mono = samples[:(FINGERPRINT_SECONDS * rate // factor + FRAME_SIZE) * factor].astype(np.float32).mean(axis=1)
+    # Averaging blocks of 4 is a crude low pass, but everything above HIGH_HZ gets thrown away anyway
+    mono = mono[:len(mono) // factor * factor].reshape(-1, factor).mean(axis=1)
+    if len(mono) < FRAME_SIZE + FRAME_STEP * MIN_FRAMES:
+        return None
+
+    frames = sliding_window_view(mono, FRAME_SIZE)[::FRAME_STEP] * np.hanning(FRAME_SIZE).astype(np.float32)
+    power = np.square(np.abs(np.fft.rfft(frames, axis=1)))
+    edges = np.geomspace(LOW_HZ, HIGH_HZ, BANDS + 1)
+    band = np.searchsorted(edges, np.fft.rfftfreq(FRAME_SIZE, factor / rate)) - 1
+    inside = np.nonzero((band >= 0) & (band < BANDS))[0]
+    bands = np.zeros((power.shape[1], BANDS), dtype=np.float32)
+    bands[inside, band[inside]] = 1
+    energy = np.log(power @ bands + 1e-3)
+
+    slope = energy[:, :-1] - energy[:, 1:]
+    bits = (slope[1:] - slope[:-1]) > 0
+    return (bits.astype(np.uint32) << np.arange(32, dtype=np.uint32)).sum(axis=1, dtype=np.uint32)
+
+
+def fingerprint_file(path):
+    # Runs in the worker process. Returns the database row, the fingerprint is None for files that can't be
+    # decoded or are too short, they aren't tried again until they change
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    import numpy as np
+    from audio_decode import decode_chunks
+    try:
+        # Only the start gets decoded, a bit more than FINGERPRINT_SECONDS for the last frame to fill up
+        pieces = list(decode_chunks(path, FINGERPRINT_SECONDS + 1))
+    except Exception:
+        return path, stat.st_mtime, stat.st_size, None
+    if not pieces:
+        return path, stat.st_mtime, stat.st_size, None
+    samples, rate = np.concatenate([samples for samples, rate in pieces]), pieces[0][1]
+    prints = fingerprint(samples, rate)
+    return path, stat.st_mtime, stat.st_size, None if prints is None else prints.astype("<u4").tobytes()
+
+
+def bit_error_rate(prints, other, offset):
+    # Share of the bits that differ with frame `offset` of prints lined up with the start of other, 1.0 if they
+    # overlap by less than MIN_FRAMES
+    import numpy as np
+    if offset >= 0:
+        prints = prints[offset:]
+    else:
+        other = other[-offset:]
+    count = min(len(prints), len(other))
+    if count < MIN_FRAMES:
+        return 1.0
+    differ = np.bitwise_xor(prints[:count], other[:count])
+    return np.unpackbits(differ.view(np.uint8)).sum() / (count * 32)
+
+
+def same_recording(prints, other, offset):
+    # The offset the index voted for can be off by one, a shift of half a frame splits the votes
+    return min(bit_error_rate(prints, other, offset + step) for step in (-1, 0, 1)) <= MATCH_BER
+
+
+def anchor_frames(count):
+    # Frames of a fingerprint with `count` frames that go into the index, earlier ones for short tracks
+    import numpy as np
+    start = max(0, min(ANCHOR_START, count - ANCHORS * ANCHOR_STEP))
+    return np.arange(start, min(count, start + ANCHORS * ANCHOR_STEP), ANCHOR_STEP)
+
+
+def lookup_keys(prints, bucket):
+    # Keys of every frame in every table, shaped (KEY_TABLES, frames)
+    import numpy as np
+    shifts = np.array(KEY_BIT_SETS, dtype=np.uint32)
+    bits = (prints[None, :, None] >> shifts[:, None, :]) & 1
+    keys = (bits << np.arange(KEY_BITS, dtype=np.uint32)).sum(axis=2, dtype=np.uint32)
+    keys |= np.arange(KEY_TABLES, dtype=np.uint32)[:, None] << KEY_BITS
+    keys |= np.uint32(bucket) << (KEY_BITS + TABLE_BITS)
+    return keys
+
+
+def merge_postings(keys, values, new_keys, new_values):
+    # Sorted postings with new ones put in their place, a copy instead of sorting everything again
+    import numpy as np
+    order = np.argsort(new_keys, kind="stable")
+    at = np.searchsorted(keys, new_keys[order], "right")
+    return np.insert(keys, at, new_keys[order]), np.insert(values, at, new_values[order])
+
+
+class FingerprintIndex:
+    """
+    Finds the tracks a fingerprint may belong to without comparing it with every track.
+
+    Postings (lookup key -> track and frame) of the anchor frames of every track sit in sorted arrays, a query is a searchsorted of the keys of its own frames around the same spot. Every hit votes for a (track, offset) pair, only pairs with MIN_VOTES are worth comparing. The length bucket is part of the key, so a query only ever meets the tracks of about its length, a small share of any real library.
+    The postings are kept in levels, each at most 1/LEVEL_FANOUT the size of the one before it. New ones go into the last and smallest level, a level that outgrows its share is merged into the one before, so adding stays cheap at any size and a query searches a handful of arrays.
+    """
+
+    def __init__(self):
+        import numpy as np
+        self._levels = [(np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32))]
+
+    def __len__(self):
+        # Postings
+        return sum(len(keys) for keys, values in self._levels)
+
+    @property
+    def nbytes(self):
+        return sum(keys.nbytes + values.nbytes for keys, values in self._levels)
+
+    def add(self, track, prints, bucket):
+        import numpy as np
+        frames = anchor_frames(len(prints))
+        # Silence has all bits 0, every quiet intro would vote for every other
+        frames = frames[prints[frames] != 0]
+        keys = lookup_keys(prints[frames], bucket)
+        values = np.broadcast_to((np.uint32(track) << FRAME_BITS) | frames.astype(np.uint32), keys.shape)
+
+        levels = self._levels
+        levels[-1] = merge_postings(*levels[-1], keys.ravel(), values.ravel())
+        while len(levels) > 1 and len(levels[-1][0]) * LEVEL_FANOUT > len(levels[-2][0]):
+            last = levels.pop()
+            levels[-1] = merge_postings(*levels[-1], *last)
+        if len(levels[-1][0]) >= LEVEL_SIZE:
+            levels.append((levels[-1][0][:0], levels[-1][1][:0]))
+
+    def query(self, prints, bucket):
+        # {track: (offset, votes)} for every track with MIN_VOTES for one offset. The offset is the frame of
+        # prints that lines up with the start of the track
+        import numpy as np
+        anchors = anchor_frames(len(prints))
+        frames = np.arange(max(0, anchors[0] - MAX_SHIFT), min(len(prints), anchors[-1] + MAX_SHIFT + 1))
+        frames = frames[prints[frames] != 0]
+        buckets = range(max(0, bucket - 1), min(bucket + 1, MAX_BUCKET) + 1)
+        keys = np.concatenate([lookup_keys(prints[frames], near) for near in buckets], axis=1).ravel()
+        key_frames = np.tile(frames, KEY_TABLES * len(buckets))
+        # In order, the searches then walk through the big arrays instead of jumping around in them
+        order = np.argsort(keys)
+        keys = keys[order]
+        key_frames = key_frames[order]
+
+        tracks = []
+        offsets = []
+        for sorted_keys, values in self._levels:
+            low = np.searchsorted(sorted_keys, keys, "left")
+            counts = np.searchsorted(sorted_keys, keys, "right") - low
+            counts[counts > STOP_POSTINGS] = 0
+            total = int(counts.sum())
+            if not total:
+                continue
+            # Positions of all hits at once: every key's range, laid end to end
+            starts = np.cumsum(counts) - counts
+            hits = values[np.repeat(low - starts, counts) + np.arange(total)]
+            tracks.append(hits >> FRAME_BITS)
+            offsets.append(np.repeat(key_frames, counts) - (hits & ((1 << FRAME_BITS) - 1)).astype(np.int64))
+        if not tracks:
+            return {}
+
+        span = 2 << FRAME_BITS
+        pairs, votes = np.unique(
+            np.concatenate(tracks).astype(np.int64) * span + np.concatenate(offsets) + (1 << FRAME_BITS),
+            return_counts=True
+        )
+        # Half a frame of shift splits the votes between two neighbouring offsets
+        neighbours = pairs[1:] == pairs[:-1] + 1
+        votes[:-1][neighbours] += votes[1:][neighbours]
+        found = {}
+        for pair, count in zip(pairs[votes >= MIN_VOTES].tolist(), votes[votes >= MIN_VOTES].tolist()):
+            track, offset = divmod(pair, span)
+            if count > found.get(track, (0, 0))[1]:
+                found[track] = (offset - (1 << FRAME_BITS), count)
+        return found
+
+
+class DuplicateFinder:
+    """
+    Finds the tracks of the playlist that are in it already as another file: a copy, another format or bit rate, another rip.
+
+    Cheap checks come first. Files with the same size, length and tags (from the metadata database) are copies and never get decoded. Only tracks with another one of about the same length get a fingerprint, made by worker processes at idle priority and kept in the database, and only those of about the same length get compared with it, through a FingerprintIndex. Tracks found to be the same form a group, the one added first is the original and the others are its duplicates.
+    add() and remove() follow the playlist, a path that is in it twice counts twice (the same file twice is the caller's to spot, nothing here is needed for that).
+    on_change(paths) is called on the background thread with the set of duplicates whenever it changes, while a big batch is worked through at most every PUBLISH_INTERVAL.
+    """
+
+    def __init__(self, index, on_change=None):
+        self.index = index
+        self.on_change = on_change
+
+        self._present = {}  # path -> how often it's in the playlist
+        self._order = {}  # path -> when it was added, the earliest of a group is the original
+        self._added = 0
+        self._queue = deque()
+        self._removed = []  # Gone from the playlist, the background thread takes them out of the checks
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._pool = None
+
+        # Only the background thread touches these
+        self._cheap = {}  # path -> (copy key, length bucket), None for tracks that can't be checked
+        self._checked = set()  # Paths taking part in the checks right now
+        self._holders = {}  # copy key -> paths with it
+        self._samples = {}  # path -> content_sample(), only for paths whose copy key isn't theirs alone
+        self._stand_ins = set()  # Paths that get compared by sound, their copies don't need to be
+        self._lengths = {}  # length bucket -> stand ins of that length
+        self._lonely = {}  # length bucket -> stand ins with no other of about their length, not compared yet
+        self._ids = {}  # path -> track number in the fingerprint index
+        self._paths = []  # and back
+        self._same = {}  # path -> paths found to be the same recording
+        self._fingerprints = FingerprintIndex() if HAVE_NUMPY else None
+        self._unsaved = {}  # path -> fingerprint made but not in the database yet
+        self._changed = False
+        self._published = 0.0
+
+    def add(self, paths):
+        with self._lock:
+            for path in paths:
+                count = self._present.get(path, 0)
+                if not count:
+                    self._order[path] = self._added
+                    self._added += 1
+                    self._queue.append(path)
+                self._present[path] = count + 1
+        self._start()
+
+    def remove(self, path):
+        with self._lock:
+            if path not in self._present:
+                return
+            count = self._present[path] - 1
+            if count > 0:
+                self._present[path] = count
+                return
+            self._present.pop(path, None)
+            self._order.pop(path, None)
+            self._removed.append(path)
+        self._start()
+
+    def clear(self):
+        # The playlist got replaced. Fingerprints and what was found stay known for the next one
+        with self._lock:
+            self._removed.extend(self._present)
+            self._present.clear()
+            self._order.clear()
+            self._queue.clear()
+        self._start()
+
+    def shutdown(self):
+        with self._lock:
+            self._stopped = True
+            self._queue.clear()
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+        self._wake.set()
+
+    def _start(self):
+        self._wake.set()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            paths, removed = self._take()
+            if paths is None:
+                return
+            compare = []
+            for path in removed:
+                compare += self._uncheck(path)
+            compare += self._check(paths)
+            if compare and self._fingerprints is not None:
+                self._compare(compare)
+            self._publish()
+
+    def _take(self):
+        # The next chunk of added paths and everything removed since the last one. None once shut down
+        with self._lock:
+            if self._stopped:
+                return None, None
+            removed, self._removed = self._removed, []
+            paths = []
+            while self._queue and len(paths) < QUEUE_CHUNK:
+                paths.append(self._queue.popleft())
+            if not self._queue and not paths and not removed:
+                self._wake.clear()
+            return paths, removed
+
+    def _check(self, paths):
+        # Cheap checks for a chunk of added tracks, returns the ones that need comparing by sound
+        self._describe([path for path in paths if path not in self._cheap])
+        compare = []
+        for path in paths:
+            with self._lock:
+                present = path in self._present
+            if present and path not in self._checked:
+                compare += self._check_one(path)
+        return compare
+
+    def _describe(self, paths):
+        # Copy key and length bucket of tracks seen for the first time, from the database where it's up to date.
+        # Web tracks would have to be downloaded, they are left out
+        known = self.index.lookup_many(paths)
+        for path in paths:
+            self._cheap[path] = None
+            if is_url(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            info = known.get(path)
+            if not self.index.is_fresh(info, stat):
+                info = self.index.get(path)
+            if info is not None and info.duration > 0:
+                self._cheap[path] = copy_key(info), length_bucket(info.duration)
+
+    def _check_one(self, path):
+        self._checked.add(path)
+        if path in self._same:
+            # Back in the playlist, what was found for it before counts again
+            self._changed = True
+        cheap = self._cheap.get(path)
+        if cheap is None:
+            return []
+        holders = self._holders.setdefault(cheap[0], [])
+        copies = [holder for holder in holders if self._is_copy(path, holder)]
+        for holder in copies:
+            self._link(path, holder)
+        holders.append(path)
+        # A copy sounds like whatever its stand in sounds like, it doesn't need a fingerprint of its own
+        return [] if copies else self._stand_in(path)
+
+    def _is_copy(self, path, other):
+        for each in (path, other):
+            if each not in self._samples:
+                self._samples[each] = content_sample(each)
+        return self._samples[path] is not None and self._samples[path] == self._samples[other]
+
+    def _stand_in(self, path):
+        # Counts the track for its length, returns what has something of about its length to compare with now
+        self._stand_ins.add(path)
+        bucket = self._cheap[path][1]
+        self._lengths[bucket] = self._lengths.get(bucket, 0) + 1
+        near = (bucket - 1, bucket, bucket + 1)
+        if sum(self._lengths.get(other, 0) for other in near) == 1:
+            self._lonely.setdefault(bucket, set()).add(path)
+            return []
+        compare = [path]
+        for other in near:
+            compare.extend(self._lonely.pop(other, ()))
+        return compare
+
+    def _uncheck(self, path):
+        # Takes a removed track out of the checks, returns a copy that stands in for it now
+        if path not in self._checked:
+            return []
+        self._checked.discard(path)
+        if path in self._same:
+            self._changed = True
+        cheap = self._cheap.get(path)
+        if cheap is None:
+            return []
+        key, bucket = cheap
+        holders = self._holders[key]
+        holders.remove(path)
+        if not holders:
+            del self._holders[key]
+        if path not in self._stand_ins:
+            return []
+        self._stand_ins.discard(path)
+        self._lengths[bucket] -= 1
+        if not self._lengths[bucket]:
+            del self._lengths[bucket]
+        self._lonely.get(bucket, set()).discard(path)
+        for holder in holders:
+            if holder not in self._stand_ins and self._is_copy(holder, path):
+                return self._stand_in(holder)
+        return []
+
+    def _compare(self, paths):
+        # Fingerprints from the database where they're up to date, the others from the worker processes
+        paths = [path for path in dict.fromkeys(paths) if path not in self._ids]
+        rows = self.index.lookup_fingerprints(paths)
+        stale = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            row = rows.get(path)
+            if row and row[0] == stat.st_mtime and row[1] == stat.st_size:
+                self._match(path, row[2])
+            else:
+                stale.append(path)
+        if not stale:
+            return
+
+        try:
+            futures = [self._get_pool().submit(fingerprint_file, path) for path in stale]
+        except RuntimeError:
+            return
+        made = []
+        try:
+            for future in as_completed(futures):
+                if self._stopped:
+                    return
+                try:
+                    row = future.result()
+                except Exception as e:
+                    log.warning(f"Duplicates: could not fingerprint a track: {e}")
+                    continue
+                if row is not None:
+                    made.append(row)
+                    self._unsaved[row[0]] = row[3]
+                    self._match(row[0], row[3])
+        finally:
+            # One transaction for the chunk
+            if made and not self._stopped:
+                self.index.store_fingerprints(made)
+            self._unsaved.clear()
+
+    def _match(self, path, data):
+        # Compares a fingerprint with the ones of about the same length, then adds it to the index
+        import numpy as np
+        if data is None or path in self._ids:
+            return
+        prints = np.frombuffer(data, dtype="<u4")
+        if len(prints) < MIN_FRAMES:
+            return
+        key, bucket = self._cheap[path]
+
+        found = self._fingerprints.query(prints, bucket)
+        best = sorted(found.items(), key=lambda item: item[1][1], reverse=True)[:MAX_CANDIDATES]
+        candidates = {
+            self._paths[track]: offset for track, (offset, votes) in best
+            if abs(self._cheap[self._paths[track]][0][1] - key[1]) <= DURATION_SLACK
+        }
+        others = {other: row[2] for other, row in self.index.lookup_fingerprints(candidates).items()}
+        others.update((other, self._unsaved[other]) for other in candidates if other in self._unsaved)
+        for other, offset in candidates.items():
+            data = others.get(other)
+            if data and same_recording(prints, np.frombuffer(data, dtype="<u4"), offset):
+                self._link(path, other)
+
+        self._ids[path] = len(self._paths)
+        self._paths.append(path)
+        self._fingerprints.add(self._ids[path], prints, bucket)
+
+    def _link(self, path, other):
+        self._same.setdefault(path, set()).add(other)
+        self._same.setdefault(other, set()).add(path)
+        self._changed = True
+
+    def _publish(self):
+        if not self._changed or self.on_change is None:
+            return
+        if self._queue and time.monotonic() - self._published < PUBLISH_INTERVAL:
+            return
+        self._changed = False
+        self._published = time.monotonic()
+        self.on_change(self._duplicates())
+
+    def _duplicates(self):
+        # Every track in the playlist that is the same as one added before it, group by group
+        found = set()
+        seen = set()
+        with self._lock:
+            order = self._order
+            for path in self._same:
+                if path in seen or path not in order:
+                    continue
+                seen.add(path)
+                group = [path]
+                for member in group:
+                    for other in self._same[member]:
+                        if other not in seen and other in order:
+                            seen.add(other)
+                            group.append(other)
+                if len(group) > 1:
+                    group.sort(key=order.get)
+                    found.update(group[1:])
+        return frozenset(found)
+
+    def _get_pool(self):
+        # Started on first use, a library that is fingerprinted already never needs it
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("shut down")
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=FINGERPRINT_WORKERS, initializer=lower_priority)
+            return self._pool
@@ -0,0 +1,95 @@
+from kivy.metrics import dp
+from kivy.properties import NumericProperty
+from kivy.uix.recyclelayout import RecycleLayout
+
+
+class FixedRowOpts:
+    # Stands in for RecycleLayout.view_opts. Every row has the same size, so the options
+    # of a row are worked out when asked for instead of keeping one dict per row around
+
+    def __init__(self, layout, count):
+        self.layout = layout
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        layout = self.layout
+        row_height = layout.row_height
+        return {
+            'size': [layout.width, row_height],
+            'size_hint': [None, None],
+            'size_hint_min': [None, None],
+            'size_hint_max': [None, None],
+            'pos': (layout.x, layout.top - (index + 1) * row_height),
+            'pos_hint': {},
+            'viewclass': layout.viewclass,
+            'width_none': False,
+            'height_none': False,
+        }
+
+
+class FixedRowLayout(RecycleLayout):
+    """
+    Vertical RecycleView layout for rows that all have the same height.
+
+    RecycleBoxLayout walks every row whenever the data changes, which gets slow with a 100k track playlist. Here a row's place is just its index times row_height, so adding, removing or changing rows only costs as much as the rows on screen.
+    """
+
+    row_height = NumericProperty(dp(50))
+
+    def __init__(self, **kwargs):
+        self._laid_out = None
+        super().__init__(**kwargs)
+
+    def attach_recycleview(self, rv):
+        super().attach_recycleview(rv)
+        if rv:
+            self.fbind('row_height', rv.refresh_from_data)
+
+    def detach_recycleview(self):
+        if self.recycleview:
+            self.funbind('row_height', self.recycleview.refresh_from_data)
+        super().detach_recycleview()
+
+    def compute_sizes_from_data(self, data, flags):
+        # Any data change means the rows on screen get filled in again, nothing else to do
+        self.clear_layout()
+        self.view_opts = FixedRowOpts(self, len(data))
+
+    def compute_layout(self, data, flags):
+        self.height = len(data) * self.row_height
+
+        # A new width or height moves every visible row, so they get laid out again
+        laid_out = (self.width, self.height, self.row_height)
+        if laid_out != self._laid_out:
+            self._laid_out = laid_out
+            self.clear_layout()
+
+    def compute_visible_views(self, data, viewport):
+        if not data:
+            return []
+        x, y, w, h = viewport
+        first = self.get_view_index_at((x, y + h))
+        last = self.get_view_index_at((x, y))
+        return list(range(first, last + 1))
+
+    def get_view_index_at(self, pos):
+        count = len(self.view_opts)
+        if not count or not self.row_height:
+            return 0
+        index = int((self.top - pos[1]) // self.row_height)
+        return max(0, min(index, count - 1))
+
+    def goto_view(self, index):
+        rv = self.recycleview
+        count = len(self.view_opts)
+        if rv is None or not 0 <= index < count:
+            return
+        # Scroll so the row sits at the top of the view, or as close as the list allows
+        scrollable = self.height - rv.height
+        if scrollable > 0:
+            rv.scroll_y = max(0, min(1, 1 - index * self.row_height / scrollable))
@@ -0,0 +1,198 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from kivy.clock import Clock
+
+from metadata_index import probe_file
+
+AUDIO_EXTENSIONS = {".mp3", ".wav", ".flac", ".ogg"}
+
+# How many files we hand to one worker at a time, and how many we push to the UI at once
+# (collected over several chunks, the last batch of a scan is whatever is left)
+PROBE_CHUNK = 64
+BATCH_SIZE = 500
+
+
+def probe_chunk(paths):
+    # Runs inside a worker process, so it must stay a plain top-level function
+    infos = []
+    for path in paths:
+        info = probe_file(path)
+        if info is not None:
+            infos.append(info)
+    return infos
+
+
+def walk_audio_files(root):
+    # os.walk would stat everything twice, scandir hands us the entries directly.
+    # Plain stack instead of recursion, some libraries are nested really deep.
+    # Entries are sorted by name so the playlist comes out in the same order as the folders.
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = sorted(it, key=lambda entry: entry.name.lower())
+        except OSError:
+            # Permission denied and friends, skip that folder and keep going
+            continue
+
+        subfolders = []
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subfolders.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                    yield entry.path.replace('\\', '/'), entry.stat()
+            except OSError:
+                continue
+
+        # Reversed, so the first subfolder is the next one popped
+        stack.extend(reversed(subfolders))
+
+
+class LibraryScanner:
+    """
+    Imports a whole folder tree without freezing the UI.
+
+    One background thread walks the folders, tags are read in a process pool (files the metadata index already knows are not probed at all), and the results come back to the Kivy thread in batches through Clock.schedule_once.
+    Callbacks always run on the Kivy thread:
+        on_batch(infos)                  -> list of TrackInfo to add
+        on_progress(done, seen, walking) -> counters, walking is False once the folder walk is finished
+        on_done(cancelled)
+    Nothing more arrives through on_batch once cancel() was called, batches already on their way are dropped.
+    """
+
+    def __init__(self, index, on_batch, on_progress=None, on_done=None, workers=None):
+        self.index = index
+        self.on_batch = on_batch
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.workers = workers or os.cpu_count() or 2
+
+        self.done = 0
+        self.seen = 0
+        self.walking = False
+        self._batch = []  # Infos collected for the next on_batch
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, root):
+        if self.running:
+            return
+        self.done = 0
+        self.seen = 0
+        self.walking = True
+        self._batch = []
+        self._cancel.clear()
+        self._thread = threading.Thread(target=self._run, args=(root,), daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _run(self, root):
+        # Chunks stay in walk order, a chunk is only handed to the UI once every chunk before it is done
+        pending = deque()
+        pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            chunk = []
+            for entry in walk_audio_files(root):
+                if self._cancel.is_set():
+                    break
+                chunk.append(entry)
+                self.seen += 1
+                if len(chunk) >= PROBE_CHUNK:
+                    pending.append(self._dispatch(pool, chunk))
+                    chunk = []
+                    self._collect(pending, block=False)
+
+                # Don't let the walker run miles ahead of the workers, keeps memory flat
+                while len(pending) >= self.workers * 2 and not self._cancel.is_set():
+                    self._collect(pending, block=True)
+
+            if chunk and not self._cancel.is_set():
+                pending.append(self._dispatch(pool, chunk))
+            self.walking = False
+            self._report_progress()
+
+            while pending and not self._cancel.is_set():
+                self._collect(pending, block=True)
+            if not self._cancel.is_set():
+                self._flush()
+        finally:
+            self.walking = False
+            pool.shutdown(wait=False, cancel_futures=True)
+            cancelled = self._cancel.is_set()
+            if self.on_done:
+                Clock.schedule_once(lambda dt: self.on_done(cancelled), 0)
+
+    def _dispatch(self, pool, chunk):
+        # 1. Files the index already has an up to date row for need no work at all
+        paths = [path for path, stat in chunk]
+        known = self.index.lookup_many(paths)
+        stale = []
+        for path, stat in chunk:
+            if not self.index.is_fresh(known.get(path), stat):
+                known.pop(path, None)
+                stale.append(path)
+
+        # 2. Everything else gets probed by a worker process
+        future = pool.submit(probe_chunk, stale) if stale else None
+        return paths, known, future
+
+    def _collect(self, pending, block):
+        while pending:
+            paths, known, future = pending[0]
+            if future is not None:
+                if not block and not future.done():
+                    return
+                try:
+                    probed = future.result()
+                except Exception:
+                    probed = []
+                if probed:
+                    self.index.store_many(probed)
+                known.update((info.path, info) for info in probed)
+
+            pending.popleft()
+            infos = [known[path] for path in paths if path in known]
+            if infos:
+                self._emit(infos)
+            # Blocking only ever waits for the oldest chunk
+            block = False
+
+    def _emit(self, infos):
+        # Full batches go out, the rest waits for the next chunks
+        self._batch.extend(infos)
+        while len(self._batch) >= BATCH_SIZE:
+            self._send(self._batch[:BATCH_SIZE])
+            self._batch = self._batch[BATCH_SIZE:]
+        self._report_progress()
+
+    def _flush(self):
+        # End of the scan, whatever is left
+        if self._batch:
+            self._send(self._batch)
+            self._batch = []
+            self._report_progress()
+
+    def _send(self, batch):
+        self.done += len(batch)
+        Clock.schedule_once(lambda dt: self._deliver(batch), 0)
+
+    def _deliver(self, batch):
+        # On the Kivy thread. A scan cancelled after this was scheduled doesn't add anything anymore
+        if not self._cancel.is_set():
+            self.on_batch(batch)
+
+    def _report_progress(self):
+        if self.on_progress:
+            done, seen, walking = self.done, self.seen, self.walking
+            Clock.schedule_once(lambda dt: self.on_progress(done, seen, walking), 0)
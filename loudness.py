@@ -0,0 +1,376 @@
+import importlib.util
+import logging
+import math
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+log = logging.getLogger("player")
+
+# Tracks without ReplayGain tags are measured with NumPy, without it only the tags are used
+HAVE_NUMPY = importlib.util.find_spec("numpy") is not None
+
+# Loudness every track is brought to, the ReplayGain 2.0 reference level
+TARGET_LUFS = -18.0
+
+# EBU R128 integrated loudness: energy in 400 ms blocks that overlap by 75%, so a block is 4 steps of 100 ms.
+# Blocks below -70 LUFS are silence, blocks more than 10 LU below the average of the rest are quiet passages,
+# neither counts
+STEP_SECONDS = 0.1
+STEPS_PER_BLOCK = 4
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+# FFT size for the K-weighting filter, and how much of every window it needs to settle (a few ms would do)
+FILTER_WINDOW = 1 << 16
+FILTER_OVERLAP = 1 << 13
+
+# Paths the background thread takes off the queue at once, checked against the database in one query
+QUEUE_CHUNK = 64
+
+GAIN_VALUE = re.compile(r"[-+]?\d+(?:\.\d+)?")
+
+
+def tag_text(value):
+    # One string out of whatever the tag format stores: ID3 frames, lists of strings, MP4 bytes
+    value = getattr(value, "text", value)
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else ""
+    if isinstance(value, bytes):
+        value = value.decode("latin-1", "replace")
+    return str(value)
+
+
+def read_replaygain(path):
+    """
+    Track gain in dB from the file's ReplayGain tags, None if it has none.
+
+    Mutagen names them differently per format ("TXXX:REPLAYGAIN_TRACK_GAIN" in ID3, "replaygain_track_gain" in
+    Vorbis comments, "----:com.apple.iTunes:replaygain_track_gain" in MP4), the last part of the key is the same.
+    The album gain is only used when there is no track gain, the queue mixes albums anyway.
+    """
+    from mutagen import File
+    try:
+        audio = File(path)
+    except Exception:
+        return None
+    if audio is None or not audio.tags:
+        return None
+
+    found = {}
+    try:
+        for key, value in audio.tags.items():
+            key = key.lower()
+            if key == "rva2:track":
+                found.setdefault("replaygain_track_gain", value.gain)
+                continue
+            name = key.rsplit(":", 1)[-1]
+            if name in ("replaygain_track_gain", "replaygain_album_gain"):
+                match = GAIN_VALUE.search(tag_text(value))
+                if match:
+                    found[name] = float(match.group())
+    except Exception:
+        return None
+    return found.get("replaygain_track_gain", found.get("replaygain_album_gain"))
+
+
+def k_weighting(rate, size):
+    # Frequency response of the BS.1770 K-weighting (a high shelf, then a high pass) at the bins of an rfft of
+    # `size` samples. The filter coefficients are worked out for the sample rate like libebur128 does,
+    # the 48 kHz ones from the standard only fit 48 kHz
+    import numpy as np
+    z = np.exp(-1j * 2 * np.pi * np.fft.rfftfreq(size))
+
+    k = math.tan(math.pi * 1681.974450955533 / rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf_b = ((vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0)
+    shelf_a = (1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0)
+
+    k = math.tan(math.pi * 38.13547087602444 / rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    pass_b = (1, -2, 1)
+    pass_a = (1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0)
+
+    response = np.ones_like(z)
+    for b, a in ((shelf_b, shelf_a), (pass_b, pass_a)):
+        response *= (b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)
+    return response.astype(np.complex64)
+
+
+class LoudnessMeter:
+    """
+    EBU R128 integrated loudness of a track that comes in piece by piece through add(), result() in LUFS once it is all there.
+
+    The filter is a multiplication in the frequency domain instead of a loop over the samples. The signal is cut into overlapping windows that all go through one rfft call (overlap-save), the first FILTER_OVERLAP samples of every window are where the filter is still settling and get thrown away. Short FFTs are a lot faster than one over the whole track. What doesn't fill a window yet waits for the next piece, together with the FILTER_OVERLAP samples before it, so where the pieces are cut makes no difference. Only the energy of every 100 ms step is kept for the whole track.
+    """
+
+    def __init__(self, rate, channels):
+        import numpy as np
+        self.step = int(rate * STEP_SECONDS)
+        self.response = k_weighting(rate, FILTER_WINDOW)
+        # Samples not filtered yet, after the FILTER_OVERLAP samples that come before them (silence at the start)
+        self.pending = np.zeros((FILTER_OVERLAP, channels), dtype=np.float32)
+        self.frames = 0
+        self.energy = np.zeros(0)  # Filtered energy of the samples that don't make up a whole step yet
+        self.powers = []  # Mean square of every 100 ms step, summed over the channels
+
+    def add(self, samples):
+        import numpy as np
+        self.frames += len(samples)
+        self.pending = np.concatenate([self.pending, samples.astype(np.float32)])
+        self._filter((len(self.pending) - FILTER_OVERLAP) // (FILTER_WINDOW - FILTER_OVERLAP))
+
+    def result(self):
+        # Loudness in LUFS, None for silence or less than one block
+        import numpy as np
+        hop = FILTER_WINDOW - FILTER_OVERLAP
+        # Whatever is left gets padded with silence to a whole window, like the end of the track always was
+        left = len(self.pending) - FILTER_OVERLAP
+        if left > 0:
+            windows = -(-left // hop)
+            padding = np.zeros((FILTER_OVERLAP + windows * hop - len(self.pending), self.pending.shape[1]), np.float32)
+            self.pending = np.concatenate([self.pending, padding])
+            self._filter(windows)
+        steps = self.frames // self.step
+        if steps < STEPS_PER_BLOCK:
+            return None
+        power = np.concatenate(self.powers)[:steps] if self.powers else np.zeros(0)
+        power = np.pad(power, (0, steps - len(power)))
+
+        blocks = np.convolve(power, np.ones(STEPS_PER_BLOCK) / STEPS_PER_BLOCK, mode="valid")
+        with np.errstate(divide="ignore"):
+            levels = -0.691 + 10 * np.log10(blocks)
+        blocks, levels = blocks[levels > ABSOLUTE_GATE], levels[levels > ABSOLUTE_GATE]
+        if not blocks.size:
+            return None
+        threshold = -0.691 + 10 * math.log10(blocks.mean()) + RELATIVE_GATE
+        return -0.691 + 10 * math.log10(blocks[levels > threshold].mean())
+
+    def _filter(self, windows):
+        # Runs the first `windows` windows of pending through the filter, keeps the rest for later
+        import numpy as np
+        from numpy.lib.stride_tricks import sliding_window_view
+        if windows <= 0:
+            return
+        hop = FILTER_WINDOW - FILTER_OVERLAP
+        used = self.pending[:FILTER_OVERLAP + windows * hop]
+        energy = np.zeros(windows * hop)
+        for channel in range(used.shape[1]):
+            spectrum = np.fft.rfft(sliding_window_view(used[:, channel], FILTER_WINDOW)[::hop], axis=1)
+            spectrum *= self.response
+            filtered = np.fft.irfft(spectrum, FILTER_WINDOW, axis=1)[:, FILTER_OVERLAP:].reshape(-1)
+            del spectrum
+            # Front channels all weigh 1, only surround ones would count more
+            energy += np.square(filtered / 32768)
+            del filtered
+        self.pending = self.pending[windows * hop:].copy()
+
+        energy = np.concatenate([self.energy, energy])
+        steps = len(energy) // self.step
+        self.powers.append(energy[:steps * self.step].reshape(steps, self.step).mean(axis=1))
+        self.energy = energy[steps * self.step:]
+
+
+def integrated_loudness(samples, rate):
+    # EBU R128 integrated loudness in LUFS of int16 samples shaped (frames, channels) that are all in memory,
+    # None for silence
+    meter = LoudnessMeter(rate, samples.shape[1])
+    meter.add(samples)
+    return meter.result()
+
+
+def measure_gain(path):
+    # Gain in dB that brings the file to TARGET_LUFS, None if it's silent or can't be decoded.
+    # The track is decoded piece by piece, a 3 hour mix needs no more memory than a song
+    from audio_decode import decode_chunks
+    meter = None
+    try:
+        for samples, rate in decode_chunks(path):
+            if meter is None:
+                meter = LoudnessMeter(rate, samples.shape[1])
+            meter.add(samples)
+    except Exception:
+        return None
+    loudness = meter.result() if meter is not None else None
+    return None if loudness is None else TARGET_LUFS - loudness
+
+
+def analyze_file(path):
+    # Runs in the worker process. Returns the database row, None when there is nothing worth remembering.
+    # Tags first, they are much cheaper than decoding the whole file
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    gain = read_replaygain(path)
+    if gain is None:
+        if not HAVE_NUMPY:
+            # Maybe next time, once NumPy is there
+            return None
+        gain = measure_gain(path)
+    return path, stat.st_mtime, stat.st_size, gain
+
+
+def lower_priority():
+    # Worker process initializer, the analysis only gets the CPU time nobody else wants
+    try:
+        if hasattr(os, "nice"):
+            os.nice(19)
+        else:
+            import ctypes
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), 0x40)  # IDLE_PRIORITY_CLASS
+    except Exception:
+        pass
+
+
+class LoudnessAnalyzer:
+    """
+    ReplayGain style gain for every track, read from its tags or measured once and kept in the metadata database.
+
+    analyze() queues a batch (the whole playlist as it comes in), one background thread works through it with a single worker process at idle priority. gain() answers from memory or the database, a track it doesn't know yet jumps the queue, so the one that is about to play gets measured next.
+    on_gain(path, gain) is called on the background thread for every track that gets a gain, gain is None when it couldn't be measured.
+    """
+
+    def __init__(self, index, on_gain=None):
+        self.index = index
+        self.on_gain = on_gain
+
+        self._gains = {}  # path -> gain in dB (or None), everything known this session
+        self._queue = deque()  # Batch work, in playlist order
+        self._urgent = deque()  # Asked for by gain(), done first
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._pool = None
+
+    def gain(self, path):
+        # Gain in dB if the track has been measured, None otherwise
+        with self._lock:
+            if path in self._gains:
+                return self._gains[path]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        row = self.index.lookup_gains([path]).get(path)
+        if row and row[0] == stat.st_mtime and row[1] == stat.st_size:
+            with self._lock:
+                self._gains[path] = row[2]
+            return row[2]
+
+        with self._lock:
+            if path not in self._urgent:
+                self._urgent.append(path)
+        self._start()
+        return None
+
+    def analyze(self, paths):
+        with self._lock:
+            self._queue.extend(paths)
+        self._start()
+
+    def clear(self):
+        # Drops the queued batch work, what's measured stays known
+        with self._lock:
+            self._queue.clear()
+
+    def shutdown(self):
+        with self._lock:
+            self._stopped = True
+            self._queue.clear()
+            self._urgent.clear()
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+        self._wake.set()
+
+    def _start(self):
+        self._wake.set()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            paths = self._take()
+            if paths is None:
+                return
+            if not paths:
+                continue
+
+            stale = self._stale(paths)
+            while stale and not self._stopped:
+                if self._urgent and len(paths) > 1:
+                    # Somebody is waiting for a track, the rest of the batch goes back to the front of the queue
+                    with self._lock:
+                        self._queue.extendleft(reversed(stale))
+                    break
+                self._measure(stale.pop(0))
+
+    def _take(self):
+        # The next urgent path, or the next chunk of the batch. None once shut down
+        with self._lock:
+            if self._stopped:
+                return None
+            if self._urgent:
+                path = self._urgent.popleft()
+                return [] if path in self._gains else [path]
+            paths = []
+            while self._queue and len(paths) < QUEUE_CHUNK:
+                path = self._queue.popleft()
+                if path not in self._gains:
+                    paths.append(path)
+            if not self._queue and not self._urgent and not paths:
+                self._wake.clear()
+            return paths
+
+    def _stale(self, paths):
+        # Remembers what the database already has (and is still up to date), returns the rest
+        rows = self.index.lookup_gains(paths)
+        stale = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            row = rows.get(path)
+            if row and row[0] == stat.st_mtime and row[1] == stat.st_size:
+                with self._lock:
+                    self._gains[path] = row[2]
+            elif path not in stale:
+                stale.append(path)
+        return stale
+
+    def _measure(self, path):
+        try:
+            row = self._get_pool().submit(analyze_file, path).result()
+        except Exception as e:
+            if not self._stopped:
+                log.warning(f"Loudness: could not analyze {path}: {e}")
+            return
+        if row is None or self._stopped:
+            return
+        self.index.store_gains([row])
+        gain = row[3]
+        with self._lock:
+            self._gains[path] = gain
+        if self.on_gain:
+            self.on_gain(path, gain)
+
+    def _get_pool(self):
+        # Started on first use, a library that is measured already never needs it
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("shut down")
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=1, initializer=lower_priority)
+            return self._pool
@@ -1,24 +1,107 @@
+import json
 import os
 import random
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# Start up timeline, MusicPlayerApp.mark_startup() logs every phase relative to this
+STARTED = time.perf_counter()
+
 from kivy.animation import Animation
 from kivy.app import App
 from kivy.clock import Clock
-from kivy.properties import NumericProperty, ListProperty
+from kivy.core.window import Window
+from kivy.logger import Logger
+from kivy.properties import NumericProperty, ListProperty, BooleanProperty, ObjectProperty, OptionProperty, StringProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
+from kivy.uix.popup import Popup
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.uix.screenmanager import Screen, ScreenManager
-from pygame import mixer
-from mutagen import File
-import tkinter as tk
-from tkinter import filedialog
 from kivy.core.text import LabelBase
 
-mixer.init()
+import fixed_row_layout  # noqa: F401, registers FixedRowLayout for the kv file
+import perf
+from album_art import ArtCache, art_texture
+from control_server import SOCKET_NAME, ControlServer
+from crossfade import MAX_CROSSFADE
+from duplicates import DuplicateFinder
+from library_scanner import LibraryScanner
+from loudness import LoudnessAnalyzer
+from metadata_index import MetadataIndex, display_title
+from perf_overlay import PerfOverlay
+from play_queue import REPEAT_MODES, REPEAT_OFF
+from player_engine import PlayerEngine
+from playlists import NATIVE_EXTENSION, PlaylistLoader, playlist_file, saved_playlists, write_m3u, write_native
+from search_index import SearchIndex
+from seek_index import SeekIndex
+from spectrum import HAVE_NUMPY, SpectrumAnalyzer
+from streaming import BLOCK_SIZE, PREFETCH_BYTES
+from waveform import PeakCache
+
+IMPORTED = time.perf_counter()
+
+# The settings screen (F1), Kivy builds it from this and stores the values in the app's config file
+SETTINGS = json.dumps([
+    {"type": "bool", "title": "Normalize loudness", "section": "playback", "key": "normalize",
+     "desc": "Play every track at the same loudness, from its ReplayGain tags or measured in the background"},
+    {"type": "numeric", "title": "Crossfade", "section": "playback", "key": "crossfade",
+     "desc": "Seconds the end of a track overlaps the start of the next one, 0 to 12, 0 turns it off"},
+    {"type": "numeric", "title": "Read-ahead", "section": "playback", "key": "prefetch",
+     "desc": "Megabytes of every track read ahead of playback, more helps with slow network drives and servers"},
+])
+# Second panel, see control_server.py
+CONTROL_SETTINGS = json.dumps([
+    {"type": "bool", "title": "Remote control", "section": "control", "key": "enabled",
+     "desc": f"Scripts on this machine can drive the player through {SOCKET_NAME} in the app's data folder"},
+    {"type": "numeric", "title": "Remote control port", "section": "control", "key": "port",
+     "desc": "Also on this port of 127.0.0.1 (HTTP or JSON lines, the only way on Windows), 0 turns it off"},
+])
+# Third panel, see duplicates.py
+LIBRARY_SETTINGS = json.dumps([
+    {"type": "bool", "title": "Find duplicates", "section": "library", "key": "duplicates",
+     "desc": "Mark tracks that are in the playlist already, also as another file, format or rip. "
+             "Tracks of about the same length get compared by how they sound, in the background"},
+])
+
+MEGABYTE = 1024 * 1024
+# Largest read-ahead the settings allow, in MB. Every open track (the current and the next one) holds that much
+MAX_PREFETCH = 64
+
+# Seconds after the first frame until the library database drops rows of files that are gone, start up is over by then
+PRUNE_DELAY = 30
+
+# Key code of F12, shows the performance overlay (Ctrl+F12 saves the timings)
+F12 = 293
+
+
+def prefetch_bytes(megabytes):
+    # Read-ahead setting in MB -> bytes, at least one block
+    return int(min(max(megabytes, 0), MAX_PREFETCH) * MEGABYTE) or BLOCK_SIZE
+
+
+def ask_with_dialog(ask, **options):
+    # tkinter is only imported the first time a dialog opens, most starts never need it
+    import tkinter as tk
+    from tkinter import filedialog
+
+    # 1. Create a hidden Tkinter root window.
+    # We only need the file dialog of tkinter, but a blank window (root) would pop up with it, withdraw hides it
+    root = tk.Tk()
+    root.withdraw()
+
+    # 2. Make the dialog appear on top of our Kivy app
+    root.attributes('-topmost', True)
+
+    # 3. Open the actual dialog (askopenfilenames, askdirectory, ...)
+    result = getattr(filedialog, ask)(**options)
+
+    # 4. Close the hidden window
+    root.destroy()
+    return result
 
-LabelBase.register(
-    name="FA",
-    fn_regular="assets/fa-solid-900.ttf"
-)
 
 def format_time(seconds):
     minutes = int(seconds // 60)
@@ -29,84 +112,125 @@ def format_time(seconds):
 class MainScreen(Screen):
 
     path = ''
-    paused = False
     is_dragging_progress_bar = False
 
     # Skipping logic
     skip_time = 5
-    current_time_offset = 0
+
+    # Waveform overview behind the progress slider (needs NumPy)
+    show_waveform = True
+    # Real spectrum bars instead of the pulsing icon (needs NumPy too)
+    show_spectrum = True
+    spectrum = None
 
     # Volume variable, max value at 1
     volume = NumericProperty(0.5)
-    # Pygame does not provide any real time, manual clock to update slider
+    # Play order, the engine follows these (see on_shuffle / on_repeat)
+    shuffle = BooleanProperty(False)
+    repeat = OptionProperty(REPEAT_OFF, options=REPEAT_MODES)
+    # Last position we showed, the real one comes from the engine (the mixer's own sample counter)
     current_time = 0
 
-    # Gradient
+    # UI refresh rate while playing. We tick just fast enough to move the slider thumb one pixel,
+    # but never slower than ui_min_fps so the time label stays responsive
+    ui_max_fps = 30
+    ui_min_fps = 4
+
+    # Power saving: nobody needs a slider or a pulsing icon they can't see.
+    # Hidden (minimized / other screen) -> no UI clock, no animation.
+    # Visible but unfocused -> slow tick, no animation. Playback itself is never touched.
+    power_saving = True
+    window_hidden = False
+
+    # Gradient, from the album art when the track has some
     grad_color_1 = ListProperty([0.1, 0.1, 0.1, 1])
     grad_color_2 = ListProperty([0.2, 0.2, 0.2, 1])
+    art_texture = ObjectProperty(None, allownone=True)
 
-    # Whenever we use self.playlist, these functions get triggered
-    @property
-    def app(self):
-        return App.get_running_app()
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
 
-    @property
-    def playlist(self):
-        return self.app.playlist
+        Window.bind(
+            on_minimize=self.on_window_hidden,
+            on_hide=self.on_window_hidden,
+            on_restore=self.on_window_shown,
+            on_show=self.on_window_shown,
+            focus=self.on_window_focus
+        )
 
-    @playlist.setter
-    def playlist(self, value):
-        self.app.playlist = value
+    def on_kv_post(self, base_widget):
+        # The screen only shows what the engine does, it never drives the mixer itself
+        self.engine.bind(on_state=self.on_engine_state, on_track=self.on_engine_track)
 
     @property
-    def current_song_index(self):
-        return self.app.current_song_index
-
-    @current_song_index.setter
-    def current_song_index(self, value):
-        # This sends the new value back to the App class
-        self.app.current_song_index = value
+    def app(self):
+        return App.get_running_app()
 
     @property
-    def music_started(self):
-        return self.app.music_started
+    def engine(self):
+        return self.app.engine
+
+    def ui_visibility(self):
+        # 'active', 'background' (visible but unfocused) or 'hidden'
+        if not self.power_saving:
+            return 'active'
+        if self.window_hidden or not self.manager or self.manager.current != self.name:
+            return 'hidden'
+        if not Window.focus:
+            return 'background'
+        return 'active'
+
+    def on_window_hidden(self, *args):
+        self.window_hidden = True
+        self.refresh_power_state()
+
+    def on_window_shown(self, *args):
+        self.window_hidden = False
+        self.refresh_power_state()
+
+    def on_window_focus(self, *args):
+        self.refresh_power_state()
+
+    def on_leave(self):
+        self.refresh_power_state()
+
+    def refresh_power_state(self):
+        # Only matters while a song is actually playing, otherwise nothing is ticking anyway
+        if not self.engine.playing:
+            return
+
+        # Both of these look at ui_visibility() themselves
+        self.start_ui_tick()
+        self.start_pulse()
 
-    @music_started.setter
-    def music_started(self, value):
-        self.app.music_started = value
+        # Coming back into view, jump the slider to the real position right away
+        if self.ui_visibility() != 'hidden':
+            self.update_slider(0)
 
     def on_enter(self):
         # Refresh the UI whenever we return to this screen
         Clock.schedule_once(self.deferred_refreshed, 0)
+        self.refresh_power_state()
 
     def deferred_refreshed(self, dt):
-        if self.playlist:
-            if not self.music_started:
-                # Reloads metadata for the current index
-                mixer.music.stop()
-                self.music_started = False
-                Clock.unschedule(self.update_slider)
-                self.import_audio()
-                self.play_music()
-            else:
-                pass
+        if self.app.playlist:
+            # "Play next" or a removed track on the list screen may have changed what comes next
+            self.refresh_track_buttons()
+            if not self.engine.started:
+                # Plays the song the list screen picked (or the current one again), loading it if needed
+                self.engine.play()
         else:
-            self.stop_and_reset()
-
-            # 2. Add these "Deep Clean" steps:
-            mixer.music.unload()  # Critical: Releases the file lock on the current MP3
-
-            # Reset internal logic flags not covered in stop_and_reset
-            self.current_time_offset = 0
+            # Critical: unloading releases the file lock on the current MP3
+            self.engine.unload()
             self.path = ''
 
-            # 3. Reset UI elements that only exist on the MainScreen
+            # Reset UI elements that only exist on the MainScreen
             song_title = self.ids.get("song_title")
             if song_title:
                 song_title.text = "Select a Song"
             self.stop_pulse()  # Ensure the animation isn't running in the background
 
-            # 4. Handle the "Smart Button" position
+            # Handle the "Smart Button" position
             # If the list is empty, snap the button back to the center
 
             main_action_btn = self.ids.get("main_action_btn")
@@ -117,6 +241,16 @@ class MainScreen(Screen):
 
     def start_pulse(self):
         Animation.cancel_all(self.ids.center_icon)
+        self.ids["spectrum_view"].stop()
+
+        # Just decoration, skip it when nobody is looking
+        if self.ui_visibility() != 'active':
+            return
+
+        # The real thing if we have it, the fake pulse otherwise
+        if self.spectrum:
+            self.ids["spectrum_view"].start()
+            return
 
         # Use raw numbers instead of strings like "130sp"
         # 130 and 100 are the pixel equivalents
@@ -128,9 +262,16 @@ class MainScreen(Screen):
 
     def stop_pulse(self):
         Animation.cancel_all(self.ids.center_icon)
+        self.ids["spectrum_view"].stop()
         # Return to base state using numbers
         Animation(font_size=100, opacity=0.5, duration=0.5).start(self.ids.center_icon)
 
+    def open_save_popup(self):
+        SavePlaylistPopup().open()
+
+    def open_load_popup(self):
+        LoadPlaylistPopup().open()
+
     def handle_action(self):
         # Access the shared app state
         if not self.app.playlist:
@@ -142,120 +283,168 @@ class MainScreen(Screen):
             self.manager.transition.direction = 'left'
 
     def open_windows_explorer(self):
-        # 1. Create a hidden Tkinter root window
-        root = tk.Tk()
-
-        # We only need to access file dialog of tkinter.
-        # When filedialog opens, a blank window also pops up (root) instance
-        # root.withdraw hides that window
-        root.withdraw()
-
-        # 2. Make the dialog appear on top of our Kivy app
-        root.attributes('-topmost', True)
-
-        # 3. Open the actual Windows File Explorer
-        file_paths = filedialog.askopenfilenames(
+        # Open the actual Windows File Explorer
+        file_paths = ask_with_dialog(
+            "askopenfilenames",
             title="Select Audio File",
             filetypes=[("Audio Files", "*.mp3 *.wav *.flac *.ogg"), ("All Files", "*.*")]
         )
 
-        # 4. Close the hidden window
-        root.destroy()
-
-        # 5. Send the path to your existing import_audio function
+        # Send the path to the engine, it loads the song and tells us about it
         if file_paths:
             # Destroy previous session
             anim = Animation(pos_hint={'right': 0.98, 'top': 0.98},
                              size_hint=(0.3, 0.07),
                              duration=0.5, t='out_cubic')
             anim.start(self.ids.main_action_btn)
-            for file_path in file_paths:
-                # Standardize path slashes for Python
-                file_path = file_path.replace('\\', '/')
-                self.playlist.append(file_path)
-
-            print(self.playlist, self.current_song_index)
-            self.import_audio()
-
-    def import_audio(self):
-        # 1. Get Metadata using Mutagen
-        audio = File(self.playlist[self.current_song_index])
-        self.path = self.playlist[self.current_song_index]
-
-        # Check for next and back buttons
-        if len(self.playlist) > 1 and self.current_song_index < len(self.playlist) - 1:
-            self.ids["next_song"].disabled = False
-        else:
-            self.ids["next_song"].disabled = True
+            # Standardize path slashes for Python
+            self.app.add_tracks([file_path.replace('\\', '/') for file_path in file_paths])
 
-        if len(self.playlist) > 1 and self.current_song_index > 0:
-            self.ids["prev_song"].disabled = False
-        else:
-            self.ids["prev_song"].disabled = True
+            Logger.debug(f"Player: {len(file_paths)} files picked, {len(self.app.playlist)} in the playlist")
+            self.engine.load(self.engine.index)
 
-        # 2. Update Slider Max and Labels
+    def on_engine_state(self, state):
+        if state == 'playing':
+            self.ids["play_button"].text = "\uf04c"
+            self.ids["skip_forward"].disabled = False
+            self.ids["skip_backward"].disabled = False
+            self.start_pulse()
+
+            # Start the slider tick, its rate depends on song length and slider width
+            self.start_ui_tick()
+            return
+
+        # Paused or stopped, either way the UI timer stops
+        self.ids["play_button"].text = "\uf04b"
+        self.stop_pulse()
+        Clock.unschedule(self.update_slider)
+
+        if state == 'stopped':
+            self.current_time = 0
+            self.ids["progress_slider"].value = 0
+            self.ids["current_time_label"].text = "00:00"
+
+    def on_engine_track(self, index, path, info):
+        # A new song is in the engine (picked by the user or a gapless change), catch the UI up
+        self.path = path
+        self.refresh_track_buttons()
+
+        # Update Slider Max and Labels
         self.current_time = 0
-        self.current_time_offset = 0
-        length = audio.info.length
+        length = info.duration if info else 0
         self.ids["progress_slider"].max = length
         self.ids["progress_slider"].value = 0
-        self.ids["song_title"].text = os.path.basename(self.path)
+        self.ids["song_title"].text = display_title(info, path)
+        # The engine probed a file the list only knew by name, its row gets the tags now
+        list_screen = self.app.root.get_screen("list")
+        list_screen.set_row_value(index, "text", display_title(info, path))
+        list_screen.highlight(index)
         self.ids["total_time_label"].text = format_time(length)
+        if self.engine.playing:
+            # A change between tracks comes without a 'playing', the tick rate follows the new length from here
+            self.start_ui_tick()
         self.ids["play_button"].disabled = False
-        self.update_procedural_bg()
+
+        # Art we have in memory shows right away, anything else comes from the art worker.
+        # Until then the gradient is the procedural one
+        art = self.app.art.cached(path)
+        if art is not None:
+            self.show_art(art)
+        else:
+            self.art_texture = None
+            self.update_procedural_bg()
+            self.app.art.request(path, self.on_art_ready)
+
+        # The analyzer (and NumPy with it) only comes in with the first song, not at start up.
+        # It follows the same real position as the slider
+        if self.spectrum is None and self.show_spectrum and HAVE_NUMPY:
+            self.spectrum = SpectrumAnalyzer(
+                os.path.join(self.app.user_data_dir, "spectrum"), self.engine.position
+            )
+            self.ids["spectrum_view"].analyzer = self.spectrum
+
+        # The spectrum decodes its own copy of the track, the bars start once it is ready
+        if self.spectrum:
+            self.spectrum.prepare(path)
+
+        # Same for the waveform overview, the slider stays plain until it arrives
+        self.ids["progress_slider"].peaks = None
+        if self.show_waveform:
+            self.app.peaks.request(path, self.on_peaks_ready)
+
+    def refresh_track_buttons(self):
+        # Next and back follow the play order (shuffle, repeat, "play next"), not just the list
+        self.ids["next_song"].disabled = not self.engine.has_next
+        self.ids["prev_song"].disabled = not self.engine.has_previous
+
+    def on_shuffle(self, instance, shuffle):
+        self.engine.set_shuffle(shuffle)
+        self.refresh_track_buttons()
+
+    def on_repeat(self, instance, repeat):
+        self.engine.set_repeat(repeat)
+        self.refresh_track_buttons()
+
+    def cycle_repeat(self):
+        # off -> all -> one -> off
+        self.repeat = REPEAT_MODES[(REPEAT_MODES.index(self.repeat) + 1) % len(REPEAT_MODES)]
+
+    def on_peaks_ready(self, path, peaks):
+        # Only if the user hasn't moved on to another song in the meantime
+        if path == self.path:
+            self.ids["progress_slider"].peaks = peaks
+
+    def on_art_ready(self, path, art):
+        if path == self.path:
+            self.show_art(art, fade=True)
+
+    def show_art(self, art, fade=False):
+        self.art_texture = art_texture(art)
+        color_1, color_2 = art.colors
+        Animation.cancel_all(self, "grad_color_1", "grad_color_2")
+        if fade:
+            # Eases over from the procedural colours instead of flashing
+            Animation(grad_color_1=color_1, grad_color_2=color_2, duration=0.4).start(self)
+        else:
+            self.grad_color_1 = color_1
+            self.grad_color_2 = color_2
 
     def update_procedural_bg(self):
-        random.seed(os.path.basename(self.path))
-        self.grad_color_1 = [random.uniform(0, 0.2), random.uniform(0, 0.2), random.uniform(0, 0.2), 1]
-        self.grad_color_2 = [random.uniform(0.1, 0.4), random.uniform(0.1, 0.4), random.uniform(0.1, 0.4), 1]
+        # Same colours for the same file every time. Its own generator, seeding the global one
+        # would reset the random state of everything else in the app
+        rng = random.Random(os.path.basename(self.path))
+        Animation.cancel_all(self, "grad_color_1", "grad_color_2")
+        self.grad_color_1 = [rng.uniform(0, 0.2), rng.uniform(0, 0.2), rng.uniform(0, 0.2), 1]
+        self.grad_color_2 = [rng.uniform(0.1, 0.4), rng.uniform(0.1, 0.4), rng.uniform(0.1, 0.4), 1]
 
     def play_music(self):
-        #1. First time starting music
-        if not self.music_started:
-            self.ids["play_button"].text = "\uf04c"
-            self.music_started = True
-            mixer.music.load(self.path)
-            self.ids["skip_forward"].disabled = False
-            self.ids["skip_backward"].disabled = False
+        # Play, pause or resume, depending on where the engine is. The buttons follow in on_engine_state
+        self.engine.toggle()
 
-            self.start_pulse()
+    def ui_tick_interval(self):
+        # Seconds of music per pixel of slider, ticking faster than that only redraws the same thumb
+        slider = self.ids["progress_slider"]
+        seconds_per_pixel = slider.max / max(1, slider.width)
+        return min(max(seconds_per_pixel, 1 / self.ui_max_fps), 1 / self.ui_min_fps)
 
-            # What if we already moved the slider even before music was played
-            mixer.music.play(start = self.current_time)
+    def start_ui_tick(self):
+        Clock.unschedule(self.update_slider)
 
-            # This object calls that function after every 1/60 second
-            Clock.schedule_interval(self.update_slider, 1/60)
+        # The position lives in the mixer, so a suspended tick loses nothing,
+        # the first tick after coming back simply reads the right value
+        visibility = self.ui_visibility()
+        if visibility == 'hidden':
             return
+        if visibility == 'background':
+            Clock.schedule_interval(self.update_slider, 1 / self.ui_min_fps)
+            return
+        Clock.schedule_interval(self.update_slider, self.ui_tick_interval())
 
-        #2. If music is currently playing, pause it
-        if self.music_started and not self.paused:
-            self.ids["play_button"].text = "\uf04b"
-            self.paused = True
-            mixer.music.pause()
-            self.stop_pulse()
-
-            # Stop the UI timer
-            # Clock object stops this calling
-            Clock.unschedule(self.update_slider)
-
-        #3. If music is paused, unpause it
-        else:
-            self.ids["play_button"].text = "\uf04c"
-            self.paused = False
-            self.start_pulse()
-            mixer.music.unpause()
-            Clock.schedule_interval(self.update_slider, 1/60)
-
+    @perf.timed("update_slider")
     def update_slider(self, dt):
-        # we just add the 'dt' (delta time) to our variable
-        # dt is provided by Clock object, that dt is timeout variable
-        self.current_time += dt
-
-        # Check if we have reached the end of song
-        if self.current_time >= self.ids["progress_slider"].max:
-            # Separate function, cleaner
-            self.stop_and_reset()
-            return
+        # No more adding up dt, we ask the engine how much the mixer has really played.
+        # End of song is handled by the engine, here we only keep the thumb from running past it
+        self.current_time = min(self.engine.position(), self.ids["progress_slider"].max)
 
         if self.is_dragging_progress_bar:
             return
@@ -263,27 +452,6 @@ class MainScreen(Screen):
         self.ids["progress_slider"].value = self.current_time
         self.ids["current_time_label"].text = format_time(self.current_time)
 
-    def stop_and_reset(self):
-        mixer.music.stop()
-        Clock.unschedule(self.update_slider)
-        self.music_started = False
-        self.paused = False
-        self.current_time = 0
-        self.stop_pulse()
-
-        # Use .get() to safely check if the widget exists yet
-        play_btn = self.ids.get("play_button")
-        if play_btn:
-            play_btn.text = "\uf04b"
-
-        slider = self.ids.get("progress_slider")
-        if slider:
-            slider.value = 0
-
-        time_label = self.ids.get("current_time_label")
-        if time_label:
-            time_label.text = "00:00"
-
     def progress_bar_drag(self, value):
         self.ids["current_time_label"].value = value
 
@@ -309,220 +477,438 @@ class MainScreen(Screen):
         # Update our tracker to current time
         self.current_time = float(value)
 
-        if self.music_started:
-            # 2. Tell Pygame to jump to the new second
-            # Note: start=value works for MP3 and OGG; WAV may require restarting
+        # The engine jumps the mixer (or remembers the position for when play is pressed)
+        self.engine.seek(self.current_time)
 
+        if self.engine.playing:
+            # Restart the clock if we are playing, now why?
             """
-            alright so here, we first use play function to jump to our desired position. Say, for a brief, let it be in nanosecond, my music will play, 
-            but immediately that self.paused will be executed, and it will pause it
-            
-            Because mixer.music.play(start=value) is the only reliable way in Pygame to move the playhead to a specific timestamp, 
-            you have to "kickstart" the engine for a split second before freezing it again.
+            In a perfect world, yes, it would work. But in a real-world app, "letting it run" leads to a subtle but annoying visual jitter known as the Phase Offset.
 
-            Why this works (and why it's necessary)
-            Pygame's mixer behaves like an old-school tape deck. You can't just "move the tape" while the power is off; the engine has to be "Engaged" (play) 
-            for the playhead to find the correct byte in the file.
+            Here is the technical reason why we restart it:
             
-            The "Jump": mixer.music.play(start=value) resets the internal buffer and starts streaming from the new location.
+            The "Sub-Second" Offset Problem
+            The Kivy Clock doesn't care where we moved the slider; it only cares about the exact moment it was first started.
             
-            The "Freeze": mixer.music.pause() happens so fast (in microseconds) that the user's ears won't even process a sound. To them, it looks like the player 
-            just "skipped" while paused.
+            => Imagine this timeline:
             
+            1) The clock is ticking at: 1.0s, 2.0s, 3.0s, 4.0s.
+            
+            2) At 2.9s, we quickly scrub the slider to 50.0s and release.
+            
+            3) If we let it run: The next tick happens at 3.0s (because that’s the next 1-second interval).
+            
+            3) The Result: Our current_time immediately jumps from 50.0 to 51.0 after only 0.1 seconds of listening.
+            
+            To the user, it looks like the slider "hiccups" or jumps forward too fast the moment they let go.
+            
+            The "Drift" cumulative error
+            Because Kivy's Clock is influenced by the frame rate (FPS) of our app, small delays in processing can build up. By restarting the clock upon a seek, 
+            we resynchronize the UI's heartbeat with the user's manual action. It ensures the first "tick" after the seek happens exactly 1.0 seconds later.
             """
-
-            mixer.music.play(start=value)
-
-            Clock.unschedule(self.update_slider)
-
-            # 3. If we were paused, pause immediately after jumping
-            if self.paused:
-
-                """
-                The "Volume Sandwich" is a defensive programming technique used to hide audio artifacts (like pops, clicks, or "ghost" notes) that occur during rapid state changes in an audio engine.
-
-                Why does this happen on fast/low-latency devices?
-                It boils down to the way modern computers handle Audio Buffers.
-                
-                The Buffer Delay: When you call mixer.music.play(), Python tells the hardware to start pushing data. On a slower device, there is a tiny "warm-up" period where the hardware prepares the stream.
-                
-                The Execution Speed: On a high-end PC with low-latency drivers, your CPU executes the Python code so fast that the play() command and the pause() command are sent to the audio hardware almost simultaneously.
-                
-                The "Glitch": Because the hardware is so responsive, it manages to play a few "frames" of audio (literally microseconds of sound) before the pause command hits the circuit. This results in a tiny chirp or pop sound.
-                """
-                mixer.music.pause()
-            else:
-                # 4. Restart the clock if we are playing, now why?
-                """
-                In a perfect world, yes, it would work. But in a real-world app, "letting it run" leads to a subtle but annoying visual jitter known as the Phase Offset.
-
-                Here is the technical reason why we restart it:
-                
-                The "Sub-Second" Offset Problem
-                The Kivy Clock doesn't care where we moved the slider; it only cares about the exact moment it was first started.
-                
-                => Imagine this timeline:
-                
-                1) The clock is ticking at: 1.0s, 2.0s, 3.0s, 4.0s.
-                
-                2) At 2.9s, we quickly scrub the slider to 50.0s and release.
-                
-                3) If we let it run: The next tick happens at 3.0s (because that’s the next 1-second interval).
-                
-                3) The Result: Our current_time immediately jumps from 50.0 to 51.0 after only 0.1 seconds of listening.
-                
-                To the user, it looks like the slider "hiccups" or jumps forward too fast the moment they let go.
-                
-                The "Drift" cumulative error
-                Because Kivy's Clock is influenced by the frame rate (FPS) of our app, small delays in processing can build up. By restarting the clock upon a seek, 
-                we resynchronize the UI's heartbeat with the user's manual action. It ensures the first "tick" after the seek happens exactly 1.0 seconds later.
-                """
-                Clock.schedule_interval(self.update_slider, 1/60)
+            self.start_ui_tick()
 
     def update_volume(self, value):
         self.volume = value
-        mixer.music.set_volume(self.volume)
+        self.engine.set_volume(self.volume)
 
-    # Skipping, current_time keeps track of this
+    # Skipping, the engine starts from where the mixer really is, not from the last UI tick
 
     def skip_forward(self):
-        # 1. Update our master variable
-        self.current_time += self.skip_time
-
-        # 2. Safety check: Don't skip past the end of the song
-        max_len = self.ids["progress_slider"].max
-        if self.current_time > max_len:
-            self.stop_and_reset()
-            return
-
-        # 3. Update the UI thumb immediately so it doesn't wait for the next Clock tick
-        self.ids["progress_slider"].value = self.current_time
-        self.ids["current_time_label"].text = format_time(self.current_time)
-
-        # 4. Tell the mixer to jump
-        # We use the same 'kickstart' logic as your seek function
-        mixer.music.play(start=self.current_time)
-        if self.paused:
-            mixer.music.pause()
+        # Running past the end of the song stops it, the engine tells us through on_engine_state
+        self.engine.skip(self.skip_time)
+        # Update the UI thumb immediately so it doesn't wait for the next Clock tick
+        self.update_slider(0)
 
     def skip_backward(self):
-        # 1. Update variable
-        self.current_time -= self.skip_time
-
-        # 2. Safety check: Don't go below 0
-        if self.current_time < 0:
-            self.current_time = 0
-
-        # 3. Update UI
-        self.ids["progress_slider"].value = self.current_time
-        self.ids["current_time_label"].text = format_time(self.current_time)
-
-        # 4. Jump
-        mixer.music.play(start=self.current_time)
-        if self.paused:
-            mixer.music.pause()
+        self.engine.skip(-self.skip_time)
+        self.update_slider(0)
 
     def next_song(self):
-        app = App.get_running_app()
-        if self.current_song_index < len(self.playlist) - 1:
-            app.current_song_index += 1
-            self.prepare_and_play()
+        self.engine.next()
 
     def prev_song(self):
-        if self.current_song_index > 0:
-            self.current_song_index -= 1
-            self.prepare_and_play()
+        self.engine.previous()
 
+class PlaylistRow(RecycleDataViewBehavior, BoxLayout):
+    # One recycled row of the playlist, the RecycleView fills these from its data dicts
+    index = 0
+    text = StringProperty("")
+    selected = BooleanProperty(False)
+    duplicate = BooleanProperty(False)
 
-    def prepare_and_play(self):
-        # Stop Current playing music
-        mixer.music.stop()
-        self.music_started = False
-        # Unschedule clocks
-        Clock.unschedule(self.update_slider)
+    def refresh_view_attrs(self, rv, index, data):
+        # Remember which playlist entry this widget is showing right now
+        self.index = index
+        return super().refresh_view_attrs(rv, index, data)
+
+    def select(self):
+        screen = App.get_running_app().root.get_screen("list")
+        screen.select_song(screen.playlist_index(self.index))
 
-        if not self.paused:
-            self.paused = self.paused
+    def remove(self):
+        screen = App.get_running_app().root.get_screen("list")
+        screen.remove_song(screen.playlist_index(self.index))
 
-        # Import next song data, change and update UI
-        self.import_audio()
+    def play_next(self):
+        screen = App.get_running_app().root.get_screen("list")
+        screen.play_next(screen.playlist_index(self.index))
 
-        # Play the song
-        self.play_music()
 
 class ListScreen(Screen):
+    # Folder import state, the kv file shows the progress bar row while this is True
+    scanning = BooleanProperty(False)
+    scan_status = StringProperty("")
+    scanner = None
+    scan_started = 0.0
+    # "12 of 30000" next to the search box while a filter is on
+    search_status = StringProperty("")
+    # Rows that are in the playlist already (the same file further up, or what DuplicateFinder found),
+    # the button next to the search box shows only those
+    duplicate_count = NumericProperty(0)
+    only_duplicates = BooleanProperty(False)
+    # Seconds per frame spent indexing new rows for the search box
+    index_slice = 0.004
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Every row in playlist order. The RecycleView shows these, or only the matching ones while searching
+        self.rows = []
+        self.shown = None  # Playlist positions of the rows on display, None means all of them
+        self.search_index = SearchIndex()
+        self.path_counts = Counter()  # How often every path is in the playlist
+        self.duplicate_paths = frozenset()  # From DuplicateFinder, see show_duplicates()
+        self.highlighted = None  # Position of the row marked as the current track
+
+        # Typing several characters within one frame only filters once
+        self.filter_trigger = Clock.create_trigger(self.apply_filter)
+        self.index_trigger = Clock.create_trigger(self.index_step)
+
+    @perf.timed("refresh_list")
     def refresh_list(self):
-        container = self.ids["list_container"]
-        container.clear_widgets()
+        # Only plain dicts are built here, the RecycleView creates widgets for the visible rows only
         app = App.get_running_app()
-
-        for index, song_path in enumerate(app.playlist):
-            row = BoxLayout(size_hint_y=None, height="50dp")
-
-            # Song Label (Click to play this song)
-            btn = Button(
-                text=os.path.basename(song_path),
-                background_color=(0, 0, 0, 0) if index != app.current_song_index else (0, 0.5, 1, 0.3)
-            )
-            btn.bind(on_release=lambda x, i=index: self.select_song(i))
-
-            # Delete Button
-            del_btn = Button(text="\uf2ed", font_name="FA", size_hint_x=None, width="50dp")
-            del_btn.bind(on_release=lambda x, i=index: self.remove_song(i))
-
-            row.add_widget(btn)
-            row.add_widget(del_btn)
-            container.add_widget(row)
+        known = app.metadata.lookup_many(app.playlist)
+        self.path_counts.clear()
+        self.duplicate_count = 0
+        self.highlighted = None
+        self.rows = self.make_rows(app.playlist, first_index=0, known=known)
+
+        # The index follows every add and remove made here, so it only starts over for a replaced playlist
+        if len(self.search_index) != len(app.playlist):
+            self.search_index.clear()
+            self.search_index.add(app.playlist, known)
+            self.index_trigger()
+        self.apply_filter()
+
+    def index_step(self, dt):
+        # A few ms of indexing per frame until the index has caught up, searching before that catches up at once
+        if not self.search_index.index_pending(self.index_slice):
+            self.index_trigger()
+
+    @perf.timed("apply_filter")
+    def apply_filter(self, *args):
+        query = self.ids["search_input"].text
+        view = self.ids["playlist_view"]
+        self.shown = self.search_index.search(query)
+        if self.only_duplicates:
+            rows = self.rows
+            matched = range(len(rows)) if self.shown is None else self.shown
+            self.shown = [position for position in matched if rows[position]["duplicate"]]
+        if self.shown is None:
+            view.data = self.rows
+        else:
+            # Only the dicts of the matching rows are handed over, no widget gets created or rebuilt here
+            rows = self.rows
+            view.data = [rows[position] for position in self.shown]
+            view.scroll_y = 1
+        self.update_search_status()
+
+    def update_search_status(self):
+        self.search_status = "" if self.shown is None else f"{len(self.shown)} of {len(self.rows)}"
+
+    def playlist_index(self, view_index):
+        # Row of the RecycleView -> position in the playlist
+        return view_index if self.shown is None else self.shown[view_index]
+
+    def view_index(self, index):
+        # Position in the playlist -> row of the RecycleView, None if the filter hides it
+        if self.shown is None:
+            return index
+        found = bisect_left(self.shown, index)
+        if found < len(self.shown) and self.shown[found] == index:
+            return found
+        return None
+
+    def make_rows(self, paths, first_index, known=None):
+        # Rows for paths that go after everything in path_counts, which counts them in
+        app = App.get_running_app()
+        paths = list(paths)
+
+        # One query for the whole list, only rows we already know about, nothing gets opened here
+        if known is None:
+            known = app.metadata.lookup_many(paths)
+        counts = self.path_counts
+        duplicates = self.duplicate_paths
+        marked = app.config.getboolean("library", "duplicates")
+        # Nothing loaded, then engine.index is 0 without meaning anything
+        current = app.engine.index if app.engine.path else None
+        if current is not None and first_index <= current < first_index + len(paths):
+            self.highlighted = current
+        rows = []
+        for offset, song_path in enumerate(paths):
+            counts[song_path] += 1
+            duplicate = marked and (counts[song_path] > 1 or song_path in duplicates)
+            self.duplicate_count += duplicate
+            rows.append({
+                "text": display_title(known.get(song_path), song_path),
+                "selected": first_index + offset == current,
+                "duplicate": duplicate
+            })
+        return rows
+
+    def append_rows(self, paths, known=None):
+        paths = list(paths)
+        if known is None:
+            known = App.get_running_app().metadata.lookup_many(paths)
+        first = len(self.rows)
+        new_rows = self.make_rows(paths, first_index=first, known=known)
+        self.rows.extend(new_rows)
+        self.search_index.add(paths, known)
+        self.index_trigger()
+
+        view = self.ids["playlist_view"]
+        if self.shown is None:
+            view.data.extend(new_rows)
+        else:
+            # While searching, only the new rows that match show up
+            matched = self.search_index.match_from(self.ids["search_input"].text, first)
+            if self.only_duplicates:
+                matched = [position for position in matched if self.rows[position]["duplicate"]]
+            self.shown.extend(matched)
+            view.data.extend([self.rows[position] for position in matched])
+            self.update_search_status()
+
+    def highlight(self, index):
+        # The current track moved (picked here, next/previous, a gapless change, the remote control), one row
+        # loses the mark and one gets it
+        if self.highlighted is not None and self.highlighted != index:
+            self.set_row_value(self.highlighted, "selected", False)
+        self.highlighted = None
+        if 0 <= index < len(self.rows):
+            self.set_row_value(index, "selected", True)
+            self.highlighted = index
+
+    def set_row_duplicate(self, index, duplicate):
+        if self.set_row_value(index, "duplicate", duplicate):
+            self.duplicate_count += 1 if duplicate else -1
+
+    def set_row_value(self, index, key, value):
+        # True if the row changed
+        rows = self.rows
+        if not 0 <= index < len(rows) or rows[index][key] == value:
+            return False
+        rows[index] = dict(rows[index], **{key: value})
+        view_index = self.view_index(index)
+        if view_index is not None:
+            # Assigning the item (instead of editing the dict) tells the RecycleView only this row changed
+            self.ids["playlist_view"].data[view_index] = rows[index]
+        return True
+
+    def show_duplicates(self, paths):
+        # A new set from DuplicateFinder. Later rows of a path are marked anyway, only its first row can change.
+        # A few changes are looked up one by one, many (the first answer for a restored library) in one pass
+        changed = paths ^ self.duplicate_paths
+        self.duplicate_paths = paths
+        if len(changed) > 32:
+            self.mark_duplicates()
+            return
+        playlist = App.get_running_app().playlist
+        for path in changed:
+            if path in self.path_counts:
+                self.set_row_duplicate(playlist.index(path), path in paths)
+        if changed and self.only_duplicates:
+            self.apply_filter()
+
+    def mark_duplicates(self):
+        # Every row over again, for a big answer or the setting being switched
+        app = App.get_running_app()
+        marked = app.config.getboolean("library", "duplicates")
+        seen = set()
+        for index, path in enumerate(app.playlist):
+            repeat = path in seen
+            seen.add(path)
+            self.set_row_duplicate(index, marked and (repeat or path in self.duplicate_paths))
+        if self.only_duplicates:
+            self.apply_filter()
+
+    def on_only_duplicates(self, *args):
+        self.apply_filter()
 
     def select_song(self, index):
-        App.get_running_app().current_song_index = index
-        # You stop the music
-        App.get_running_app().music_started = False
+        app = App.get_running_app()
+        self.highlight(index)
+        # Loading stops the music, the main screen starts the new song when it shows up
+        app.engine.load(index)
         self.manager.current = "main"
 
+    def play_next(self, index):
+        App.get_running_app().engine.play_next(index)
+
     def remove_song(self, index):
         app = App.get_running_app()
-
-        # If we delete the song that is currently playing
-        if index == app.current_song_index:
-            mixer.music.stop()
-            app.playlist.pop(index)
-            # Reset index to 0 or keep it within bounds
-            app.current_song_index = max(0, min(index, len(app.playlist) - 1))
-            # You have stopped the music too
-            app.music_started = False
-        else:
-            app.playlist.pop(index)
-            # If we deleted a song BEFORE the current one, shift index down
-            if index < app.current_song_index:
-                app.current_song_index -= 1
-
-        self.refresh_list()
+        was_current = index == app.engine.index
+        view_index = self.view_index(index)
+        path = app.playlist[index]
+
+        # The engine takes it out of its queue and stops it if it was playing
+        app.engine.remove(index)
+        app.playlist.pop(index)
+        removed = self.rows.pop(index)
+        self.search_index.pop(index)
+        if view_index is not None:
+            self.ids["playlist_view"].data.pop(view_index)
+
+        if self.shown is not None:
+            # Everything after the removed track moved up one place in the playlist
+            shown = self.shown
+            if view_index is not None:
+                shown.pop(view_index)
+            for i in range(bisect_left(shown, index), len(shown)):
+                shown[i] -= 1
+            self.update_search_status()
+
+        self.path_counts[path] -= 1
+        if removed["duplicate"]:
+            self.duplicate_count -= 1
+        elif self.path_counts[path]:
+            # That was the first row of a path that is in the list again, the next one takes its place
+            self.set_row_duplicate(app.playlist.index(path), path in self.duplicate_paths)
+        if not self.path_counts[path]:
+            del self.path_counts[path]
+        app.duplicates.remove(path)
+
+        if self.highlighted is not None and self.highlighted >= index:
+            self.highlighted = None if self.highlighted == index else self.highlighted - 1
+        if was_current and app.engine.path:
+            # The row that slid into place becomes the highlighted one
+            self.highlight(app.engine.index)
+
+    def open_load_popup(self):
+        LoadPlaylistPopup().open()
 
     def open_windows_explorer(self):
-        root = tk.Tk()
-        root.withdraw()
-        root.attributes('-topmost', True)
 
-        file_paths = filedialog.askopenfilenames(
+        file_paths = ask_with_dialog(
+            "askopenfilenames",
             title="Add to Playlist",
             filetypes=[("Audio Files", "*.mp3 *.wav *.flac *.ogg")]
         )
-        root.destroy()
 
         if file_paths:
-            app = App.get_running_app()
-            for path in file_paths:
-                clean_path = path.replace('\\', '/')
-                # Add to the existing list instead of replacing it
-                app.playlist.append(clean_path)
+            clean_paths = [path.replace('\\', '/') for path in file_paths]
+            # Add to the existing list instead of replacing it, only the new rows get built
+            App.get_running_app().add_tracks(clean_paths)
+
+    def open_folder_dialog(self):
+        # Same hidden Tkinter trick as the file picker, we only need the folder path
+        folder = ask_with_dialog("askdirectory", title="Import Music Folder")
+
+        if folder:
+            self.import_folder(folder)
+
+    def import_folder(self, folder):
+        app = App.get_running_app()
+        if self.scanner and self.scanner.running:
+            return
 
-            self.refresh_list()  # Re-draw the scrollable list
+        # The walk and the tag reading happen off the UI thread,
+        # we only get called back with finished batches
+        self.scanner = LibraryScanner(
+            app.metadata,
+            on_batch=self.on_scan_batch,
+            on_progress=self.on_scan_progress,
+            on_done=self.on_scan_done
+        )
+        self.scanning = True
+        self.scan_status = "Scanning..."
+        self.scan_started = time.perf_counter()
+        self.scanner.start(folder)
+
+    def cancel_scan(self):
+        if self.scanner:
+            self.scanner.cancel()
+            self.scan_status = "Cancelling..."
+
+    def on_scan_batch(self, infos):
+        # Batches are already sized so that one extend per frame stays cheap
+        paths = [info.path for info in infos]
+        App.get_running_app().add_tracks(paths, known={info.path: info for info in infos})
+
+    def on_scan_progress(self, done, seen, walking):
+        if walking:
+            self.scan_status = f"Imported {done} of {seen}+ files..."
+        else:
+            self.scan_status = f"Imported {done} of {seen} files..."
+
+    def on_scan_done(self, cancelled):
+        perf.record("import folder", self.scan_started)
+        self.scanning = False
+        self.scan_status = ""
 
-    # This is your ScrollView list of paths
+    # This is your RecycleView list of paths
     def on_enter(self):
-        # Refresh the list view whenever we switch to this screen
-        self.refresh_list()
+        # add_tracks() and remove_song() keep the rows up to date one change at a time, a full rebuild is only
+        # needed when the playlist got replaced behind our back (load_playlist() rebuilds for itself)
+        if len(self.rows) != len(App.get_running_app().playlist):
+            self.refresh_list()
+
+class SavePlaylistPopup(Popup):
+    def save(self):
+        name = self.ids["name_input"].text.strip()
+        if not name:
+            return
+        App.get_running_app().save_playlist(name)
+        self.dismiss()
+
+    def export_m3u(self):
+        file_path = ask_with_dialog(
+            "asksaveasfilename",
+            title="Export Playlist",
+            defaultextension=".m3u8",
+            filetypes=[("M3U Playlist", "*.m3u8 *.m3u")]
+        )
+
+        if file_path:
+            App.get_running_app().export_m3u(file_path)
+            self.dismiss()
+
+
+class LoadPlaylistPopup(Popup):
+    def on_open(self):
+        # Only a handful of saved playlists, plain buttons are fine here
+        app = App.get_running_app()
+        container = self.ids["saved_list"]
+        container.clear_widgets()
+        for name in saved_playlists(app.playlists_dir):
+            btn = Button(text=name, size_hint_y=None, height="44dp")
+            btn.bind(on_release=lambda x, n=name: self.load(playlist_file(app.playlists_dir, n)))
+            container.add_widget(btn)
+
+    def load(self, file_path):
+        App.get_running_app().load_playlist(file_path)
+        self.dismiss()
+
+    def import_m3u(self):
+        file_path = ask_with_dialog(
+            "askopenfilename",
+            title="Import Playlist",
+            filetypes=[("Playlists", "*.m3u8 *.m3u *.mpl"), ("All Files", "*.*")]
+        )
+
+        if file_path:
+            self.load(file_path)
+
 
 class MusicPlayerAppScreenManager(ScreenManager):
     pass
@@ -530,11 +916,316 @@ class MusicPlayerAppScreenManager(ScreenManager):
 class MusicPlayerApp(App):
     # SHARED DATA LIVES HERE
     playlist = ListProperty([])
-    current_song_index = NumericProperty(0)
-    music_started = False
-
+    # Playback state (current song, playing or not) lives in the engine
+    engine = None
+    metadata = None
+    seek_index = None
+    peaks = None
+    loudness = None
+    duplicates = None
+    art = None
+    playlist_loader = None
+    # F12, timings of the hot paths (see perf.py)
+    perf_overlay = None
+    # Scripts and kiosk setups drive the player through this, see control_server.py
+    control = None
+    # Milliseconds since STARTED for every start up phase, filled in by mark_startup()
+    startup_times = None
+    # Only our own panel on the settings screen, not Kivy's
+    use_kivy_settings = False
+
+
+    def build_config(self, config):
+        # What the last session left behind, the playlist itself is in session_file
+        config.setdefaults("session", {"index": 0, "volume": 0.5, "shuffle": 0, "repeat": REPEAT_OFF})
+        # What the settings screen changes, see SETTINGS
+        config.setdefaults("playback", {"normalize": 1, "crossfade": 0, "prefetch": PREFETCH_BYTES // MEGABYTE})
+        config.setdefaults("control", {"enabled": 1, "port": 0})
+        config.setdefaults("library", {"duplicates": 1})
+
+    def build_settings(self, settings):
+        settings.add_json_panel("Playback", self.config, data=SETTINGS)
+        settings.add_json_panel("Remote control", self.config, data=CONTROL_SETTINGS)
+        settings.add_json_panel("Library", self.config, data=LIBRARY_SETTINGS)
+
+    def on_config_change(self, config, section, key, value):
+        if section == "control":
+            self.start_control()
+            return
+        if section == "library" and key == "duplicates":
+            # Same file repeats get marked again (or unmarked) at once, copies once the finder answers
+            list_screen = self.root.get_screen("list")
+            if config.getboolean("library", "duplicates"):
+                self.duplicates.add(self.playlist)
+            else:
+                self.duplicates.clear()
+                list_screen.duplicate_paths = frozenset()
+            list_screen.mark_duplicates()
+            return
+        if section != "playback":
+            return
+        if key == "normalize":
+            self.engine.set_normalize(config.getboolean("playback", "normalize"))
+            if self.engine.normalize:
+                self.loudness.analyze(self.playlist)
+        elif key == "crossfade":
+            try:
+                self.engine.set_crossfade(float(value))
+            except ValueError:
+                Logger.warning(f"Player: crossfade has to be a number of seconds, not {value!r}")
+        elif key == "prefetch":
+            try:
+                self.engine.prefetch_bytes = prefetch_bytes(float(value))
+            except ValueError:
+                Logger.warning(f"Player: read-ahead has to be a number of megabytes, not {value!r}")
+
+    def get_application_config(self):
+        # Next to the library database instead of next to main.py
+        return super().get_application_config(os.path.join(self.user_data_dir, "%(appname)s.ini"))
 
     def build(self):
-        return MusicPlayerAppScreenManager()
+        self.startup_times = {}
+        self.mark_startup("imports", IMPORTED)
+
+        LabelBase.register(
+            name="FA",
+            fn_regular="assets/fa-solid-900.ttf"
+        )
+
+        # Track metadata survives restarts, so big playlists are not re-parsed every time
+        self.metadata = MetadataIndex(os.path.join(self.user_data_dir, "library.db"))
+        self.seek_index = SeekIndex(self.metadata)
+        self.peaks = PeakCache(os.path.join(self.user_data_dir, "peaks"))
+        self.loudness = LoudnessAnalyzer(self.metadata)
+        self.duplicates = DuplicateFinder(self.metadata, on_change=self.on_duplicates)
+        self.art = ArtCache(os.path.join(self.user_data_dir, "art"))
+
+        # The engine knows nothing about Kivy, its events get handed over to the UI thread here
+        self.engine = PlayerEngine(self.metadata, self.seek_index, dispatch=self.run_on_ui, loudness=self.loudness)
+        self.engine.normalize = self.config.getboolean("playback", "normalize")
+        self.engine.crossfade = min(max(self.config.getfloat("playback", "crossfade"), 0.0), MAX_CROSSFADE)
+        # Tracks opened from now on read this far ahead, the one playing keeps its window
+        self.engine.prefetch_bytes = prefetch_bytes(self.config.getfloat("playback", "prefetch"))
+        self.engine.bind(on_ready=lambda: self.mark_startup("mixer ready"))
+
+        self.perf_overlay = PerfOverlay()
+        Window.bind(on_flip=self.on_first_frame, on_key_down=self.on_key_down)
+        root = MusicPlayerAppScreenManager()
+        self.mark_startup("build")
+        return root
+
+    def mark_startup(self, phase, at=None):
+        elapsed = ((at or time.perf_counter()) - STARTED) * 1000
+        self.startup_times[phase] = elapsed
+        Logger.info(f"Startup: {phase} after {elapsed:.0f} ms")
+
+    def on_first_frame(self, *args):
+        Window.unbind(on_flip=self.on_first_frame)
+        self.mark_startup("first frame")
+
+        # The window is up, everything else can come in behind it.
+        # Opening the mixer means importing pygame, on its own thread but still fighting us for the GIL, so only now
+        self.engine.start()
+        main_screen = self.root.get_screen("main")
+        main_screen.volume = self.config.getfloat("session", "volume")
+        main_screen.shuffle = self.config.getboolean("session", "shuffle")
+        repeat = self.config.get("session", "repeat")
+        main_screen.repeat = repeat if repeat in REPEAT_MODES else REPEAT_OFF
+        Clock.schedule_once(self.restore_session, 0)
+        Clock.schedule_once(self.prune_library, PRUNE_DELAY)
+        self.start_control()
+
+    def prune_library(self, dt):
+        # A stat for every file the database knows, on a worker, the UI and the session restore never wait for it
+        def work():
+            removed = self.metadata.prune()
+            if removed:
+                Logger.info(f"Library: forgot {removed} files that are gone")
+
+        threading.Thread(target=work, daemon=True).start()
+
+    def start_control(self):
+        # (Re)starts the remote control with what the settings say
+        if self.control:
+            self.control.stop()
+            self.control = None
+        if not self.config.getboolean("control", "enabled"):
+            return
+        try:
+            port = int(float(self.config.get("control", "port")))
+        except ValueError:
+            Logger.warning(f"Control: the port has to be a number, not {self.config.get('control', 'port')!r}")
+            port = 0
+        if not 0 <= port < 65536:
+            Logger.warning(f"Control: there is no port {port}")
+            port = 0
+        self.control = ControlServer(self, os.path.join(self.user_data_dir, SOCKET_NAME), port)
+        self.control.start()
+
+    def on_key_down(self, window, key, scancode, codepoint, modifiers):
+        if key != F12:
+            return False
+        if "ctrl" in modifiers:
+            self.export_perf()
+        else:
+            self.perf_overlay.toggle()
+        return True
+
+    def export_perf(self):
+        # A summary for reading and a trace for chrome://tracing or ui.perfetto.dev, side by side
+        base = os.path.join(self.user_data_dir, "perf", time.strftime("perf-%Y%m%d-%H%M%S"))
+        try:
+            perf.recorder.export_json(base + ".json")
+            perf.recorder.export_trace(base + ".trace.json")
+        except OSError as e:
+            Logger.error(f"Perf: could not save the timings: {e}")
+            return
+        Logger.info(f"Perf: timings saved to {base}.json and {base}.trace.json")
+        self.perf_overlay.say(f"saved {os.path.basename(base)}.json")
 
-MusicPlayerApp().run()
+    def run_on_ui(self, callback):
+        # Widgets may only be touched from the Kivy thread, anything else waits for the next frame
+        if threading.current_thread() is threading.main_thread():
+            callback()
+        else:
+            Clock.schedule_once(lambda dt: callback(), 0)
+
+    @perf.timed("add_tracks")
+    def add_tracks(self, paths, known=None):
+        # Every way into the playlist ends here: the list the UI binds to, the engine's queue and the rows
+        self.playlist.extend(paths)
+        self.engine.add(paths)
+        self.root.get_screen("list").append_rows(paths, known)
+        # Loudness of the new tracks gets measured in the background, long before most of them play
+        if self.engine.normalize:
+            self.loudness.analyze(paths)
+        # Copies of tracks that are in the playlist already are looked for in the background too, rows get marked
+        if self.config.getboolean("library", "duplicates"):
+            self.duplicates.add(paths)
+
+    def on_duplicates(self, paths):
+        # On the finder's thread. An answer that was on its way when the setting got turned off is dropped
+        def show():
+            if self.config.getboolean("library", "duplicates"):
+                self.root.get_screen("list").show_duplicates(paths)
+        self.run_on_ui(show)
+
+    @property
+    def session_file(self):
+        return os.path.join(self.user_data_dir, "session" + NATIVE_EXTENSION)
+
+    def restore_session(self, dt):
+        # The last playlist streams back in like any saved playlist, rows show up batch by batch
+        if not os.path.exists(self.session_file):
+            self.mark_startup("session restored")
+            return
+        index = self.config.getint("session", "index")
+        self.playlist_loader = PlaylistLoader(
+            self.metadata,
+            on_batch=self.on_playlist_batch,
+            on_done=lambda cancelled: self.on_session_restored(index, cancelled)
+        )
+        self.playlist_loader.start(self.session_file)
+
+    def on_session_restored(self, index, cancelled):
+        # Cancelled means the user already loaded something else, that one wins
+        if cancelled:
+            return
+        self.mark_startup("session restored")
+        if 0 <= index < len(self.playlist):
+            # Only loaded, the song shows up on the main screen but doesn't start playing
+            if self.engine.ready:
+                self.engine.load(index)
+            else:
+                self.engine.bind(on_ready=lambda: self.engine.load(index))
+
+    def save_session(self):
+        # Paths only, the metadata index still has everything else next time.
+        # A playlist that is still loading is skipped, it would be saved half finished
+        if self.playlist_loader and self.playlist_loader.running:
+            return
+        try:
+            write_native(self.session_file, self.playlist, {})
+        except OSError as e:
+            Logger.error(f"Playlist: could not save the session: {e}")
+            return
+        self.config.set("session", "index", self.engine.index)
+        main_screen = self.root.get_screen("main")
+        self.config.set("session", "volume", main_screen.volume)
+        self.config.set("session", "shuffle", int(main_screen.shuffle))
+        self.config.set("session", "repeat", main_screen.repeat)
+        self.config.write()
+
+    @property
+    def playlists_dir(self):
+        return os.path.join(self.user_data_dir, "playlists")
+
+    def save_playlist(self, name):
+        os.makedirs(self.playlists_dir, exist_ok=True)
+        self.write_playlist_async(write_native, playlist_file(self.playlists_dir, name))
+
+    def export_m3u(self, file_path):
+        self.write_playlist_async(write_m3u, file_path)
+
+    def write_playlist_async(self, writer, file_path):
+        # Snapshot on the UI thread, the metadata lookup and the writing happen on a worker
+        paths = list(self.playlist)
+
+        def work():
+            try:
+                writer(file_path, paths, self.metadata.lookup_many(paths))
+                Logger.info(f"Playlist: saved {len(paths)} tracks to {file_path}")
+            except OSError as e:
+                Logger.error(f"Playlist: could not save {file_path}: {e}")
+
+        threading.Thread(target=work, daemon=True).start()
+
+    def load_playlist(self, file_path):
+        # A loaded playlist replaces the current one, so stop everything first
+        if self.playlist_loader:
+            self.playlist_loader.cancel()
+        self.engine.clear()
+        self.duplicates.clear()
+        self.playlist = []
+
+        list_screen = self.root.get_screen("list")
+        list_screen.duplicate_paths = frozenset()
+        list_screen.refresh_list()
+
+        # Rows appear batch by batch while the rest of the file is still being read
+        self.playlist_loader = PlaylistLoader(self.metadata, on_batch=self.on_playlist_batch)
+        self.playlist_loader.start(file_path)
+        self.root.current = "list"
+
+    def on_playlist_batch(self, paths, known):
+        self.add_tracks(paths, known)
+
+    def on_stop(self):
+        if self.control:
+            self.control.stop()
+        if self.root:
+            self.save_session()
+        if perf.recorder.enabled and perf.recorder.spans():
+            # Whatever was recorded this session, MUSICPLAYER_PERF=1 runs always leave their timings behind
+            self.export_perf()
+        if self.playlist_loader:
+            self.playlist_loader.cancel()
+        if self.engine:
+            self.engine.shutdown()
+        if self.peaks:
+            self.peaks.shutdown()
+        if self.loudness:
+            self.loudness.shutdown()
+        if self.duplicates:
+            self.duplicates.shutdown()
+        if self.art:
+            self.art.shutdown()
+        main_screen = self.root.get_screen("main") if self.root else None
+        if main_screen and main_screen.spectrum:
+            main_screen.spectrum.shutdown()
+        if self.metadata:
+            self.metadata.close()
+
+# The scanner spawns worker processes, they re-import this file and must not start a second app
+if __name__ == "__main__":
+    MusicPlayerApp().run()
@@ -0,0 +1,243 @@
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+from streaming import is_url
+
+# One row per audio file. mtime + size is our "has this file changed?" check,
+# if both still match we trust the row and never open the file again.
+TrackInfo = namedtuple(
+    "TrackInfo",
+    ["path", "mtime", "size", "duration", "title", "artist", "album", "codec", "bitrate"]
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path     TEXT PRIMARY KEY,
+    mtime    REAL NOT NULL,
+    size     INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    title    TEXT,
+    artist   TEXT,
+    album    TEXT,
+    codec    TEXT,
+    bitrate  INTEGER
+)
+"""
+
+SEEK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seek_tables (
+    path  TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size  INTEGER NOT NULL,
+    data  BLOB NOT NULL
+)
+"""
+
+# Gain in dB that brings a track to the loudness target, NULL when it couldn't be measured (so it isn't tried again
+# until the file changes)
+LOUDNESS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS loudness (
+    path  TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size  INTEGER NOT NULL,
+    gain  REAL
+)
+"""
+
+# Audio fingerprint of the first seconds of a track (see duplicates.py), little endian uint32s. NULL when the
+# file couldn't be decoded
+FINGERPRINT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    path  TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size  INTEGER NOT NULL,
+    data  BLOB
+)
+"""
+
+# Everything above is kept per path, prune() goes through all of them
+TABLES = ("tracks", "seek_tables", "loudness", "fingerprints")
+
+# SQLite caps the number of "?" in one statement, so big lookups go in chunks
+QUERY_CHUNK = 500
+
+
+def display_title(info, path):
+    # "Artist - Title" when the tags have it, file name otherwise
+    if info is not None and info.title:
+        if info.artist:
+            return f"{info.artist} - {info.title}"
+        return info.title
+    return os.path.basename(path)
+
+
+def probe_file(path, stat=None, source=None):
+    # The only place that actually opens an audio file for its tags.
+    # Returns None if the file is gone or mutagen can't make sense of it.
+    # With a source (an open StreamSource) the tags are read through it instead of opening the file a second time.
+    # Mutagen is imported here, a start with a fully indexed library never needs it
+    from mutagen import File
+    try:
+        if stat is None:
+            stat = source.stat() if source is not None else os.stat(path)
+        audio = File(source if source is not None else path, easy=True)
+    except Exception:
+        return None
+
+    if audio is None or audio.info is None:
+        return None
+
+    def first_tag(key):
+        # Easy tags are lists of strings, we only show the first one
+        try:
+            values = audio.tags.get(key) if audio.tags else None
+        except Exception:
+            values = None
+        return values[0] if values else None
+
+    return TrackInfo(
+        path=path,
+        mtime=stat.st_mtime,
+        size=stat.st_size,
+        duration=float(getattr(audio.info, "length", 0) or 0),
+        title=first_tag("title"),
+        artist=first_tag("artist"),
+        album=first_tag("album"),
+        codec=type(audio).__name__,
+        bitrate=int(getattr(audio.info, "bitrate", 0) or 0),
+    )
+
+
+class MetadataIndex:
+    """
+    On-disk cache of track metadata so we don't run mutagen over the same files on every start.
+
+    The connection is shared between the UI thread and background workers, so every access goes through one lock.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        folder = os.path.dirname(db_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        # WAL keeps readers from waiting on a writer, commits are also much cheaper
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(SCHEMA)
+        self._conn.execute(SEEK_SCHEMA)
+        self._conn.execute(LOUDNESS_SCHEMA)
+        self._conn.execute(FINGERPRINT_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get(self, path, source=None):
+        # 1. Cheap check, a stat is way less work than parsing tags. An open source already knows its size and date
+        try:
+            stat = source.stat() if source is not None else os.stat(path)
+        except OSError:
+            return None
+
+        # 2. Up to date row? Then we are done
+        info = self.lookup(path)
+        if self.is_fresh(info, stat):
+            return info
+
+        # 3. New or changed file, probe it once and remember the result
+        info = probe_file(path, stat, source)
+        if info is not None:
+            self.store_many([info])
+        return info
+
+    def is_fresh(self, info, stat):
+        return info is not None and info.mtime == stat.st_mtime and info.size == stat.st_size
+
+    def lookup(self, path):
+        # Just the stored row, no stat and no probing
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM tracks WHERE path = ?", (path,)).fetchone()
+        return TrackInfo(*row) if row else None
+
+    def lookup_many(self, paths):
+        # Returns {path: TrackInfo} for the paths we already know about
+        return {row[0]: TrackInfo(*row) for row in self._select("tracks", paths)}
+
+    def _select(self, table, paths):
+        # All rows of table for these paths, a list of tuples with the path first
+        paths = list(paths)
+        rows = []
+        with self._lock:
+            for start in range(0, len(paths), QUERY_CHUNK):
+                chunk = paths[start:start + QUERY_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                rows += self._conn.execute(f"SELECT * FROM {table} WHERE path IN ({marks})", chunk)
+        return rows
+
+    def store_many(self, infos):
+        # One transaction for the whole batch, commits are the slow part
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [tuple(info) for info in infos]
+            )
+            self._conn.commit()
+
+    def load_seek_table(self, path, stat):
+        # Raw bytes of a cached seek table, None if missing or the file changed since
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mtime, size, data FROM seek_tables WHERE path = ?", (path,)
+            ).fetchone()
+        if row and row[0] == stat.st_mtime and row[1] == stat.st_size:
+            return row[2]
+        return None
+
+    def store_seek_table(self, path, stat, data):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO seek_tables VALUES (?, ?, ?, ?)",
+                (path, stat.st_mtime, stat.st_size, data)
+            )
+            self._conn.commit()
+
+    def lookup_gains(self, paths):
+        # Returns {path: (mtime, size, gain)} for the paths that have been measured, the caller checks the stat
+        return {path: (mtime, size, gain) for path, mtime, size, gain in self._select("loudness", paths)}
+
+    def store_gains(self, rows):
+        # rows are (path, mtime, size, gain) tuples
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO loudness VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def lookup_fingerprints(self, paths):
+        # Returns {path: (mtime, size, data)} for the paths that have been fingerprinted, the caller checks the stat
+        return {path: (mtime, size, data) for path, mtime, size, data in self._select("fingerprints", paths)}
+
+    def store_fingerprints(self, rows):
+        # rows are (path, mtime, size, data) tuples
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def prune(self):
+        # Drop rows for files that no longer exist. Changed files don't need this,
+        # get() notices the new mtime/size and re-probes just that one file.
+        # Web tracks are left alone, a server that is down for a moment doesn't make them gone
+        with self._lock:
+            paths = [row[0] for row in self._conn.execute(
+                f"SELECT path FROM {TABLES[0]} " + " ".join(f"UNION SELECT path FROM {table}" for table in TABLES[1:])
+            )]
+        missing = [(path,) for path in paths if not is_url(path) and not os.path.exists(path)]
+        with self._lock:
+            for table in TABLES:
+                self._conn.executemany(f"DELETE FROM {table} WHERE path = ?", missing)
+            self._conn.commit()
+        return len(missing)
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from functools import wraps
+
+# Off unless asked for, MUSICPLAYER_PERF=1 in the environment or the F12 overlay turns it on
+ENV_SWITCH = "MUSICPLAYER_PERF"
+
+# Spans kept for the trace export, the oldest fall off the end
+TRACE_SPANS = 20000
+# Durations kept per name for the percentiles in the overlay and the summary
+SAMPLES = 512
+
+# start is time.perf_counter(), duration in seconds, thread the name of the thread it ran on
+Span = namedtuple("Span", ["name", "start", "duration", "thread"])
+
+
+class _NoSpan:
+    # What span() hands out while recording is off, entering and leaving it costs next to nothing
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class _OpenSpan:
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.record(self.name, self.start)
+        return False
+
+
+class PerfRecorder:
+    """
+    Timings of the player's hot paths, for the overlay (F12) and for the benchmarks.
+
+    Code marks what it wants measured with `with recorder.span("name"):` or the @recorder.timed("name") decorator, from any thread. While recording is off that is one attribute check, so the marks stay in the code for good. Every span goes into a ring buffer that exports as a Chrome trace (chrome://tracing, Perfetto), and the last SAMPLES durations per name give the percentiles.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=TRACE_SPANS)
+        self._samples = {}  # name -> deque of durations in seconds
+        self._counts = {}  # name -> (count, total seconds, max seconds), over everything since clear()
+
+    def span(self, name):
+        if not self.enabled:
+            return NO_SPAN
+        return _OpenSpan(self, name)
+
+    def timed(self, name):
+        # Decorator, for callbacks that run every frame (Clock.unschedule still finds the bound method)
+        def decorate(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(name, start)
+            return wrapper
+        return decorate
+
+    def record(self, name, start, end=None):
+        # For spans that start and end in different callbacks, like a folder import
+        if not self.enabled:
+            return
+        duration = (end or time.perf_counter()) - start
+        span = Span(name, start, duration, threading.current_thread().name)
+        with self._lock:
+            self._spans.append(span)
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=SAMPLES)
+            samples.append(duration)
+            count, total, longest = self._counts.get(name, (0, 0.0, 0.0))
+            self._counts[name] = (count + 1, total + duration, max(longest, duration))
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+            self._samples.clear()
+            self._counts.clear()
+        self.started = time.perf_counter()
+
+    def summary(self):
+        # {name: {count, mean, p50, p95, max, last}}, all times in ms. Percentiles over the last SAMPLES only
+        with self._lock:
+            samples = {name: sorted(durations) for name, durations in self._samples.items()}
+            last = {name: durations[-1] for name, durations in self._samples.items()}
+            counts = dict(self._counts)
+        result = {}
+        for name, durations in samples.items():
+            count, total, longest = counts[name]
+            result[name] = {
+                "count": count,
+                "mean": total / count * 1000,
+                "p50": durations[len(durations) // 2] * 1000,
+                "p95": durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000,
+                "max": longest * 1000,
+                "last": last[name] * 1000,
+            }
+        return result
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def export_json(self, path):
+        write_json(path, {"recorded_for": time.perf_counter() - self.started, "spans": self.summary()})
+
+    def export_trace(self, path):
+        # Trace Event Format, complete events ("X") in microseconds, one row per thread
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for span in self.spans():
+            tid = threads.setdefault(span.thread, len(threads) + 1)
+            events.append({
+                "name": span.name, "cat": "player", "ph": "X", "pid": pid, "tid": tid,
+                "ts": round((span.start - self.started) * 1e6, 1), "dur": round(span.duration * 1e6, 1),
+            })
+        events += [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}}
+            for thread, tid in threads.items()
+        ]
+        write_json(path, {"traceEvents": events, "displayTimeUnit": "ms"})
+
+
+def write_json(path, data):
+    # Under a temporary name first, like every other cache file here
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path + ".tmp", 'w', encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+# The one recorder everything reports to
+recorder = PerfRecorder(enabled=os.environ.get(ENV_SWITCH, "") not in ("", "0"))
+span = recorder.span
+timed = recorder.timed
+record = recorder.record
@@ -0,0 +1,140 @@
+import time
+
+from kivy.animation import Animation
+from kivy.clock import Clock
+from kivy.core.window import Window
+from kivy.graphics import Color, Rectangle
+from kivy.uix.label import Label
+
+import perf
+
+# Seconds between overlay updates, often enough to read along
+REFRESH = 0.5
+# A frame that took longer than this counts as a long one (two frames at 60 fps)
+LONG_FRAME = 2 / 60
+# Rows of the table, the slowest names by p95 first
+ROWS = 16
+
+
+class FrameWatch:
+    """
+    Frame times and the cost of Kivy's animations, recorded as "frame" and "animation" spans.
+
+    A callback on every Clock tick records the time since the last one. Animations run inside Kivy with no hook to time them from outside, so Animation._update gets wrapped with perf.timed() while the watch runs and stop() puts the original back. Animations started in between keep the wrapper until they end, it is a plain call once recording is off.
+    """
+
+    def __init__(self):
+        self._event = None
+        self._last = None
+        self._original = None  # Animation._update from before start(), while ours is in its place
+        self._wrapper = None
+
+    def start(self):
+        if self._event is not None:
+            return
+        self._original = Animation._update
+        self._wrapper = perf.timed("animation")(self._original)
+        Animation._update = self._wrapper
+        self._last = time.perf_counter()
+        self._event = Clock.schedule_interval(self._tick, 0)
+
+    def stop(self):
+        if self._event is None:
+            return
+        self._event.cancel()
+        self._event = None
+        # Unless somebody wrapped it again on top of ours, then theirs stays
+        if Animation._update is self._wrapper:
+            Animation._update = self._original
+        self._original = self._wrapper = None
+
+    def _tick(self, dt):
+        now = time.perf_counter()
+        perf.record("frame", self._last, now)
+        self._last = now
+
+
+class PerfOverlay(Label):
+    """
+    The F12 overlay, a table of the recorded spans drawn on top of whatever screen is showing.
+
+    Showing it turns recording on, hiding it turns it back off unless MUSICPLAYER_PERF had it on from the start.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(
+            font_name="RobotoMono-Regular", font_size="11sp", halign="left", valign="top",
+            size_hint=(None, None), padding=(8, 6), **kwargs
+        )
+        with self.canvas.before:
+            Color(0, 0, 0, 0.75)
+            self._background = Rectangle()
+        self.bind(texture_size=self._layout)
+        Window.bind(size=self._layout)
+
+        self.frames = FrameWatch()
+        self.shown = False
+        self.message = ""
+        self._from_env = perf.recorder.enabled
+        self._event = None
+        if self._from_env:
+            self.frames.start()
+
+    def toggle(self):
+        if self.shown:
+            self.hide()
+        else:
+            self.show()
+
+    def show(self):
+        if self.shown:
+            return
+        self.shown = True
+        perf.recorder.enabled = True
+        self.frames.start()
+        Window.add_widget(self)
+        self._event = Clock.schedule_interval(self.refresh, REFRESH)
+        self.refresh(0)
+
+    def hide(self):
+        if not self.shown:
+            return
+        self.shown = False
+        self._event.cancel()
+        Window.remove_widget(self)
+        if not self._from_env:
+            perf.recorder.enabled = False
+            self.frames.stop()
+
+    def say(self, message):
+        # One line under the table until the overlay is hidden
+        self.message = message
+        if self.shown:
+            self.refresh(0)
+
+    def refresh(self, dt):
+        summary = perf.recorder.summary()
+        frame = summary.pop("frame", None)
+        lines = ["F12 hide, Ctrl+F12 save", ""]
+        if frame:
+            long_frames = sum(1 for span in perf.recorder.spans() if span.name == "frame" and span.duration > LONG_FRAME)
+            lines.insert(0, f"{1000 / max(frame['p50'], 0.001):5.1f} fps   {long_frames} long frames   worst {frame['max']:.0f} ms")
+
+        lines.append(f"{'span':<20}{'count':>7}{'last':>8}{'p50':>8}{'p95':>8}{'max':>8}")
+        slowest = sorted(summary.items(), key=lambda item: item[1]["p95"], reverse=True)
+        for name, stats in slowest[:ROWS]:
+            lines.append(
+                f"{name[:19]:<20}{stats['count']:>7}{stats['last']:>8.2f}{stats['p50']:>8.2f}"
+                f"{stats['p95']:>8.2f}{stats['max']:>8.2f}"
+            )
+        if not summary:
+            lines.append("nothing recorded yet")
+        if self.message:
+            lines += ["", self.message]
+        self.text = "\n".join(lines)
+
+    def _layout(self, *args):
+        self.size = self.texture_size
+        self.pos = (0, Window.height - self.height)
+        self._background.pos = self.pos
+        self._background.size = self.size
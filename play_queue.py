@@ -0,0 +1,365 @@
+import random
+from bisect import bisect_left
+from collections import deque
+
+REPEAT_OFF = 'off'
+REPEAT_ALL = 'all'
+REPEAT_ONE = 'one'
+REPEAT_MODES = (REPEAT_OFF, REPEAT_ALL, REPEAT_ONE)
+
+# Room left between the sort keys of neighbouring tracks. A moved track takes the key halfway between
+# its new neighbours, only when there is no room left all keys get handed out again
+KEY_STEP = 1 << 16
+
+# How many tracks previous() can go back through
+HISTORY_LENGTH = 1000
+
+# Removed tracks stay in the shuffle order as gaps until there are this many, then it gets compacted
+MIN_COMPACT = 1024
+
+
+class PlayQueue:
+    """
+    Which track plays after which: playlist order or shuffle, repeat, "play next" and history.
+
+    Tracks are known by the id add() hands out. Ids stay the same while other tracks are added, removed or moved, so
+    nothing has to be fixed up afterwards. Positions (what the list on screen shows) come from a sorted list of keys,
+    one bisect away.
+
+    Shuffle is a stored permutation of the ids. Everything up to the cursor has been played, in the order it was played,
+    the rest is still to come, so previous() walks back through exactly what was heard. A removed track is skipped
+    where it sits in the permutation instead of being searched for.
+
+    "Play next" tracks play before the rest of the order without moving the place in it: once they are done, playback
+    continues after the track that was playing before them.
+    """
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.repeat = REPEAT_OFF
+        self.clear()
+
+    def clear(self):
+        self._next_id = 0
+        self._paths = {}  # id -> path, the tracks still in the playlist
+        self._keys = []  # Sort keys in playlist order
+        self._ids = []  # Ids in playlist order, lines up with _keys
+        self._key_of = {}  # id -> sort key
+
+        # The track playing now, and the one in the playlist order that playback continues from.
+        # They only differ while a "play next" track plays
+        self.current = None
+        self._anchor = None
+
+        self.shuffle = False
+        self._order = []  # Shuffled ids, may contain removed ones
+        self._order_index = {}  # id -> place in _order
+        self._cursor = -1  # Place of the anchor in _order
+        self._gaps = 0  # Removed ids still in _order
+        self._next_round = None  # With repeat on, the shuffle after this one once somebody asked for it
+
+        self._up_next = deque()
+        self._history = deque(maxlen=HISTORY_LENGTH)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, track_id):
+        return track_id in self._paths
+
+    def path(self, track_id):
+        return self._paths[track_id]
+
+    def id_at(self, position):
+        return self._ids[position]
+
+    def position(self, track_id):
+        return bisect_left(self._keys, self._key_of[track_id])
+
+    # Changing the playlist
+
+    def add(self, paths):
+        # Appends at the end, returns the new ids
+        first = self._next_id
+        key = self._keys[-1] + KEY_STEP if self._keys else 0
+        for path in paths:
+            track_id = self._next_id
+            self._next_id += 1
+            self._paths[track_id] = path
+            self._key_of[track_id] = key
+            self._keys.append(key)
+            self._ids.append(track_id)
+            key += KEY_STEP
+        added = list(range(first, self._next_id))
+
+        self._next_round = None
+        if self.shuffle and added:
+            # New tracks get mixed in with the part of the shuffle that is still to come: each one goes to the end and
+            # trades places with a random track after the cursor (or itself). Only as much work as tracks were added,
+            # a folder import adds a batch at a time. What was coming keeps its order, apart from the few tracks that
+            # were moved to the end
+            start = self._cursor + 1
+            for track_id in added:
+                self._extend_order([track_id])
+                last = len(self._order) - 1
+                self._swap(self.rng.randint(start, last), last)
+        return added
+
+    def remove(self, track_id):
+        position = self.position(track_id)
+        del self._keys[position]
+        del self._ids[position]
+        del self._key_of[track_id]
+        del self._paths[track_id]
+
+        self._next_round = None
+        # A "play next" track is playing, the place in the order is somewhere else and stays there
+        in_order = self.current == self._anchor
+
+        if track_id == self._anchor:
+            # The order carries on from the track before it
+            if self.shuffle:
+                self._cursor = self._alive_before(self._order_index[track_id])
+                self._anchor = self._order[self._cursor] if self._cursor >= 0 else None
+            else:
+                self._anchor = self._ids[position - 1] if position > 0 else None
+        if track_id == self.current:
+            # The track that slid into its place becomes the current one
+            self.current = None
+            if self._ids:
+                replacement = self._ids[min(position, len(self._ids) - 1)]
+                if in_order:
+                    self._set_current(replacement)
+                else:
+                    self.current = replacement
+
+        if self.shuffle:
+            self._gaps += 1
+            if self._gaps > MIN_COMPACT and self._gaps * 2 > len(self._order):
+                self._compact()
+
+    def move(self, track_id, position):
+        # Puts a track at another place in the playlist, one bisect and one list insert
+        old = self.position(track_id)
+        del self._keys[old]
+        del self._ids[old]
+        position = max(0, min(position, len(self._ids)))
+
+        before = self._keys[position - 1] if position > 0 else None
+        after = self._keys[position] if position < len(self._keys) else None
+        if before is None and after is None:
+            key = 0
+        elif after is None:
+            key = before + KEY_STEP
+        elif before is None:
+            key = after - KEY_STEP
+        else:
+            key = (before + after) // 2
+        self._keys.insert(position, key)
+        self._ids.insert(position, track_id)
+        self._key_of[track_id] = key
+
+        if key == before or key == after:
+            # No room left between the neighbours
+            self._renumber()
+
+    def play_next(self, track_id):
+        # Plays right after the current track, before anything else queued this way
+        self._up_next.appendleft(track_id)
+
+    # Modes
+
+    def set_shuffle(self, shuffle):
+        if shuffle == self.shuffle:
+            return
+        self.shuffle = shuffle
+        self._next_round = None
+        if not shuffle:
+            self._set_order([], -1)
+            return
+        # The track playing now counts as the first one played
+        first = self._anchor
+        self._set_order(self._shuffled(first), -1)
+        if first is not None:
+            self._cursor = 0
+
+    def set_repeat(self, mode):
+        if mode not in REPEAT_MODES:
+            raise ValueError(f"repeat has to be one of {REPEAT_MODES}, not {mode!r}")
+        self.repeat = mode
+
+    # Moving around
+
+    def jump(self, track_id):
+        # The user picked a track, the order carries on from there
+        if self.current is not None and self.current != track_id:
+            self._history.append(self.current)
+        self._set_current(track_id)
+        return track_id
+
+    def peek_next(self, auto=True):
+        # What next() would return, without going there
+        return self._next(auto, commit=False)
+
+    def next(self, auto=False):
+        """
+        Goes to the track after the current one and returns its id, None at the end.
+
+        auto is True when the track played to its end, that's when repeat-one plays it again. The next button skips
+        to the following track either way.
+        """
+        return self._next(auto, commit=True)
+
+    def previous(self):
+        # Back through what was played, or the track before in the order if there is no history
+        while self._history:
+            track_id = self._history.pop()
+            if track_id in self._paths:
+                self._set_current(track_id)
+                return track_id
+
+        anchor = self._anchor
+        if anchor is None:
+            return None
+        if self.shuffle:
+            cursor = self._alive_before(self._cursor)
+            if cursor < 0:
+                return None
+            track_id = self._order[cursor]
+        else:
+            position = self.position(anchor)
+            if position == 0:
+                return None
+            track_id = self._ids[position - 1]
+        self._set_current(track_id)
+        return track_id
+
+    def has_previous(self):
+        if any(track_id in self._paths for track_id in self._history):
+            return True
+        if self._anchor is None:
+            return False
+        if self.shuffle:
+            return self._alive_before(self._cursor) >= 0
+        return self.position(self._anchor) > 0
+
+    def has_next(self):
+        return self.peek_next(auto=False) is not None
+
+    def _next(self, auto, commit):
+        if auto and self.repeat == REPEAT_ONE and self.current in self._paths:
+            return self.current
+
+        # "Play next" tracks first, the place in the order stays where it was
+        for index, track_id in enumerate(self._up_next):
+            if track_id in self._paths:
+                if commit:
+                    for _ in range(index + 1):
+                        self._up_next.popleft()
+                    if self.current is not None:
+                        self._history.append(self.current)
+                    self.current = track_id
+                return track_id
+
+        track_id = self._following()
+        if track_id is None and self.repeat != REPEAT_OFF and self._ids:
+            # Around again, a new shuffle or the top of the list
+            if not self.shuffle:
+                track_id = self._ids[0]
+            else:
+                # Shuffled as soon as somebody asks, so peeking and going there agree on the track
+                if self._next_round is None:
+                    self._next_round = self._shuffled(None)
+                track_id = self._next_round[0]
+                if commit:
+                    self._set_order(self._next_round, -1)
+                    self._next_round = None
+
+        if track_id is not None and commit:
+            if self.current is not None:
+                self._history.append(self.current)
+            self._set_current(track_id)
+        return track_id
+
+    def _following(self):
+        # Next track in the order after the anchor, ignoring repeat
+        if self.shuffle:
+            cursor = self._cursor + 1
+            order = self._order
+            while cursor < len(order) and order[cursor] not in self._paths:
+                cursor += 1
+            return order[cursor] if cursor < len(order) else None
+        if self._anchor is None:
+            return self._ids[0] if self._ids else None
+        position = self.position(self._anchor) + 1
+        return self._ids[position] if position < len(self._ids) else None
+
+    def _set_current(self, track_id):
+        self.current = track_id
+        self._anchor = track_id
+        if self.shuffle:
+            self._place_in_shuffle(track_id)
+
+    # Shuffle order
+
+    def _place_in_shuffle(self, track_id):
+        # Makes track_id the last played entry of the permutation, everything after it is still to come
+        index = self._order_index[track_id]
+        if index == self._cursor:
+            return
+        if index > self._cursor:
+            # Not played yet, it trades places with the first track still to come
+            self._cursor += 1
+            self._swap(index, self._cursor)
+            return
+        # Already played (we went back), the cursor goes back with it
+        self._cursor = index
+
+    def _swap(self, a, b):
+        order = self._order
+        order[a], order[b] = order[b], order[a]
+        self._order_index[order[a]] = a
+        self._order_index[order[b]] = b
+
+    def _shuffled(self, first):
+        # The whole playlist in random order, starting with `first` if given. A new round doesn't
+        # start with the track that just ended
+        ids = list(self._ids)
+        self.rng.shuffle(ids)
+        if first is not None:
+            ids.remove(first)
+            ids.insert(0, first)
+        elif len(ids) > 1 and ids[0] == self.current:
+            ids[0], ids[-1] = ids[-1], ids[0]
+        return ids
+
+    def _set_order(self, ids, cursor):
+        self._order = []
+        self._order_index = {}
+        self._gaps = 0
+        self._extend_order(ids)
+        self._cursor = cursor
+
+    def _alive_before(self, cursor):
+        # Place of the last track before cursor that is still in the playlist, -1 if there is none
+        cursor -= 1
+        while cursor >= 0 and self._order[cursor] not in self._paths:
+            cursor -= 1
+        return cursor
+
+    def _extend_order(self, ids):
+        start = len(self._order)
+        self._order.extend(ids)
+        for index, track_id in enumerate(ids, start):
+            self._order_index[track_id] = index
+
+    def _compact(self):
+        # Drops the removed ids from the permutation, the cursor stays on the same track
+        alive = self._paths
+        played = [track_id for track_id in self._order[:self._cursor + 1] if track_id in alive]
+        upcoming = [track_id for track_id in self._order[self._cursor + 1:] if track_id in alive]
+        self._set_order(played + upcoming, len(played) - 1)
+
+    def _renumber(self):
+        self._keys = list(range(0, len(self._ids) * KEY_STEP, KEY_STEP))
+        self._key_of = dict(zip(self._ids, self._keys))
@@ -0,0 +1,40 @@
+def get_pos():
+    # pygame is imported on first use, importing this module must stay cheap (see PlayerEngine.start)
+    from pygame import mixer
+    return mixer.music.get_pos()
+
+
+class PlaybackClock:
+    """
+    Where the song really is, read from the mixer instead of counted by the UI.
+
+    mixer.music.get_pos() is the number of milliseconds the mixer has actually played since the last play() call.
+    It comes from the audio callback, so it stops while paused and never drifts, but it knows nothing about play(start=...).
+    That part is the offset we keep here.
+    """
+
+    def __init__(self):
+        self.offset = 0.0
+        self._base_ms = 0
+
+    def restart(self, offset):
+        # Call this right after play(start=offset), or when a queued file takes over
+        self.offset = float(offset)
+        self._base_ms = max(0, get_pos())
+
+    def reset(self):
+        self.offset = 0.0
+        self._base_ms = 0
+
+    def position(self):
+        raw = get_pos()
+
+        # -1 means nothing is loaded or playing, so the last known offset is all we have
+        if raw < 0:
+            return self.offset
+
+        # The counter went backwards, the mixer restarted it (a queued file started playing)
+        if raw < self._base_ms:
+            self._base_ms = 0
+
+        return self.offset + (raw - self._base_ms) / 1000
@@ -0,0 +1,853 @@
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import perf
+from crossfade import MAX_CROSSFADE, fade_in, load_tail, skip_start
+from metadata_index import probe_file
+from play_queue import PlayQueue
+from playback_clock import PlaybackClock
+from streaming import PREFETCH_BYTES, open_source
+
+log = logging.getLogger("player")
+
+# pygame (and the NumPy it pulls in) is a big part of the start up time. The engine thread imports it
+# and opens the mixer in the background, see start()
+mixer = None
+
+STOPPED = 'stopped'
+PLAYING = 'playing'
+PAUSED = 'paused'
+
+EVENTS = ('on_ready', 'on_state', 'on_track', 'on_position', 'on_track_end')
+
+# How often the volume of a track that fades in gets raised, in seconds
+FADE_STEP = 0.03
+# A prepared track end is still used when playback is this far into it (the engine thread woke up late). It then starts
+# just as far in, nothing is heard twice. Further in (a seek into the last seconds) the track plays to its end uncut
+TAIL_SLACK = 0.25
+# How often the engine thread looks whether a track that was just started is audible yet, in seconds
+FIRST_AUDIO_POLL = 0.005
+
+
+class PlayerEngine:
+    """
+    Everything about playback, without a window.
+
+    The engine owns the mixer, the play queue (playlist order, shuffle, repeat) and the play/pause state. Its own thread
+    watches for the end of the track (and switches over to the queued one in gapless mode) and reports the position,
+    nobody has to poll it.
+    Listeners are added with bind(), the events are:
+        on_ready()                  -> the mixer is open, commands before that wait for it
+        on_state(state)             -> 'stopped', 'playing' or 'paused'
+        on_track(index, path, info) -> a track was loaded, info is the TrackInfo or None
+        on_position(seconds)        -> every position_interval while playing
+        on_track_end(path)          -> the track played to its end
+    Callbacks go through dispatch(callback). The default just calls them on whatever thread the event happened on,
+    a UI passes something that hands them over to its own thread.
+    """
+
+    def __init__(self, metadata=None, seek_index=None, dispatch=None, position_interval=0.5, loudness=None):
+        self.metadata = metadata
+        self.seek_index = seek_index
+        self.loudness = loudness
+        self.dispatch = dispatch or (lambda callback: callback())
+        self.position_interval = position_interval
+
+        # Tracks come in with add() and are known by the ids the queue hands out, positions are only for the UI
+        self.queue = PlayQueue()
+        self.path = ''
+        self.info = None
+        self.state = STOPPED
+        self.volume = 0.5
+        # Normalization: the current track's gain in dB goes on top of the volume
+        self.normalize = True
+        self.track_gain = 0.0
+        self.clock = PlaybackClock()
+
+        # Gapless playback: the next track is queued in the mixer while the current one plays,
+        # so pygame switches over on its own at the exact end of the file
+        self.gapless = True
+        self.queued_path = ''
+        self.queued_id = None
+        self._queued_source = None  # The source the mixer got for the queued track, None when it got the path
+        # Every track is played from a StreamSource that reads this many bytes ahead of the decoder.
+        # The tags are read through it too, one handle per track (see streaming.py)
+        self.prefetch_bytes = PREFETCH_BYTES
+        self._source = None  # Opened for the current track, not handed to the mixer yet
+        self._next_source = None  # (track id, source) opened ahead for a track a crossfade will start
+
+        # True while the mixer plays a stream opened at a seek point instead of the plain file
+        self.spliced = False
+
+        # Crossfade in seconds, 0 is off. The last seconds of a track are decoded ahead into a Sound that already
+        # fades out. At the change it plays on its own channel while the next track fades in on the music stream
+        self.crossfade = 0.0
+        self._tail = None  # (path, start time, Sound) of the current track, prepared in the background
+        self._fade_channel = None
+        self._fade_in = 0.0  # Length of the fade in on the music stream, 0 when there is none
+        self._fade_level = 1.0
+        self._prepared_id = None  # Next track that a crossfade will start, nothing queued in the mixer for it
+
+        # Instrumentation, all in milliseconds
+        self.mixer_open_ms = 0
+        self.last_seek_ms = 0
+        self.last_track_change_ms = 0
+        # From the command that started a track until the mixer had played some of it
+        self.last_first_audio_ms = 0
+        self._awaiting_audio = None  # perf_counter() of that command while we wait
+
+        self._loaded = False
+        self._start_at = 0.0
+        self._track_end_at = None
+        self._listeners = {event: [] for event in EVENTS}
+        # Reentrant, listeners called on our own thread may ask the engine for things again
+        self._lock = threading.RLock()
+        self._ready = threading.Event()
+        # ready only says the mixer was tried, this says it really opened (no sound card, no pygame: it didn't)
+        self.mixer_open = False
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        if loudness is not None:
+            loudness.on_gain = self._on_gain
+
+    # Events
+
+    def bind(self, **callbacks):
+        for event, callback in callbacks.items():
+            self._listeners[event].append(callback)
+
+    def unbind(self, **callbacks):
+        for event, callback in callbacks.items():
+            if callback in self._listeners[event]:
+                self._listeners[event].remove(callback)
+
+    def emit(self, event, *args):
+        for callback in list(self._listeners[event]):
+            self.dispatch(lambda callback=callback: callback(*args))
+
+    # Lifetime
+
+    def start(self):
+        # Returns right away, the engine thread opens the mixer first thing.
+        # Call it once the window exists, SDL doesn't like two threads initializing it at the same time
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _open_mixer(self):
+        global mixer
+        started = time.perf_counter()
+        try:
+            from pygame import mixer as pygame_mixer
+            mixer = pygame_mixer
+            if not mixer.get_init():
+                mixer.init()
+            # Channel 0 is ours, Sounds played by anybody else can't take it away from a crossfade
+            mixer.set_reserved(1)
+            self._fade_channel = mixer.Channel(0)
+            self.mixer_open = True
+            self._apply_volume()
+        except Exception as e:
+            # No sound card or no pygame, commands will fail loudly, but they won't hang
+            log.error(f"Player: could not open the mixer: {e}")
+        self.mixer_open_ms = (time.perf_counter() - started) * 1000
+        self._ready.set()
+        self.emit('on_ready')
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    @contextmanager
+    def _locked(self):
+        # Every command waits for the mixer, then they run one at a time.
+        # A command before start() starts the engine, otherwise it would wait forever
+        if self._thread is None:
+            self.start()
+        self._ready.wait()
+        with self._lock:
+            yield
+
+    def shutdown(self):
+        self._stopped = True
+        self._wake.set()
+        if mixer is not None and mixer.get_init():
+            mixer.music.stop()
+        with self._lock:
+            self._drop_sources()
+
+    # State
+
+    @property
+    def duration(self):
+        return self.info.duration if self.info else 0
+
+    @property
+    def playing(self):
+        return self.state == PLAYING
+
+    @property
+    def paused(self):
+        return self.state == PAUSED
+
+    @property
+    def started(self):
+        # A track is in the mixer, playing or paused
+        return self.state != STOPPED
+
+    @property
+    def index(self):
+        # Position of the current track in the playlist
+        current = self.queue.current
+        return self.queue.position(current) if current is not None else 0
+
+    @property
+    def has_next(self):
+        return self.queue.has_next()
+
+    @property
+    def has_previous(self):
+        return self.queue.has_previous()
+
+    def position(self):
+        if self.state == STOPPED:
+            return self._start_at
+        return self.clock.position()
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            self.emit('on_state', state)
+
+    # Commands, safe to call from any thread
+
+    def add(self, paths):
+        # Appends to the playlist, returns the ids of the new tracks
+        with self._lock:
+            added = self.queue.add(paths)
+            self._refresh_queued()
+            return added
+
+    def clear(self):
+        # Empty playlist, nothing loaded
+        with self._lock:
+            self.unload()
+            self.queue.clear()
+
+    def load(self, index):
+        # Makes the track at index the current one without playing it
+        with self._locked():
+            self._load_track(self.queue.jump(self.queue.id_at(index)))
+
+    def _load_track(self, track_id, keep_fade=False, changing=False):
+        # changing: the track gets started right after this, see _halt()
+        self._halt(keep_fade, changing)
+        self._tail = None
+        self.path = self.queue.path(track_id)
+        if self._source is not None:
+            # Loaded before but never played
+            self._source.close()
+        # Opened (and reading ahead) from here on, the tags come through the same handle the decoder gets
+        self._source = self._take_next_source(track_id) or open_source(self.path, self.prefetch_bytes)
+        if self.metadata:
+            self.info = self.metadata.get(self.path, self._source)
+        else:
+            self.info = probe_file(self.path, source=self._source)
+        self._loaded = True
+        self.track_gain = self._gain_for(self.path)
+        self._apply_volume()
+        self._start_at = 0.0
+        self.spliced = False
+
+        # Seek table gets loaded (or built once) in the background while the song plays
+        if self.seek_index:
+            self.seek_index.prepare(self.path)
+        self.emit('on_track', self.index, self.path, self.info)
+
+    def unload(self):
+        # Nothing loaded anymore, also releases the file lock the mixer holds on the current file.
+        # Without an open mixer nothing can be loaded in it, no need to wait for one
+        with self._lock:
+            if self.mixer_open:
+                self._halt()
+                mixer.music.unload()
+            self._drop_sources()
+            self.path = ''
+            self.info = None
+            self._loaded = False
+            self._start_at = 0.0
+
+    def play(self, index=None):
+        # Starts the current track (or the one at index) from where the slider was left
+        started = time.perf_counter()
+        with self._locked():
+            if index is not None:
+                self.load(index)
+            elif not self._loaded:
+                if not len(self.queue):
+                    return
+                if self.queue.current is None:
+                    self.queue.jump(self.queue.id_at(0))
+                self._load_track(self.queue.current)
+            self._start(started)
+
+    def _start(self, requested_at=None):
+        with perf.span("music.load"):
+            self._load_music()
+        self.spliced = False
+        self._awaiting_audio = requested_at or time.perf_counter()
+        with perf.span("music.play"):
+            mixer.music.play(start=self._start_at)
+        self.clock.restart(self._start_at)
+        self._set_state(PLAYING)
+
+        # End of track has its own deadline, and the next song starts loading in the background
+        self._schedule_track_end()
+        self._prepare_next()
+
+    def pause(self):
+        with self._locked():
+            if self.state != PLAYING:
+                return
+            mixer.music.pause()
+            self._fade_channel.pause()
+            self._track_end_at = None
+            self._awaiting_audio = None
+            self._set_state(PAUSED)
+
+    def resume(self):
+        with self._locked():
+            if self.state != PAUSED:
+                return
+            mixer.music.unpause()
+            self._fade_channel.unpause()
+            self._set_state(PLAYING)
+            self._schedule_track_end()
+
+    def toggle(self):
+        # What the play button does
+        with self._locked():
+            if self.state == STOPPED:
+                self.play()
+            elif self.state == PLAYING:
+                self.pause()
+            else:
+                self.resume()
+
+    def stop(self):
+        with self._locked():
+            self._halt()
+            self._start_at = 0.0
+
+    def _halt(self, keep_fade=False, changing=False):
+        # keep_fade: a crossfade is starting, the end of the old track keeps playing on its channel.
+        # changing: the next track starts right away, the state stays as it is. Listeners only hear 'stopped'
+        # for a real stop (stop(), unload(), the end of the playlist), never in the middle of a track change
+        mixer.music.stop()
+        self._awaiting_audio = None
+        if not keep_fade:
+            self._end_fade()
+        self.queued_path = ''
+        self.queued_id = None
+        self._queued_source = None
+        self._prepared_id = None
+        self._track_end_at = None
+        self.clock.reset()
+        if not changing:
+            self._set_state(STOPPED)
+
+    def seek(self, position):
+        with self._locked():
+            position = max(0.0, float(position))
+            if self.state == STOPPED:
+                # Remembered for when play() is pressed
+                self._start_at = position
+                return
+            self._end_fade()
+
+            """
+            alright so here, we first use play function to jump to our desired position. Say, for a brief, let it be in nanosecond, my music will play,
+            but immediately the pause below will be executed, and it will pause it
+
+            Because mixer.music.play(start=value) is the only reliable way in Pygame to move the playhead to a specific timestamp,
+            you have to "kickstart" the engine for a split second before freezing it again.
+
+            Why this works (and why it's necessary)
+            Pygame's mixer behaves like an old-school tape deck. You can't just "move the tape" while the power is off; the engine has to be "Engaged" (play)
+            for the playhead to find the correct byte in the file.
+
+            The "Jump": mixer.music.play(start=value) resets the internal buffer and starts streaming from the new location.
+
+            The "Freeze": mixer.music.pause() happens so fast (in microseconds) that the user's ears won't even process a sound. To them, it looks like the player
+            just "skipped" while paused.
+            """
+            self._jump_to(position)
+            self.clock.restart(position)
+
+            if self.state == PAUSED:
+                # Playing is the only way to move the playhead, pause again right away
+                mixer.music.pause()
+            else:
+                self._schedule_track_end()
+
+    def skip(self, seconds):
+        # Relative seek from where the mixer really is. Running past the end stops, like the song ended
+        with self._locked():
+            position = self.position() + seconds
+            if self.started and self.duration and position > self.duration:
+                self.stop()
+                return
+            self.seek(position)
+
+    def next(self):
+        with self._locked():
+            track_id = self.queue.next()
+            if track_id is not None:
+                self._change_track(track_id)
+
+    def previous(self):
+        with self._locked():
+            track_id = self.queue.previous()
+            if track_id is not None:
+                self._change_track(track_id)
+
+    def _crossfade_to(self, track_id, tail):
+        # Called at the start of the prepared tail. The tail takes over from the music stream at the level the
+        # track plays at now, the next track starts on the music stream at level 0
+        ended_path = self.path
+        self._tail = None
+        sound = tail[2]
+        # The music stream has played on past the start of the tail if we woke up late, the tail skips as much
+        late = self.clock.position() - tail[1]
+        if late > 0:
+            sound = skip_start(sound, late)
+            if sound is None:
+                self._change_track(track_id)
+                return
+        self._fade_channel.set_volume(self._track_volume())
+        self._fade_channel.play(sound)
+        self.emit('on_track_end', ended_path)
+
+        started = time.perf_counter()
+        self._fade_in = sound.get_length()
+        self._fade_level = 0.0
+        self._load_track(track_id, keep_fade=True, changing=True)
+        self._start(started)
+        self.last_track_change_ms = (time.perf_counter() - started) * 1000
+        perf.record("crossfade start", started)
+        log.info(f"Player: crossfade of {self._fade_in:.1f}s, next track started after {self.last_track_change_ms:.1f} ms")
+
+    def _change_track(self, track_id):
+        started = time.perf_counter()
+        self._load_track(track_id, changing=True)
+        self._start(started)
+        self.last_track_change_ms = (time.perf_counter() - started) * 1000
+        perf.record("track change", started)
+        log.info(f"Player: track change (stop + load + play) took {self.last_track_change_ms:.1f} ms")
+
+    def remove(self, index):
+        # Takes a track out of the playlist. If it was the current one, the track that
+        # slid into its place becomes current, it gets loaded when played
+        with self._locked():
+            track_id = self.queue.id_at(index)
+            if track_id == self.queue.current:
+                self._halt()
+                self._loaded = False
+                self._start_at = 0.0
+            self.queue.remove(track_id)
+            self._refresh_queued()
+
+    def play_next(self, index):
+        # The track at index plays after the current one
+        with self._lock:
+            self.queue.play_next(self.queue.id_at(index))
+            self._refresh_queued()
+
+    def set_shuffle(self, shuffle):
+        with self._lock:
+            self.queue.set_shuffle(shuffle)
+            self._refresh_queued()
+
+    def set_repeat(self, mode):
+        with self._lock:
+            self.queue.set_repeat(mode)
+            self._refresh_queued()
+
+    def set_volume(self, volume):
+        # Before the mixer is open this only remembers the volume, _open_mixer applies it
+        self.volume = volume
+        if self.mixer_open:
+            with self._lock:
+                self._apply_volume()
+
+    def set_crossfade(self, seconds):
+        # 0 turns it off. The current track gets a new tail (or none) right away
+        with self._lock:
+            self.crossfade = max(0.0, min(float(seconds), MAX_CROSSFADE))
+            self._tail = None
+            if self.state == PLAYING:
+                self._schedule_track_end()
+            if self.state != STOPPED:
+                self._prepare_next()
+
+    def set_normalize(self, normalize):
+        self.normalize = normalize
+        if self.mixer_open:
+            with self._lock:
+                self._apply_volume()
+
+    # Loudness
+
+    def _gain_for(self, path):
+        # Unknown gain plays at 0 dB, asking for it puts the track at the front of the analyzer's queue
+        gain = self.loudness.gain(path) if self.loudness else None
+        return gain or 0.0
+
+    def _track_volume(self):
+        # The slider volume with the track's gain on top. The mixer can't go above 1, so a quiet track
+        # played at full volume stays as quiet as it is, and a gain can never make anything clip
+        volume = self.volume
+        if self.normalize and self.track_gain:
+            volume = min(1.0, volume * 10 ** (self.track_gain / 20))
+        return volume
+
+    def _apply_volume(self):
+        mixer.music.set_volume(self._track_volume() * self._fade_level)
+
+    def _on_gain(self, path, gain):
+        # Called on the analyzer's thread. The track playing now only gets measured once it started,
+        # its level changes a moment in. Every other track is measured before it plays
+        with self._lock:
+            if path == self.path and self.mixer_open:
+                self.track_gain = gain or 0.0
+                self._apply_volume()
+
+    def _jump_to(self, position):
+        # With a seek table we open the file right at the nearest frame and pygame only decodes the small rest.
+        # Without one, play(start=...) has to decode everything from the start of the file (VBR MP3 especially)
+        started = time.perf_counter()
+        spliced = self.seek_index.open_at(self.path, position) if self.seek_index else None
+
+        if spliced is None:
+            if self.spliced:
+                # Still holding a spliced stream from an earlier seek, go back to the real file
+                with perf.span("music.load"):
+                    self._keep_queued(self._load_music)
+                self.spliced = False
+            with perf.span("music.play(start)"):
+                mixer.music.play(start=position)
+        else:
+            source, point, namehint = spliced
+            with perf.span("music.load"):
+                self._keep_queued(lambda: mixer.music.load(source, namehint))
+            self.spliced = True
+            with perf.span("music.play(start)"):
+                mixer.music.play(start=position - point)
+
+        self.last_seek_ms = (time.perf_counter() - started) * 1000
+        perf.record("seek", started)
+        log.debug(f"Player: seek to {position:.1f}s took {self.last_seek_ms:.1f} ms")
+
+    # Streaming
+
+    def _load_music(self):
+        # The current track into the mixer, through the source _load_track opened if it is still there.
+        # The mixer owns the source from here on and closes it once it is done with the track
+        source, self._source = self._source, None
+        if source is None:
+            source = open_source(self.path, self.prefetch_bytes)
+        if source is None:
+            # Can't be opened, pygame gets the path and raises the error
+            mixer.music.load(self.path)
+            return
+        source.seek(0)
+        mixer.music.load(source, source.namehint)
+
+    def _queue_music(self, path, source=None):
+        source = source or open_source(path, self.prefetch_bytes)
+        self._queued_source = source
+        if source is None:
+            mixer.music.queue(path)
+            return
+        source.seek(0)
+        mixer.music.queue(source, source.namehint)
+
+    def _keep_queued(self, load):
+        # play(start=...) leaves the mixer queue alone, but music.load() empties it and closes the queued source.
+        # The source stays open through the load and goes back in, with everything it already read ahead
+        # (a seek doesn't open the next file again, over HTTP neither)
+        source = self._queued_source
+        if source is not None:
+            source.keep_open = True
+        try:
+            load()
+        finally:
+            if source is not None:
+                source.keep_open = False
+        if self.queued_path:
+            self._queue_music(self.queued_path, source)
+
+    def _take_next_source(self, track_id):
+        # The source opened ahead for track_id, None if there is none. One for another track gets closed
+        prepared, self._next_source = self._next_source, None
+        if prepared is None:
+            return None
+        prepared_id, source = prepared
+        if prepared_id == track_id:
+            return source
+        source.close()
+        return None
+
+    def _drop_sources(self):
+        # Sources that never made it into the mixer, the mixer closes its own
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+        self._take_next_source(None)
+
+    def _first_audio(self):
+        # The mixer has played the first bit of the track that was just started
+        self.last_first_audio_ms = (time.perf_counter() - self._awaiting_audio) * 1000
+        perf.record("time to first audio", self._awaiting_audio)
+        self._awaiting_audio = None
+        log.info(f"Player: first audio {self.last_first_audio_ms:.1f} ms after the track was started")
+
+    # Crossfade
+
+    def _fade_length(self):
+        # Never more than half the track, a short one would be fading out before it really started
+        if not self.crossfade or not self.duration:
+            return 0.0
+        return min(self.crossfade, self.duration / 2)
+
+    def _usable_tail(self):
+        # The prepared end of the current track, unless playback is already past its start (a seek, or it was
+        # ready too late). Then the track plays to its real end and changes without a fade
+        tail = self._tail
+        if tail is None or tail[0] != self.path or self.clock.position() > tail[1] + TAIL_SLACK:
+            return None
+        return tail
+
+    def _step_fade(self):
+        # Follows the track's own clock, pausing in the middle of a fade just holds it where it is
+        progress = self.clock.position() / self._fade_in
+        if progress >= 1:
+            self._fade_in = 0.0
+            self._fade_level = 1.0
+        else:
+            self._fade_level = fade_in(progress)
+        self._apply_volume()
+
+    def _end_fade(self):
+        # Anything the user does in the middle of a crossfade ends it, the new track jumps to its full level
+        if self._fade_channel is not None:
+            self._fade_channel.stop()
+        if self._fade_in or self._fade_level != 1.0:
+            self._fade_in = 0.0
+            self._fade_level = 1.0
+            self._apply_volume()
+
+    # Gapless
+
+    def _prepare_next(self):
+        self.queued_path = ''
+        self.queued_id = None
+        self._queued_source = None
+        self._prepared_id = None
+        track_id = self.queue.peek_next()
+        fade = self._fade_length()
+        if (not self.gapless and not fade) or track_id is None:
+            return
+
+        path = self.queue.path(track_id)
+        args = (track_id, path, self.path, self.duration - fade, fade)
+        threading.Thread(target=self._prebuffer_next, args=args, daemon=True).start()
+
+    def _refresh_queued(self):
+        # The playlist or the play order changed, the track queued in the mixer may not be the next one anymore.
+        # Pygame can't take a queued file back, a wrong one gets caught in _on_track_end
+        next_id = self.queue.peek_next()
+        if self.state != STOPPED and next_id != self.queued_id and next_id != self._prepared_id:
+            self._prepare_next()
+
+    def _prebuffer_next(self, track_id, path, current, fade_start, fade):
+        # Runs on a worker thread. With crossfade on, the end of the current track gets decoded first.
+        # Then the next file gets opened, its source starts reading ahead right away and its tags go into the index
+        # through it, so starting it later doesn't wait on the disk
+        tail = self._tail
+        if fade and (tail is None or tail[:2] != (current, fade_start)):
+            if self.seek_index:
+                self.seek_index.load(current)
+            sound = load_tail(current, fade_start, fade_start + fade, self.seek_index)
+            tail = (current, fade_start, sound) if sound is not None else None
+            with self._lock:
+                if tail is not None and self.path == current and self.crossfade:
+                    # The track now ends where its tail starts
+                    self._tail = tail
+                    if self.state == PLAYING:
+                        self._schedule_track_end()
+
+        source = open_source(path, self.prefetch_bytes)
+        if source is None:
+            return
+        if self.metadata:
+            self.metadata.get(path, source)
+        if self.loudness:
+            self.loudness.gain(path)
+
+        with self._lock:
+            # The playlist or the track may have changed while we were reading
+            if self.state == STOPPED or self.queue.peek_next() != track_id:
+                source.close()
+                return
+            if self._usable_tail() is not None or not self.gapless:
+                # Nothing goes into the mixer's queue, the crossfade (or the next track change) starts this one
+                if self._usable_tail() is not None:
+                    self._prepared_id = track_id
+                self._take_next_source(None)
+                self._next_source = (track_id, source)
+                return
+            self._queue_music(path, source)
+            self.queued_path = path
+            self.queued_id = track_id
+
+    # Engine thread
+
+    def _schedule_track_end(self):
+        # One deadline for the exact moment the song runs out, the engine thread sleeps until then
+        # Unknown length (no tags), then only the mixer running dry ends the track.
+        # With a crossfade prepared, the track is done where its tail starts
+        if self.duration:
+            tail = self._usable_tail()
+            end = tail[1] if tail else self.duration
+            remaining = max(0, end - self.clock.position())
+            self._track_end_at = time.perf_counter() + remaining
+        else:
+            self._track_end_at = None
+        self._wake.set()
+
+    def _run(self):
+        self._open_mixer()
+        next_position = 0
+        while not self._stopped:
+            now = time.perf_counter()
+            timeout = None
+            if self.state == PLAYING:
+                timeout = max(0, next_position - now)
+                if self._track_end_at is not None:
+                    timeout = min(timeout, max(0, self._track_end_at - now))
+                if self._fade_in:
+                    timeout = min(timeout, FADE_STEP)
+                if self._awaiting_audio is not None:
+                    timeout = min(timeout, FIRST_AUDIO_POLL)
+
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._stopped:
+                return
+
+            with self._lock:
+                if self.state != PLAYING:
+                    continue
+                now = time.perf_counter()
+                if self._awaiting_audio is not None and mixer.music.get_pos() > 0:
+                    self._first_audio()
+                # Past the deadline, or the mixer ran dry early (the tags had the length wrong)
+                if (self._track_end_at is not None and now >= self._track_end_at) or not mixer.music.get_busy():
+                    self._on_track_end()
+                    continue
+                if self._fade_in:
+                    self._step_fade()
+                if now >= next_position:
+                    next_position = now + self.position_interval
+                    if self._listeners['on_position']:
+                        self.emit('on_position', self.clock.position())
+
+    def _on_track_end(self):
+        tail = self._usable_tail()
+        if tail is not None and mixer.music.get_busy():
+            # Not the real end, the crossfade starts here
+            track_id = self.queue.next(auto=True)
+            if track_id is not None:
+                self._crossfade_to(track_id, tail)
+                return
+            # Nothing comes after it anymore, the track plays to its real end
+            self._tail = None
+            self._schedule_track_end()
+            return
+
+        ended_path = self.path
+        ended_at = self._track_end_at or time.perf_counter()
+        track_id = self.queue.next(auto=True)
+
+        if track_id is not None and track_id == self.queued_id:
+            # Pygame already started the queued file, we only have to catch up
+            self.path = self.queued_path
+            self.info = self.metadata.get(self.path) if self.metadata else probe_file(self.path)
+            self.queued_path = ''
+            self.queued_id = None
+            self._queued_source = None
+            self.spliced = False
+            self.clock.restart(0)
+            # The mixer already plays the new file at the old track's level, the gain follows right away
+            self.track_gain = self._gain_for(self.path)
+            self._apply_volume()
+
+            # How far behind the real end of the previous track we switched over
+            # (measured before _schedule_track_end moves the deadline to the new song)
+            self.last_track_change_ms = (time.perf_counter() - ended_at) * 1000
+            perf.record("gapless catch-up", ended_at)
+            self._schedule_track_end()
+            self._prepare_next()
+            if self.seek_index:
+                self.seek_index.prepare(self.path)
+
+            self.emit('on_track_end', ended_path)
+            self.emit('on_track', self.index, self.path, self.info)
+            log.info(f"Player: gapless track change, caught up after {self.last_track_change_ms:.1f} ms")
+            return
+
+        if track_id is not None:
+            # Gapless is off, or the queued file wasn't the next track anymore
+            self.emit('on_track_end', ended_path)
+            self._change_track(track_id)
+            return
+
+        # End of the playlist
+        self._halt()
+        self._start_at = 0.0
+        self.emit('on_track_end', ended_path)
+
+
+def main():
+    # Headless player: python player_engine.py song.mp3 [more.mp3 ...]
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    paths = [path.replace('\\', '/') for path in sys.argv[1:] if os.path.isfile(path)]
+    if not paths:
+        print("usage: python player_engine.py song.mp3 [more.mp3 ...]")
+        return
+
+    done = threading.Event()
+    engine = PlayerEngine()
+    engine.add(paths)
+    engine.bind(
+        on_track=lambda index, path, info: print(f"[{index + 1}/{len(paths)}] {path}"),
+        on_state=lambda state: state == STOPPED and done.set(),
+    )
+    engine.start()
+    engine.play(0)
+    try:
+        done.wait()
+    except KeyboardInterrupt:
+        pass
+    engine.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import os
+import threading
+
+from kivy.clock import Clock
+
+from metadata_index import TrackInfo
+from streaming import is_url
+
+NATIVE_EXTENSION = ".mpl"
+NATIVE_HEADER = "#MUSICPLAYER-PLAYLIST 1"
+
+# The first batch is small so the list shows something right away. After that every batch is
+# BATCH_GROWTH times bigger, a few large updates are much cheaper for the list than many small ones
+FIRST_BATCH = 200
+BATCH_GROWTH = 4
+
+
+def escape(value):
+    # Native format is one line per track with tab separated fields
+    if value is None:
+        return ""
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def unescape(value):
+    if "\\" not in value:
+        return value
+    out = []
+    chars = iter(value)
+    for char in chars:
+        if char == "\\":
+            char = {"t": "\t", "n": "\n"}.get(next(chars, ""), "\\")
+        out.append(char)
+    return "".join(out)
+
+
+def write_native(file_path, paths, infos):
+    """
+    Our own format: path plus everything the metadata index knows about the track.
+
+    Loading it puts the metadata straight back into the index, so nothing has to be probed again.
+    """
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+        f.write(NATIVE_HEADER + "\n")
+        for path in paths:
+            info = infos.get(path)
+            if info is None:
+                f.write(escape(path) + "\n")
+            else:
+                f.write("\t".join(escape(value) for value in info) + "\n")
+    os.replace(tmp_path, file_path)
+
+
+def write_m3u(file_path, paths, infos):
+    with open(file_path, "w", encoding="utf-8", newline="\n") as f:
+        f.write("#EXTM3U\n")
+        for path in paths:
+            info = infos.get(path)
+            if info is not None:
+                title = f"{info.artist} - {info.title}" if info.artist and info.title else (info.title or os.path.basename(path))
+                f.write(f"#EXTINF:{int(info.duration)},{title}\n")
+            f.write(path + "\n")
+
+
+def parse_native_line(line):
+    fields = [unescape(field) for field in line.split("\t")]
+    path = fields[0]
+    if len(fields) != len(TrackInfo._fields):
+        return path, None
+    try:
+        return path, TrackInfo(
+            path=path,
+            mtime=float(fields[1]),
+            size=int(fields[2]),
+            duration=float(fields[3]),
+            title=fields[4] or None,
+            artist=fields[5] or None,
+            album=fields[6] or None,
+            codec=fields[7] or None,
+            bitrate=int(fields[8] or 0),
+        )
+    except ValueError:
+        return path, None
+
+
+def iter_playlist(file_path):
+    # Yields (path, TrackInfo or None) one line at a time, the file is never read in one go
+    folder = os.path.dirname(os.path.abspath(file_path))
+    native = file_path.lower().endswith(NATIVE_EXTENSION)
+
+    # utf-8-sig eats the BOM some Windows tools put in front of M3U8 files
+    with open(file_path, encoding="utf-8-sig", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line or line.startswith("#"):
+                continue
+
+            if native:
+                yield parse_native_line(line)
+                continue
+
+            # M3U entries can be relative to the playlist file
+            path = line.replace("\\", "/")
+            if "://" not in path and not os.path.isabs(path):
+                path = os.path.normpath(os.path.join(folder, path)).replace("\\", "/")
+            yield path, None
+
+
+class PlaylistLoader:
+    """
+    Streams a saved playlist into the app without blocking the UI.
+
+    A background thread parses the file and stores the metadata that came with it in the index. The paths reach the Kivy thread in batches through on_batch(paths, known), where known maps path -> TrackInfo for everything the index has, so the UI doesn't have to look anything up itself.
+    """
+
+    def __init__(self, index, on_batch, on_done=None):
+        self.index = index
+        self.on_batch = on_batch
+        self.on_done = on_done
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, file_path):
+        self._cancel.clear()
+        self._thread = threading.Thread(target=self._run, args=(file_path,), daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _run(self, file_path):
+        paths = []
+        infos = []
+        limit = FIRST_BATCH
+        try:
+            for path, info in iter_playlist(file_path):
+                if self._cancel.is_set():
+                    break
+                paths.append(path)
+                if info is not None:
+                    infos.append(info)
+                if len(paths) >= limit:
+                    self._flush(paths, infos)
+                    paths, infos = [], []
+                    limit *= BATCH_GROWTH
+            if not self._cancel.is_set():
+                self._flush(paths, infos)
+        except OSError:
+            pass
+        finally:
+            if self.on_done:
+                cancelled = self._cancel.is_set()
+                Clock.schedule_once(lambda dt: self.on_done(cancelled), 0)
+
+    def _flush(self, paths, infos):
+        if not paths:
+            return
+        # Metadata that came with the file goes into the index, anything missing (M3U) is looked up here.
+        # Only rows that still fit the file: a track retagged or replaced since the playlist was saved would
+        # otherwise get its old tags back. Streams and missing files can't be checked, they keep what the index has
+        infos = [info for info in infos if self._still_fresh(info)]
+        if infos:
+            self.index.store_many(infos)
+        known = {info.path: info for info in infos}
+        missing = [path for path in paths if path not in known]
+        if missing:
+            known.update(self.index.lookup_many(missing))
+        Clock.schedule_once(lambda dt: self._deliver(paths, known), 0)
+
+    def _still_fresh(self, info):
+        if is_url(info.path):
+            return False
+        try:
+            stat = os.stat(info.path)
+        except OSError:
+            return False
+        return self.index.is_fresh(info, stat)
+
+    def _deliver(self, paths, known):
+        if not self._cancel.is_set():
+            self.on_batch(paths, known)
+
+
+def playlist_file(folder, name):
+    # Keep the name readable but safe to use as a file name
+    safe = "".join(char for char in name if char.isalnum() or char in " -_.").strip() or "playlist"
+    return os.path.join(folder, safe + NATIVE_EXTENSION)
+
+
+def saved_playlists(folder):
+    if not os.path.isdir(folder):
+        return []
+    names = [name[:-len(NATIVE_EXTENSION)] for name in os.listdir(folder) if name.endswith(NATIVE_EXTENSION)]
+    return sorted(names, key=str.lower)
@@ -0,0 +1,216 @@
+import os
+import re
+import time
+import unicodedata
+from bisect import bisect_left
+from itertools import compress, islice
+
+# Words of the search text, \w also covers letters outside ASCII
+WORD = re.compile(r"\w+")
+
+# A query word matches words that start with it ("bea" finds "Beatles"). Words of 1-2 letters are looked
+# up by prefix, longer ones through the trigrams they contain
+GRAM = 3
+
+# Results of the last few query words, typing "daft pu" -> "daft pun" doesn't look up "daft" again
+CACHED_TERMS = 64
+
+# Entries indexed between two looks at the clock in index_pending()
+INDEX_CHUNK = 64
+
+
+def words(text):
+    # Lower case without accents, so "beyonce" finds "Beyoncé"
+    text = unicodedata.normalize("NFKD", text.casefold())
+    if not text.isascii():
+        text = "".join(char for char in text if not unicodedata.combining(char))
+    return WORD.findall(text)
+
+
+def search_text(info, path):
+    # What a row can be found by: the file name without the extension (or every track would match "mp3")
+    # and whatever tags we know
+    parts = [os.path.splitext(os.path.basename(path))[0]]
+    if info is not None:
+        parts += [info.title, info.artist, info.album]
+    return " ".join(part for part in parts if part)
+
+
+def trigrams(word):
+    return {word[i:i + GRAM] for i in range(len(word) - GRAM + 1)}
+
+
+class SearchIndex:
+    """
+    In-memory word index over the playlist, for filtering while the user types.
+
+    Every entry gets an id that only ever grows, so ids are in playlist order and popping a track doesn't renumber anything. Words point to the ids that contain them, and a second, much smaller index over the distinct words (trigrams and two letter prefixes) finds the words that start with a query word. A keystroke costs as much as the words it touches, not as much as the playlist.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._next_id = 0
+        self._ids = []  # Entry ids in playlist order
+        self._words = {}  # id -> the distinct words of that entry
+        self._postings = {}  # word -> ids of the entries containing it
+        self._grams = {}  # trigram -> words containing it
+        self._prefixes = {}  # 2 letter prefix -> words starting with it
+        self._initials = {}  # first letter -> ids of the entries with a word starting with it
+        self._cache = {}
+        self._pending = []  # Paths of added entries that aren't indexed yet
+        self._pending_info = {}
+
+    def __len__(self):
+        return len(self._ids) + len(self._pending)
+
+    def add(self, paths, known=None):
+        # Appends the tracks at the end of the playlist, known maps path -> TrackInfo for the tagged ones.
+        # Their words are only indexed by index_pending(), so adding a big batch doesn't cost a frame
+        self._pending.extend(paths)
+        if known:
+            self._pending_info.update(known)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def index_pending(self, budget=None):
+        """
+        Indexes added entries that aren't yet, for at most `budget` seconds if given.
+
+        Returns True once nothing is left. Searching catches up on everything first, so results are never missing a track.
+        """
+        pending = self._pending
+        if not pending:
+            return True
+        self._cache.clear()
+        deadline = None if budget is None else time.perf_counter() + budget
+        while pending:
+            for path in islice(pending, INDEX_CHUNK):
+                self._index_entry(search_text(self._pending_info.get(path), path))
+            del pending[:INDEX_CHUNK]
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        if not pending:
+            self._pending_info.clear()
+        return not pending
+
+    def _index_entry(self, text):
+        entry = self._next_id
+        self._next_id += 1
+        self._ids.append(entry)
+        entry_words = tuple(set(words(text)))
+        self._words[entry] = entry_words
+        postings = self._postings
+        for word in entry_words:
+            ids = postings.get(word)
+            if ids is None:
+                postings[word] = ids = set()
+                self._add_word(word)
+            ids.add(entry)
+            # A single letter matches a big part of the playlist, collecting that from the words
+            # on every keystroke would take longer than a frame, so it's kept up to date here
+            initials = self._initials.get(word[0])
+            if initials is None:
+                self._initials[word[0]] = initials = set()
+            initials.add(entry)
+
+    def pop(self, position):
+        self.index_pending()
+        self._cache.clear()
+        entry = self._ids.pop(position)
+        for word in self._words.pop(entry):
+            initials = self._initials[word[0]]
+            initials.discard(entry)
+            if not initials:
+                del self._initials[word[0]]
+            ids = self._postings[word]
+            ids.discard(entry)
+            if not ids:
+                # Last entry with this word, the word itself goes too
+                del self._postings[word]
+                self._remove_word(word)
+
+    def search(self, query):
+        """
+        Playlist positions of the entries matching every word of the query, in playlist order.
+
+        None for an empty query, which means "no filter".
+        """
+        terms = words(query)
+        if not terms:
+            return None
+        self.index_pending()
+
+        # Smallest set first, so every intersection after it only walks a few ids
+        matched = sorted((self._term_ids(term) for term in set(terms)), key=len)
+        hits = matched[0]
+        for ids in matched[1:]:
+            if not hits:
+                break
+            hits = hits & ids
+        return self._positions(hits)
+
+    def match_from(self, query, first):
+        # Positions from `first` on that match, for rows added while a filter is showing
+        terms = set(words(query))
+        self.index_pending()
+        ids = self._ids
+        matched = []
+        for position in range(first, len(ids)):
+            entry_words = self._words[ids[position]]
+            if all(any(word.startswith(term) for word in entry_words) for term in terms):
+                matched.append(position)
+        return matched
+
+    def _term_ids(self, term):
+        ids = self._cache.get(term)
+        if ids is not None:
+            return ids
+
+        if len(term) == 1:
+            return self._initials.get(term, set())
+        if len(term) < GRAM:
+            candidates = self._prefixes.get(term, ())
+        else:
+            # Words containing all trigrams of the term, checked for actually starting with it after that
+            grams = sorted((self._grams.get(gram, ()) for gram in trigrams(term)), key=len)
+            candidates = set(grams[0]).intersection(*grams[1:]) if grams[0] else ()
+            candidates = [word for word in candidates if word.startswith(term)]
+
+        postings = self._postings
+        ids = set().union(*[postings[word] for word in candidates])
+
+        if len(self._cache) >= CACHED_TERMS:
+            self._cache.clear()
+        self._cache[term] = ids
+        return ids
+
+    def _positions(self, hits):
+        ids = self._ids
+        if len(hits) == len(ids):
+            return list(range(len(ids)))
+        if ids and ids[-1] == len(ids) - 1:
+            # Nothing popped since the list was filled, ids are still the positions
+            return sorted(hits)
+        if len(hits) * 8 > len(ids):
+            # Most of the list matches, one pass over it beats a bisect per hit
+            return list(compress(range(len(ids)), map(hits.__contains__, ids)))
+        return [bisect_left(ids, entry) for entry in sorted(hits)]
+
+    def _add_word(self, word):
+        for gram in trigrams(word):
+            self._grams.setdefault(gram, set()).add(word)
+        if len(word) > 1:
+            self._prefixes.setdefault(word[:2], set()).add(word)
+
+    def _remove_word(self, word):
+        for index, keys in ((self._grams, trigrams(word)), (self._prefixes, {word[:2]})):
+            for key in keys:
+                found = index.get(key)
+                if found is not None:
+                    found.discard(word)
+                    if not found:
+                        del index[key]
@@ -0,0 +1,381 @@
+import io
+import mmap
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+from streaming import BLOCK_SIZE, is_url, name_hint, open_source
+
+# One seek point every half second is plenty, the decoder finds the exact sample from there
+SEEK_POINT_SPACING = 0.5
+# Keep the tables of the last few tracks in memory, the rest lives in the metadata database
+MEMORY_TABLES = 4
+
+# MPEG audio lookup tables, indexed by the bits of the 4 byte frame header
+MP3_BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 25: [11025, 12000, 8000]}
+
+
+class SeekTable:
+    """
+    Sorted (seconds, byte offset) pairs for one file.
+
+    header is what has to go in front of the bytes at an offset for the decoder to accept them as a file (empty for MP3, a minimal STREAMINFO block for FLAC).
+    """
+
+    def __init__(self, kind, header, times, offsets):
+        self.kind = kind
+        self.header = header
+        self.times = times
+        self.offsets = offsets
+
+    def find(self, position):
+        # Last seek point at or before the position, one bisect instead of decoding from the start
+        i = bisect_right(self.times, position) - 1
+        if i < 0:
+            return None
+        return self.times[i], self.offsets[i]
+
+    def to_bytes(self):
+        times = array('d', self.times)
+        offsets = array('q', self.offsets)
+        kind = self.kind.encode()
+        head = array('q', [len(kind), len(self.header), len(times)])
+        return head.tobytes() + kind + self.header + times.tobytes() + offsets.tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob):
+        head = array('q')
+        head.frombytes(blob[:24])
+        kind_len, header_len, count = head
+        pos = 24
+        kind = blob[pos:pos + kind_len].decode()
+        pos += kind_len
+        header = bytes(blob[pos:pos + header_len])
+        pos += header_len
+        times = array('d')
+        times.frombytes(blob[pos:pos + count * 8])
+        pos += count * 8
+        offsets = array('q')
+        offsets.frombytes(blob[pos:pos + count * 8])
+        return cls(kind, header, times, offsets)
+
+
+class SpliceReader(io.RawIOBase):
+    """
+    Read-only file object that looks like header + file[offset:end].
+
+    Pygame can load music from a file object, so this lets the decoder start right at a seek point instead of scanning up to it. With an end it also stops at one, audio_decode.py decodes long files piece by piece like that. A web track is read through a StreamSource, from the seek point on.
+    """
+
+    def __init__(self, header, path, offset, end=None):
+        self.header = header
+        if is_url(path):
+            self.file = open_source(path)
+            if self.file is None:
+                raise OSError(f"can't open {path}")
+        else:
+            self.file = open(path, 'rb')
+        self.offset = offset
+        if end is None:
+            end = self.file.seek(0, io.SEEK_END)
+        self.length = len(header) + end - offset
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self.pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self.pos = max(0, min(pos, self.length))
+        return self.pos
+
+    def readinto(self, buffer):
+        view = memoryview(buffer)
+        written = 0
+
+        # 1. Whatever is left of the synthetic header
+        if self.pos < len(self.header):
+            part = self.header[self.pos:self.pos + len(view)]
+            view[:len(part)] = part
+            written = len(part)
+            self.pos += written
+
+        # 2. The rest straight from the real file, up to the end
+        wanted = min(len(view), written + self.length - self.pos)
+        if written < wanted:
+            self.file.seek(self.offset + self.pos - len(self.header))
+            count = self.file.readinto(view[written:wanted]) or 0
+            self.pos += count
+            written += count
+        return written
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def syncsafe(data):
+    # ID3 sizes use 7 bits per byte
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def skip_id3(f):
+    start = 0
+    head = f.read(10)
+    if head[:3] == b"ID3" and len(head) == 10:
+        start = 10 + syncsafe(head[6:10])
+    f.seek(start)
+    return start
+
+
+def parse_mp3_header(h):
+    # Returns (version, layer, frame length, samples per frame, sample rate) or None
+    if h[0] != 0xFF or (h[1] & 0xE0) != 0xE0:
+        return None
+    version = {0: 25, 2: 2, 3: 1}.get((h[1] >> 3) & 3)
+    layer = {1: 3, 2: 2, 3: 1}.get((h[1] >> 1) & 3)
+    bitrate_index = h[2] >> 4
+    rate_index = (h[2] >> 2) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    bitrate = MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+    padding = (h[2] >> 1) & 1
+
+    if layer == 1:
+        return version, layer, (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    if layer == 3 and version != 1:
+        return version, layer, 72 * bitrate // sample_rate + padding, 576, sample_rate
+    return version, layer, 144 * bitrate // sample_rate + padding, 1152, sample_rate
+
+
+def build_mp3_table(path):
+    # One pass over the frame headers. Exact for VBR, unlike the 100 entry Xing TOC,
+    # and we only ever pay for it once per file because the result is cached.
+    with open(path, 'rb') as f:
+        start = skip_id3(f)
+        # Mapped instead of read, a 3 hour mix doesn't have to fit in RAM
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return scan_mp3_frames(data, start)
+
+
+def scan_mp3_frames(data, start):
+    times = array('d')
+    offsets = array('q')
+    pos = start
+    samples = 0
+    first = None
+    next_point = 0.0
+    while pos + 4 <= len(data):
+        frame = parse_mp3_header(data[pos:pos + 4])
+        if frame is None or (first and frame[:2] != first[:2]):
+            # Garbage or a false sync, step forward until we find a real frame
+            pos += 1
+            continue
+
+        version, layer, length, frame_samples, sample_rate = frame
+        if length <= 0:
+            pos += 1
+            continue
+
+        if first is None:
+            first = frame
+            # The Xing/Info frame carries no audio, skip it so the times line up
+            if b"Xing" in data[pos:pos + 64] or b"Info" in data[pos:pos + 64]:
+                pos += length
+                continue
+
+        seconds = samples / sample_rate
+        if seconds >= next_point:
+            times.append(seconds)
+            offsets.append(pos)
+            next_point = seconds + SEEK_POINT_SPACING
+
+        samples += frame_samples
+        pos += length
+
+    if not times:
+        return None
+    return SeekTable("mp3", b"", times, offsets)
+
+
+def build_flac_table(path):
+    with open(path, 'rb') as f:
+        return read_flac_table(f)
+
+
+def read_flac_table(f):
+    # Metadata blocks first, then the SEEKTABLE the encoder already wrote for us. Only the blocks at the top
+    # of the file are read, that's also cheap over the network
+    skip_id3(f)
+    if f.read(4) != b"fLaC":
+        return None
+
+    streaminfo = None
+    seekpoints = []
+    while True:
+        block = f.read(4)
+        if len(block) < 4:
+            return None
+        last = block[0] & 0x80
+        kind = block[0] & 0x7F
+        size = int.from_bytes(block[1:4], 'big')
+        body = f.read(size)
+        if kind == 0:
+            streaminfo = bytearray(body)
+        elif kind == 3:
+            for i in range(0, len(body) - 17, 18):
+                first_sample = int.from_bytes(body[i:i + 8], 'big')
+                offset = int.from_bytes(body[i + 8:i + 16], 'big')
+                # All ones is a placeholder point
+                if first_sample != 0xFFFFFFFFFFFFFFFF:
+                    seekpoints.append((first_sample, offset))
+        if last:
+            break
+    first_frame = f.tell()
+
+    if streaminfo is None or len(streaminfo) < 34 or not seekpoints:
+        return None
+
+    sample_rate = (streaminfo[10] << 12) | (streaminfo[11] << 4) | (streaminfo[12] >> 4)
+    if not sample_rate:
+        return None
+
+    # A spliced stream is shorter than the original, so mark total samples and MD5 as unknown
+    streaminfo[13] &= 0xF0
+    streaminfo[14:18] = b"\x00\x00\x00\x00"
+    streaminfo[18:34] = bytes(16)
+    header = b"fLaC" + bytes([0x80]) + (34).to_bytes(3, 'big') + bytes(streaminfo[:34])
+
+    seekpoints.sort()
+    times = array('d', [sample / sample_rate for sample, offset in seekpoints])
+    offsets = array('q', [first_frame + offset for sample, offset in seekpoints])
+    return SeekTable("flac", header, times, offsets)
+
+
+def build_seek_table(path):
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        if extension == ".mp3":
+            return build_mp3_table(path)
+        if extension == ".flac":
+            return build_flac_table(path)
+    except (OSError, ValueError):
+        return None
+    return None
+
+
+class SeekIndex:
+    """
+    Seek tables for the tracks we play, built in the background and cached next to the metadata.
+
+    open_at() never builds anything itself. If the table isn't ready yet the caller just falls back to play(start=...).
+    Web tracks get one too when they are FLAC, its seek table is in the first few KB. An MP3 table takes every frame header, that would be the whole file over the network once more, so web MP3s keep seeking with play(start=...).
+    """
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def prepare(self, path):
+        with self._lock:
+            if path in self._tables:
+                self._tables.move_to_end(path)
+                return
+        threading.Thread(target=self._load, args=(path,), daemon=True).start()
+
+    def load(self, path):
+        # prepare() on the calling thread, for a worker that needs the table before it can go on
+        with self._lock:
+            if path in self._tables:
+                return
+        self._load(path)
+
+    def _load(self, path):
+        if is_url(path):
+            self._load_remote(path)
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+
+        # 1. Cached in the database and the file hasn't changed since
+        blob = self.metadata.load_seek_table(path, stat)
+        table = SeekTable.from_bytes(blob) if blob else None
+
+        # 2. Otherwise walk the file once and remember the result
+        if table is None:
+            table = build_seek_table(path)
+            if table is None:
+                return
+            self.metadata.store_seek_table(path, stat, table.to_bytes())
+
+        self._keep(path, table)
+
+    def _load_remote(self, path):
+        if name_hint(path) != "flac":
+            return
+        # Only the top of the file is needed, no reading ahead past the first block
+        source = open_source(path, BLOCK_SIZE)
+        if source is None:
+            return
+        try:
+            stat = source.stat()
+            blob = self.metadata.load_seek_table(path, stat)
+            table = SeekTable.from_bytes(blob) if blob else None
+            if table is None:
+                table = read_flac_table(source)
+                if table is None:
+                    return
+                self.metadata.store_seek_table(path, stat, table.to_bytes())
+        except (OSError, ValueError):
+            return
+        finally:
+            source.close()
+        self._keep(path, table)
+
+    def _keep(self, path, table):
+        with self._lock:
+            self._tables[path] = table
+            while len(self._tables) > MEMORY_TABLES:
+                self._tables.popitem(last=False)
+
+    def open_at(self, path, position):
+        # Returns (file object, time of the seek point, namehint) or None.
+        # The seek point is at most SEEK_POINT_SPACING before the position (or one FLAC seektable gap),
+        # the caller plays the small rest with start=... on the spliced stream
+        with self._lock:
+            table = self._tables.get(path)
+        if table is None:
+            return None
+
+        point = table.find(position)
+        if point is None:
+            return None
+        seconds, offset = point
+        try:
+            return SpliceReader(table.header, path, offset), seconds, table.kind
+        except OSError:
+            return None
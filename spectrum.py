@@ -0,0 +1,318 @@
+import hashlib
+import importlib.util
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from kivy.clock import Clock
+from kivy.graphics import Color, Mesh
+from kivy.properties import ListProperty, NumericProperty, ObjectProperty
+from kivy.uix.widget import Widget
+
+import perf
+
+# No NumPy, no spectrum. MainScreen falls back to the pulse animation.
+# Only checked here, NumPy itself is imported by the code that needs it, it is too slow for the start up path
+HAVE_NUMPY = importlib.util.find_spec("numpy") is not None
+
+# The tap is a mono copy of the track at half the mixer rate, plenty for a visualizer
+TAP_RATE = 22050
+FFT_SIZE = 2048
+HOP = 512
+# Windows per FFT batch, the bars show their average so they don't flicker
+BATCH = 4
+BANDS = 32
+# Bars fall back slowly instead of dropping to zero between beats
+DECAY = 0.85
+# Tap files are big (about 2.6 MB per minute), only the most recent tracks keep theirs
+MAX_TAP_FILES = 4
+
+
+def build_tap_file(path, out_path):
+    # Runs in a worker process. Average both channels and every pair of samples in one go, piece by piece straight
+    # into the file. A frame left over at the end of a piece goes in front of the next one
+    import numpy as np
+    from audio_decode import decode_chunks
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, 'wb') as out:
+        rest = None
+        for samples, rate in decode_chunks(path):
+            step = max(1, rate // TAP_RATE)
+            if rest is not None:
+                samples = np.concatenate([rest, samples])
+            frames = samples.shape[0] // step
+            samples[:frames * step].reshape(frames, -1).mean(axis=1).astype(np.int16).tofile(out)
+            rest = samples[frames * step:]
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+class PcmRing:
+    """
+    Fixed size ring of float samples, stored twice back to back.
+
+    Because of the mirror, the newest n samples are always one contiguous slice, so latest() hands out a view and never copies.
+    """
+
+    def __init__(self, capacity):
+        import numpy as np
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity * 2, dtype=np.float32)
+        self.head = 0
+        self.filled = 0
+
+    def clear(self):
+        self.head = 0
+        self.filled = 0
+
+    def write(self, chunk):
+        n = len(chunk)
+        if n >= self.capacity:
+            chunk = chunk[-self.capacity:]
+            n = self.capacity
+
+        # Up to the end of the ring, then wrap around to the start. Both copies get written
+        first = min(n, self.capacity - self.head)
+        end = self.head + first
+        self.buffer[self.head:end] = chunk[:first]
+        self.buffer[self.head + self.capacity:end + self.capacity] = chunk[:first]
+        rest = n - first
+        if rest:
+            self.buffer[:rest] = chunk[first:]
+            self.buffer[self.capacity:self.capacity + rest] = chunk[first:]
+
+        self.head = (self.head + n) % self.capacity
+        self.filled = min(self.capacity, self.filled + n)
+
+    def latest(self, n):
+        end = self.head + self.capacity
+        return self.buffer[end - n:end]
+
+
+class SpectrumAnalyzer:
+    """
+    Turns the playing track into bar heights, off the UI thread.
+
+    A worker process decodes the track once into a mono tap file. While music plays, our thread follows the real playback position (position_source), feeds the new samples from the memory mapped tap into a PcmRing and runs a batch of FFTs over views of it.
+    The result lands in self.levels, which the renderer reads directly.
+    """
+
+    def __init__(self, folder, position_source, bands=BANDS, fps=30):
+        import numpy as np
+        self.folder = folder
+        self.position_source = position_source
+        self.bands = bands
+        self.fps = fps
+        os.makedirs(folder, exist_ok=True)
+
+        # Double buffered, the analyzer writes the back one and swaps
+        self.levels = np.zeros(bands, dtype=np.float32)
+        self._back = np.zeros(bands, dtype=np.float32)
+
+        self.ring = PcmRing(FFT_SIZE * 2)
+        self.window = np.hanning(FFT_SIZE).astype(np.float32)
+        self.band_edges, self.band_sizes = self._make_bands(bands)
+        # Full scale sine through a Hann window, used to turn magnitudes into 0..1
+        self.reference = FFT_SIZE * 32768 / 4
+
+        # Instrumentation, milliseconds for the last analysis batch
+        self.analysis_ms = 0.0
+
+        self.path = ''
+        self._pcm = None
+        self._fed = 0
+        self._active = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _make_bands(self, bands):
+        # Log spaced from 40 Hz up, every band gets at least one FFT bin
+        import numpy as np
+        bins = FFT_SIZE // 2 + 1
+        freqs = np.geomspace(40, TAP_RATE / 2, bands + 1)
+        edges = np.unique(np.clip((freqs * FFT_SIZE / TAP_RATE).astype(np.intp), 1, bins - 1))
+        sizes = np.diff(np.append(edges, bins)).astype(np.float32)
+        return edges, sizes
+
+    def prepare(self, path):
+        self.path = path
+        self._pcm = None
+        threading.Thread(target=self._load_tap, args=(path,), daemon=True).start()
+
+    def _load_tap(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        key = f"{path}|{stat.st_mtime}|{stat.st_size}".encode()
+        tap_path = os.path.join(self.folder, hashlib.sha1(key).hexdigest() + ".pcm")
+
+        if not os.path.exists(tap_path):
+            try:
+                self._get_pool().submit(build_tap_file, path, tap_path).result()
+            except Exception:
+                return
+            self._prune_taps(keep=tap_path)
+
+        # Only switch if the track hasn't changed again while we were decoding
+        if path == self.path:
+            import numpy as np
+            try:
+                pcm = np.memmap(tap_path, dtype=np.int16, mode='r')
+            except ValueError:
+                # Empty tap, nothing decodable in this file
+                return
+            with self._lock:
+                self._pcm = pcm
+                self._fed = 0
+                self.ring.clear()
+
+    def _prune_taps(self, keep):
+        taps = [os.path.join(self.folder, name) for name in os.listdir(self.folder) if name.endswith(".pcm")]
+        taps.sort(key=lambda tap: os.path.getmtime(tap), reverse=True)
+        for tap in taps[MAX_TAP_FILES:]:
+            if tap != keep:
+                try:
+                    os.remove(tap)
+                except OSError:
+                    # Still mapped on Windows, it goes next time
+                    pass
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=1)
+            return self._pool
+
+    def start(self):
+        self._active.set()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def pause(self):
+        self._active.clear()
+        self.levels[:] = 0
+
+    def shutdown(self):
+        self._stopped = True
+        self._active.set()
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def _run(self):
+        while not self._stopped:
+            # Sleeps here for free while paused or hidden
+            self._active.wait()
+            if self._stopped:
+                return
+            started = time.perf_counter()
+            with self._lock:
+                if self._pcm is not None:
+                    self._analyze()
+            self.analysis_ms = (time.perf_counter() - started) * 1000
+            time.sleep(max(0.0, 1 / self.fps - self.analysis_ms / 1000))
+
+    def _analyze(self):
+        import numpy as np
+        from numpy.lib.stride_tricks import sliding_window_view
+
+        # 1. Bring the ring up to the real playback position
+        target = min(int(self.position_source() * TAP_RATE), len(self._pcm))
+        if target < self._fed or target - self._fed > self.ring.capacity:
+            # A seek, forget what we had and start filling from just before the new position
+            self.ring.clear()
+            self._fed = max(0, target - self.ring.capacity)
+        # Straight from the memory map into the ring, no temporary copy in between
+        self.ring.write(self._pcm[self._fed:target])
+        self._fed = target
+
+        needed = FFT_SIZE + HOP * (BATCH - 1)
+        if self.ring.filled < needed:
+            return
+
+        # 2. BATCH overlapping windows as a strided view, one rfft call for all of them
+        frames = sliding_window_view(self.ring.latest(needed), FFT_SIZE)[::HOP]
+        spectrum = np.abs(np.fft.rfft(frames * self.window, axis=1)).mean(axis=0)
+
+        # 3. Average the bins into log bands, then map -60..0 dB onto 0..1
+        bands = np.add.reduceat(spectrum, self.band_edges) / self.band_sizes
+        decibels = 20 * np.log10(bands / self.reference + 1e-9)
+        heights = np.clip((decibels + 60) / 60, 0, 1)
+
+        np.maximum(heights[:self.bands], self.levels[:len(heights)] * DECAY, out=self._back[:len(heights)])
+        self.levels, self._back = self._back, self.levels
+
+
+class SpectrumView(Widget):
+    """
+    Bars for SpectrumAnalyzer.levels, drawn as one Mesh.
+
+    Vertices and indices are allocated once per size change. Each frame only rewrites the bar tops in place and hands the same buffer back to the Mesh.
+    """
+
+    analyzer = ObjectProperty(None, allownone=True)
+    bar_color = ListProperty([1, 1, 1, 0.6])
+    # Instrumentation, milliseconds spent in the last update_frame
+    frame_ms = NumericProperty(0)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._vertices = None
+        with self.canvas:
+            self._color = Color(*self.bar_color)
+            self._mesh = Mesh(mode='triangles')
+        self.bind(size=self.layout_bars, pos=self.layout_bars, analyzer=self.layout_bars)
+
+    def on_bar_color(self, instance, value):
+        if hasattr(self, "_color"):
+            self._color.rgba = value
+
+    def layout_bars(self, *args):
+        if self.analyzer is None:
+            return
+        import numpy as np
+        bands = self.analyzer.bands
+        gap = self.width / bands * 0.2
+        lefts = self.x + np.arange(bands) * self.width / bands
+        rights = lefts + self.width / bands - gap
+
+        # 4 corners per bar: bottom left, bottom right, top right, top left (x, y, u, v each)
+        self._vertices = np.zeros((bands, 4, 4), dtype=np.float32)
+        self._vertices[:, (0, 3), 0] = lefts[:, None]
+        self._vertices[:, (1, 2), 0] = rights[:, None]
+        self._vertices[:, :, 1] = self.y
+        self._vertex_view = memoryview(self._vertices.reshape(-1))
+
+        corners = np.array([0, 1, 2, 2, 3, 0], dtype=np.uint16)
+        self._indices = (corners + 4 * np.arange(bands, dtype=np.uint16)[:, None]).reshape(-1)
+        self._mesh.indices = memoryview(self._indices)
+        self.update_frame(0)
+
+    def start(self):
+        if self.analyzer is None:
+            return
+        self.analyzer.start()
+        Clock.unschedule(self.update_frame)
+        Clock.schedule_interval(self.update_frame, 1 / self.analyzer.fps)
+
+    def stop(self):
+        Clock.unschedule(self.update_frame)
+        if self.analyzer is not None:
+            self.analyzer.pause()
+            self.update_frame(0)
+
+    @perf.timed("spectrum frame")
+    def update_frame(self, dt):
+        if self._vertices is None:
+            return
+        started = time.perf_counter()
+        # Only the two top corners move
+        self._vertices[:, 2:, 1] = self.y + self.analyzer.levels[:, None] * self.height
+        self._mesh.vertices = self._vertex_view
+        self.frame_ms = (time.perf_counter() - started) * 1000
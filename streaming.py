@@ -0,0 +1,328 @@
+import io
+import os
+import threading
+from collections import namedtuple
+from urllib.parse import unquote, urlsplit
+
+# Bytes read ahead of the decoder for every open track, the settings screen changes it
+PREFETCH_BYTES = 4 * 1024 * 1024
+# Unit of reading and caching. Big enough that a slow server isn't asked for every few KB
+BLOCK_SIZE = 256 * 1024
+# Blocks behind the read position that stay around, decoders step back a little now and then
+KEEP_BEHIND = 2
+# Seconds before a request to a server that doesn't answer fails
+HTTP_TIMEOUT = 10
+
+# What MetadataIndex needs from os.stat()
+SourceStat = namedtuple("SourceStat", ["st_mtime", "st_size"])
+
+
+def is_url(path):
+    return path.startswith(("http://", "https://"))
+
+
+def name_hint(path):
+    # File type for the decoder, "mp3" for both /music/a.mp3 and http://host/a.mp3?token=1
+    if is_url(path):
+        path = unquote(urlsplit(path).path)
+    return os.path.splitext(path)[1][1:].lower()
+
+
+class FileBackend:
+    # One handle for everything read from a local (or mounted network) file
+    def __init__(self, path):
+        self.file = open(path, 'rb', buffering=0)
+        stat = os.fstat(self.file.fileno())
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.head = None
+        self._lock = threading.Lock()
+
+    def read_at(self, offset, size):
+        with self._lock:
+            self.file.seek(offset)
+            return self.file.read(size)
+
+    def close(self):
+        with self._lock:
+            self.file.close()
+
+
+class HttpBackend:
+    """
+    Byte ranges of a file on a web server, over one kept alive connection.
+
+    Opening asks for the first block already, the answer has the file size in it (Content-Range) and the block is the start of every decoder's work anyway.
+    A server without Range support sends the whole file instead. That one answer is read front to back into a temporary file as far as reads need it, and everything is served from there. Asking again for every block would download the file up to that block each time.
+    """
+
+    def __init__(self, url):
+        # Only imported for the first web track, http.client (ssl with it) is a noticeable part of the start up time
+        import http.client
+        self._errors = (http.client.HTTPException, ConnectionError)
+        parts = urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.url = url
+        self._connection = connection_class(parts.netloc, timeout=HTTP_TIMEOUT)
+        self._target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self._lock = threading.Lock()
+        self.size = None
+        self.mtime = 0.0
+        # Server without Range support: the answer that is being read, and the temporary file it goes into
+        self._body = None
+        self._spool = None
+        self._broken = None  # Why the answer stopped before its end
+        self.head = self.read_at(0, BLOCK_SIZE)
+
+    def read_at(self, offset, size):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    return self._request(offset, size)
+                except self._errors as e:
+                    # Servers drop idle keep alive connections, one retry on a fresh one
+                    self._connection.close()
+                    if attempt:
+                        raise OSError(f"Lost the connection to {self.url}: {e}")
+
+    def _request(self, offset, size):
+        if self._spool is not None:
+            return self._from_spool(offset, size)
+        self._connection.request("GET", self._target, headers={"Range": f"bytes={offset}-{offset + size - 1}"})
+        response = self._connection.getresponse()
+        if response.status == 416:
+            response.read()
+            return b""
+        if response.status not in (200, 206):
+            response.read()
+            raise OSError(f"HTTP {response.status} for {self.url}")
+
+        if self.size is None:
+            self._read_headers(response)
+        if response.status == 206:
+            return response.read()
+        # No range support, the body is the whole file
+        import tempfile
+        self._body = response
+        self._spool = tempfile.TemporaryFile()
+        return self._from_spool(offset, size)
+
+    def _from_spool(self, offset, size):
+        spool = self._spool
+        end = offset + size if self.size is None else min(offset + size, self.size)
+        spool.seek(0, io.SEEK_END)
+        try:
+            while spool.tell() < end and self._body is not None:
+                data = self._body.read(BLOCK_SIZE)
+                if not data:
+                    self._finish_body()
+                    break
+                spool.write(data)
+        except self._errors as e:
+            # Half a file and no way to ask for the rest, what is there can still be read
+            self._finish_body()
+            self._broken = e
+        if spool.tell() < end and self._broken is not None:
+            raise OSError(f"Lost the connection to {self.url}: {self._broken}")
+        if self._body is not None and self.size and spool.tell() >= self.size:
+            self._finish_body()
+        spool.seek(offset)
+        return spool.read(max(0, end - offset))
+
+    def _finish_body(self):
+        self._body = None
+        self._connection.close()
+
+    def _read_headers(self, response):
+        from email.utils import parsedate_to_datetime
+        content_range = response.getheader("Content-Range", "")
+        if "/" in content_range and not content_range.endswith("*"):
+            self.size = int(content_range.rsplit("/", 1)[1])
+        else:
+            self.size = int(response.getheader("Content-Length", 0))
+        try:
+            self.mtime = parsedate_to_datetime(response.getheader("Last-Modified")).timestamp()
+        except (TypeError, ValueError):
+            pass
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+            if self._spool is not None:
+                self._spool.close()
+
+
+def open_backend(path):
+    return HttpBackend(path) if is_url(path) else FileBackend(path)
+
+
+class StreamSource(io.RawIOBase):
+    """
+    A file object for pygame and mutagen that reads ahead of whoever uses it.
+
+    A prefetch thread keeps the next `prefetch` bytes after the read position in memory, block by block, so the decoder (which pygame calls from the audio thread) gets its data from memory instead of waiting on a slow disk, a NAS or a web server. The tags are read through the same object before it goes to the mixer, one open and one handle per track.
+    Memory stays bounded: only the window ahead, KEEP_BEHIND blocks behind, and the first and last block (headers and tags) are kept.
+    Pygame closes the object once it is done with the track. Closing never waits for a read in progress, the prefetch thread closes the file or connection on its way out.
+    """
+
+    def __init__(self, path, prefetch=PREFETCH_BYTES):
+        super().__init__()
+        self.path = path
+        # Mutagen guesses the format from the name as well as the content
+        self.name = path
+        self.namehint = name_hint(path)
+        self.backend = open_backend(path)
+        self.length = self.backend.size
+        self.window = max(1, -(-prefetch // BLOCK_SIZE))
+        self.last_block = max(0, (self.length - 1) // BLOCK_SIZE)
+        self.pos = 0
+        # Set while the mixer lets go of the object but the player wants it back, close() leaves it open then
+        self.keep_open = False
+
+        # Instrumentation: blocks the reader had to wait for (misses) and everything read from the backend
+        self.misses = 0
+        self.bytes_fetched = 0
+
+        self._blocks = {}  # block number -> bytes
+        self._loading = set()  # block numbers being read right now
+        self._reading = 0  # block the reader is at, the window starts here
+        self._stopped = False
+        self._cond = threading.Condition()
+        if self.backend.head is not None:
+            self._store(0, self.backend.head)
+            self.bytes_fetched += len(self.backend.head)
+            self.backend.head = None
+        self._thread = threading.Thread(target=self._prefetch, daemon=True, name="stream prefetch")
+        self._thread.start()
+
+    def stat(self):
+        return SourceStat(self.backend.mtime, self.length)
+
+    def buffered(self):
+        # Bytes in memory right now
+        with self._cond:
+            return sum(len(block) for block in self._blocks.values())
+
+    # File object
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self.pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self.pos = max(0, min(pos, self.length))
+        # The window moves along right away, not only with the next read
+        with self._cond:
+            self._reading = self.pos // BLOCK_SIZE
+            self._cond.notify_all()
+        return self.pos
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        written = 0
+        while written < len(view) and self.pos < self.length:
+            number, start = divmod(self.pos, BLOCK_SIZE)
+            part = self._block(number)[start:start + len(view) - written]
+            if not part:
+                break
+            view[written:written + len(part)] = part
+            written += len(part)
+            self.pos += len(part)
+        return written
+
+    def close(self):
+        if self.keep_open:
+            return
+        with self._cond:
+            self._stopped = True
+            self._blocks.clear()
+            self._cond.notify_all()
+        super().close()
+
+    # Blocks
+
+    def _block(self, number):
+        with self._cond:
+            if self._reading != number:
+                self._reading = number
+                self._cond.notify_all()
+            block = self._blocks.get(number)
+            if block is not None:
+                return block
+            self.misses += 1
+            # The prefetch thread is on it, or the reader fetches it itself
+            while number in self._loading:
+                self._cond.wait()
+                block = self._blocks.get(number)
+                if block is not None:
+                    return block
+            self._loading.add(number)
+        try:
+            data = self.backend.read_at(number * BLOCK_SIZE, BLOCK_SIZE)
+        finally:
+            with self._cond:
+                self._loading.discard(number)
+                self._cond.notify_all()
+        with self._cond:
+            self.bytes_fetched += len(data)
+            self._store(number, data)
+        return data
+
+    def _next_missing(self):
+        for number in range(self._reading, min(self._reading + self.window, self.last_block + 1)):
+            if number not in self._blocks and number not in self._loading:
+                return number
+        return None
+
+    def _store(self, number, data):
+        if self._stopped:
+            return
+        self._blocks[number] = data
+        first = self._reading - KEEP_BEHIND
+        last = self._reading + self.window
+        for old in [n for n in self._blocks if not first <= n < last and n not in (0, self.last_block)]:
+            del self._blocks[old]
+
+    def _prefetch(self):
+        failed = False
+        try:
+            while True:
+                with self._cond:
+                    number = None if failed else self._next_missing()
+                    while not self._stopped and number is None:
+                        self._cond.wait()
+                        number = None if failed else self._next_missing()
+                    if self._stopped:
+                        return
+                    self._loading.add(number)
+                try:
+                    data = self.backend.read_at(number * BLOCK_SIZE, BLOCK_SIZE)
+                except OSError:
+                    # No more reading ahead, a reader that gets here fetches (and fails) on its own
+                    data = None
+                    failed = True
+                with self._cond:
+                    self._loading.discard(number)
+                    if data is not None:
+                        self.bytes_fetched += len(data)
+                        self._store(number, data)
+                    self._cond.notify_all()
+        finally:
+            self.backend.close()
+
+
+def open_source(path, prefetch=PREFETCH_BYTES):
+    # A StreamSource, or None when the file or server can't be reached
+    try:
+        return StreamSource(path, prefetch)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,175 @@
+"""
+ArtCache: where the picture comes from, the thumbnails on disk and in memory, and the background colours.
+
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("PIL")
+from PIL import Image
+
+from kivy.clock import Clock
+
+import album_art
+from album_art import THUMBNAIL_SIZE, ArtCache, background_colors, dim, embedded_art, folder_art
+
+BLUE = (20, 40, 200)
+RED = (230, 10, 10)
+
+
+def cover(size=(1200, 900), main=BLUE, patch=RED):
+    # Mostly one colour with a smaller patch of another
+    image = Image.new("RGB", size, main)
+    image.paste(patch, (0, 0, size[0] // 4, size[1] // 4))
+    return image
+
+
+def jpeg_bytes(image):
+    data = io.BytesIO()
+    image.save(data, "JPEG", quality=95)
+    return data.getvalue()
+
+
+def write_mp3(path, picture=None):
+    # A few silent MPEG frames, with an ID3 picture in front if given
+    with open(path, "wb") as f:
+        f.write((b"\xFF\xFB\x90\x00" + bytes(413)) * 40)
+    if picture is not None:
+        from mutagen.id3 import APIC, ID3
+        tags = ID3()
+        tags.add(APIC(encoding=3, mime="image/png", type=0, desc="back", data=b"not the front"))
+        tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="front", data=picture))
+        tags.save(path)
+
+
+def wait_for(results, count=1, timeout=5):
+    deadline = time.time() + timeout
+    while len(results) < count and time.time() < deadline:
+        Clock.tick()
+        time.sleep(0.005)
+    return results
+
+
+def test_dim_keeps_the_hue_and_caps_the_brightness():
+    assert dim((1.0, 0.5, 0.0), 0.4) == pytest.approx([0.4, 0.2, 0.0, 1])
+    # Already dark enough, left alone
+    assert dim((0.1, 0.2, 0.05), 0.4) == pytest.approx([0.1, 0.2, 0.05, 1])
+
+
+def test_background_takes_the_dominant_colour_and_the_most_saturated_one():
+    bottom, top = background_colors(cover(main=(90, 90, 100), patch=RED))
+    # Bottom: the grey that covers most of the picture, dimmed to 0.2
+    assert max(bottom[:3]) == pytest.approx(0.2, abs=0.01)
+    assert abs(bottom[0] - bottom[2]) < 0.03
+    # Top: the red patch, dimmed to 0.4
+    assert top[0] == pytest.approx(0.4, abs=0.01) and top[1] < 0.05 and top[2] < 0.05
+
+
+def test_front_cover_from_the_tags_and_pictures_from_the_folder(tmp_path):
+    picture = jpeg_bytes(cover())
+    write_mp3(str(tmp_path / "tagged.mp3"), picture)
+    assert embedded_art(str(tmp_path / "tagged.mp3")) == picture
+
+    folder = tmp_path / "album"
+    folder.mkdir()
+    write_mp3(str(folder / "01.mp3"))
+    assert embedded_art(str(folder / "01.mp3")) is None
+    assert folder_art(str(folder / "01.mp3")) is None
+    (folder / "folder.jpg").write_bytes(b"folder")
+    (folder / "cover.jpg").write_bytes(b"cover")
+    assert folder_art(str(folder / "01.mp3")) == b"cover"
+
+
+def test_thumbnail_is_made_once_and_read_back_from_disk(tmp_path, monkeypatch):
+    track = str(tmp_path / "a.mp3")
+    write_mp3(track, jpeg_bytes(cover()))
+    cache = ArtCache(str(tmp_path / "art"))
+    results = []
+    cache.request(track, lambda path, art: results.append(art))
+    [art] = wait_for(results)
+    assert max(art.size) == THUMBNAIL_SIZE and art.size == (THUMBNAIL_SIZE, THUMBNAIL_SIZE * 3 // 4)
+    assert len(art.pixels) == art.size[0] * art.size[1] * 4
+    assert cache.cached(track) is art
+    assert [name[-4:] for name in os.listdir(tmp_path / "art")] == [".jpg"]
+
+    # A new cache (next start) reads the thumbnail and never looks at the tags again
+    again = ArtCache(str(tmp_path / "art"))
+    from_disk = []
+    monkeypatch.setattr(album_art, "embedded_art", lambda path: pytest.fail("read the tags again"))
+    again.request(track, lambda path, art: from_disk.append(art))
+    [art_again] = wait_for(from_disk)
+    assert art_again.size == art.size
+    assert sum(art_again.colors, []) == pytest.approx(sum(art.colors, []), abs=0.05)
+    cache.shutdown()
+    again.shutdown()
+
+
+def test_no_art_is_remembered_and_never_calls_back(tmp_path):
+    track = str(tmp_path / "plain.mp3")
+    write_mp3(track)
+    cache = ArtCache(str(tmp_path / "art"))
+    assert cache._load(track) is None
+    assert [name[-5:] for name in os.listdir(tmp_path / "art")] == [".none"]
+    results = []
+    cache.request(track, lambda path, art: results.append(art))
+    time.sleep(0.2)
+    assert wait_for(results, timeout=0.2) == []
+    cache.shutdown()
+
+
+def test_only_the_latest_request_gets_loaded(tmp_path, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    loaded = []
+    real_load = ArtCache._load
+
+    def slow_load(self, path):
+        loaded.append(path)
+        started.set()
+        release.wait(5)
+        return real_load(self, path)
+
+    monkeypatch.setattr(ArtCache, "_load", slow_load)
+    tracks = []
+    for name in "abcd":
+        tracks.append(str(tmp_path / f"{name}.mp3"))
+        write_mp3(tracks[-1], jpeg_bytes(cover()))
+    cache = ArtCache(str(tmp_path / "art"))
+    ready = []
+    cache.request(tracks[0], lambda path, art: ready.append(path))
+    assert started.wait(5)
+    for track in tracks[1:]:
+        cache.request(track, lambda path, art: ready.append(path))
+    release.set()
+    wait_for(ready, 2)
+    cache.shutdown()
+    assert loaded == [tracks[0], tracks[3]]
+    assert ready == [tracks[0], tracks[3]]
+
+
+def test_memory_and_disk_stay_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(album_art, "MEMORY_ITEMS", 2)
+    monkeypatch.setattr(album_art, "DISK_ITEMS", 3)
+    monkeypatch.setattr(album_art, "TRIM_EVERY", 1)
+    cache = ArtCache(str(tmp_path / "art"))
+    tracks = []
+    for number in range(5):
+        tracks.append(str(tmp_path / f"{number}.mp3"))
+        write_mp3(tracks[-1], jpeg_bytes(cover(size=(64, 64))))
+        cache._remember(tracks[-1], cache._load(tracks[-1]))
+        # Whole seconds apart, the trim goes by modification time
+        for name in os.listdir(tmp_path / "art"):
+            file_path = tmp_path / "art" / name
+            stat = os.stat(file_path)
+            os.utime(file_path, (stat.st_mtime - 10, stat.st_mtime - 10))
+    assert [track for track in tracks if cache.cached(track)] == tracks[-2:]
+    assert len(os.listdir(tmp_path / "art")) == 3
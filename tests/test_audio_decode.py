@@ -0,0 +1,120 @@
+"""
+decode_chunks() and the spliced decoding behind it, on generated 16 bit WAV files.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import wave
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("pygame")
+
+import audio_decode
+from audio_decode import ALIGN_FRAMES, CHUNK_SECONDS, decode_chunks
+from seek_index import SeekTable
+
+RATE = 44100
+HEADER = 44  # What the wave module writes in front of the samples
+
+
+def write_wav(path, samples, rate=RATE):
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(samples.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(samples.tobytes())
+    return str(path)
+
+
+def noise(seconds, channels=2, seed=0):
+    # Nothing repeats in noise, a piece that is joined one frame off can't look right by chance
+    rng = np.random.default_rng(seed)
+    return rng.integers(-20000, 20000, (int(seconds * RATE), channels)).astype(np.int16)
+
+
+def splice_table(path, frames, spacing, shift=None):
+    # A seek point every `spacing` seconds. shift moves the bytes of a point away from where its time says, like a
+    # decoder that starts a splice a bit early or late, decode_chunks has to line the pieces up by their content
+    with open(path, 'rb') as f:
+        header = f.read(HEADER)
+    times, offsets = [], []
+    for number, frame in enumerate(range(0, frames, int(spacing * RATE))):
+        moved = frame + (shift(number) if shift and number else 0)
+        times.append(frame / RATE)
+        offsets.append(HEADER + moved * 4)
+    return SeekTable("wav", header, times, offsets)
+
+
+def joined(pieces):
+    return np.concatenate([samples for samples, rate in pieces])
+
+
+def test_wav_comes_in_pieces_of_chunk_seconds(tmp_path):
+    samples = noise(CHUNK_SECONDS * 2 + 3)
+    pieces = list(decode_chunks(write_wav(tmp_path / "a.wav", samples)))
+    assert [len(piece) for piece, rate in pieces] == [CHUNK_SECONDS * RATE] * 2 + [3 * RATE]
+    assert all(rate == RATE for piece, rate in pieces)
+    assert np.array_equal(joined(pieces), samples)
+
+
+def test_mono_wav_plays_on_both_sides(tmp_path):
+    samples = noise(2, channels=1)
+    result = joined(decode_chunks(write_wav(tmp_path / "mono.wav", samples)))
+    assert np.array_equal(result, np.repeat(samples, 2, axis=1))
+
+
+def test_seconds_stops_after_that_much(tmp_path):
+    samples = noise(CHUNK_SECONDS + 5)
+    path = write_wav(tmp_path / "a.wav", samples)
+    result = joined(decode_chunks(path, CHUNK_SECONDS + 1.5))
+    assert np.array_equal(result, samples[:round((CHUNK_SECONDS + 1.5) * RATE)])
+
+
+def test_other_rates_go_through_the_decoder(tmp_path):
+    samples = noise(1.5)
+    path = write_wav(tmp_path / "a.wav", samples, rate=22050)
+    assert audio_decode._wav_chunks(path) is None
+    result = joined(decode_chunks(path))
+    # pygame converts to the mixer's rate
+    assert abs(len(result) - 2 * len(samples)) < 64
+
+
+@pytest.mark.parametrize("spacing", [7.0, 10.0, 13.3])
+def test_spliced_pieces_join_without_gap_or_repeat(tmp_path, spacing):
+    samples = noise(75)
+    path = write_wav(tmp_path / "a.wav", samples)
+    table = splice_table(path, len(samples), spacing)
+    pieces = list(audio_decode._decode_pieces(path, table))
+    assert len(pieces) > 1
+    assert np.array_equal(joined(pieces), samples)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_spliced_pieces_are_lined_up_by_their_content(tmp_path, seed):
+    # Every seek point's bytes are up to 300 frames away from its time, the joins still have to be exact
+    rng = np.random.default_rng(seed)
+    shifts = rng.integers(-300, 300, 64)
+    samples = noise(70, seed=seed)
+    path = write_wav(tmp_path / "a.wav", samples)
+    table = splice_table(path, len(samples), 10.0, shift=lambda number: int(shifts[number]))
+    assert np.array_equal(joined(audio_decode._decode_pieces(path, table)), samples)
+
+
+def test_find_end_picks_the_match_closest_to_where_it_should_be():
+    samples = noise(1)
+    tail = samples[1000:1000 + ALIGN_FRAMES].copy()
+    # The same tail again further on, the one nearer to expected wins
+    samples[5000:5000 + ALIGN_FRAMES] = tail
+    assert audio_decode._find_end(samples, tail, 1000 + ALIGN_FRAMES + 10) == 1000 + ALIGN_FRAMES
+    assert audio_decode._find_end(samples, tail, 5000 + ALIGN_FRAMES - 10) == 5000 + ALIGN_FRAMES
+
+
+def test_find_end_falls_back_to_expected():
+    samples = noise(1)
+    tail = noise(0.01, seed=1)[:ALIGN_FRAMES]
+    assert audio_decode._find_end(samples, tail, 777) == 777
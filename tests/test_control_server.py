@@ -0,0 +1,351 @@
+"""
+ControlServer over its Unix socket and port: commands, batches, busy answers, events and HTTP, against a small
+stand-in for the app.
+
+    python -m pytest tests
+"""
+import json
+import os
+import select
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+import pytest
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kivy.clock import Clock
+from kivy.event import EventDispatcher
+from kivy.properties import BooleanProperty, ListProperty, NumericProperty, OptionProperty
+
+import control_server
+from control_server import ControlServer
+from play_queue import REPEAT_MODES
+from player_engine import EVENTS, PAUSED, PLAYING, STOPPED
+
+
+class Engine:
+    # What the server reads and calls on PlayerEngine, events go out right away on the calling thread
+    def __init__(self):
+        self.ready = True
+        self.state = STOPPED
+        self.path = ""
+        self.index = 0
+        self.info = None
+        self.duration = 0.0
+        self.calls = []
+        self._listeners = {event: [] for event in EVENTS}
+
+    def bind(self, **callbacks):
+        for event, callback in callbacks.items():
+            self._listeners[event].append(callback)
+
+    def unbind(self, **callbacks):
+        for event, callback in callbacks.items():
+            if callback in self._listeners[event]:
+                self._listeners[event].remove(callback)
+
+    def emit(self, event, *args):
+        for callback in list(self._listeners[event]):
+            callback(*args)
+
+    def position(self):
+        return 1.25
+
+    def play(self, index=None):
+        self.calls.append(("play", index))
+        self.set_state(PLAYING)
+
+    def pause(self):
+        self.set_state(PAUSED)
+
+    def resume(self):
+        self.set_state(PLAYING)
+
+    def toggle(self):
+        self.set_state(PAUSED if self.state == PLAYING else PLAYING)
+
+    def stop(self):
+        self.set_state(STOPPED)
+
+    def skip(self, seconds):
+        self.calls.append(("skip", seconds))
+
+    def play_next(self, index):
+        self.calls.append(("play_next", index))
+
+    def set_state(self, state):
+        self.state = state
+        self.emit("on_state", state)
+
+
+class MainScreen(EventDispatcher):
+    volume = NumericProperty(1.0)
+    shuffle = BooleanProperty(False)
+    repeat = OptionProperty(REPEAT_MODES[0], options=REPEAT_MODES)
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def next_song(self):
+        self.calls.append("next")
+
+    def prev_song(self):
+        self.calls.append("previous")
+
+    def seek_music(self, position):
+        self.calls.append(("seek", position))
+
+    def update_slider(self, dt):
+        pass
+
+    def cycle_repeat(self):
+        self.repeat = REPEAT_MODES[(REPEAT_MODES.index(self.repeat) + 1) % len(REPEAT_MODES)]
+
+
+class App(EventDispatcher):
+    playlist = ListProperty()
+
+    def __init__(self):
+        super().__init__()
+        self.engine = Engine()
+        self.main = MainScreen()
+        self.root = self
+
+    def get_screen(self, name):
+        return self.main
+
+    def add_tracks(self, paths):
+        self.playlist = self.playlist + paths
+
+
+@pytest.fixture
+def folder():
+    # Unix socket paths have to stay short, pytest's tmp_path can be too long for one
+    path = tempfile.mkdtemp(prefix="ctl")
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(app, socket_path, port=0):
+    server = ControlServer(app, socket_path, port)
+    server.start()
+    deadline = time.time() + 5
+    while len(server.addresses) < (1 if socket_path else 0) + (1 if port else 0) and time.time() < deadline:
+        time.sleep(0.01)
+    return server
+
+
+@pytest.fixture
+def running(folder):
+    app = App()
+    server = start_server(app, os.path.join(folder, "control.sock"), free_port())
+    yield app, server
+    server.stop()
+
+
+class Connection:
+    # A JSON lines client. Reading ticks the Kivy clock, the commands run on this (the UI) thread
+    def __init__(self, server):
+        self.sock = socket.socket(socket.AF_UNIX)
+        self.sock.connect(server.addresses[0])
+        self.buffer = b""
+
+    def send(self, message):
+        self.sock.sendall((message if isinstance(message, str) else json.dumps(message)).encode() + b"\n")
+
+    def receive(self, timeout=5, tick=True):
+        deadline = time.time() + timeout
+        while b"\n" not in self.buffer:
+            if time.time() > deadline:
+                raise TimeoutError(self.buffer)
+            if tick:
+                Clock.tick()
+            if select.select([self.sock], [], [], 0.01)[0]:
+                data = self.sock.recv(65536)
+                if not data:
+                    raise ConnectionError("closed")
+                self.buffer += data
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return json.loads(line)
+
+    def call(self, message, tick=True):
+        self.send(message)
+        return self.receive(tick=tick)
+
+    def close(self):
+        self.sock.close()
+
+
+def http(server, request):
+    port = int(server.addresses[1].rsplit(":", 1)[1])
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(request.encode())
+        data = b""
+        deadline = time.time() + 5
+        while time.time() < deadline:
+            Clock.tick()
+            if select.select([sock], [], [], 0.01)[0]:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+    head, _, body = data.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+
+def test_commands_run_on_the_ui_thread_and_answer_with_their_id(running):
+    app, server = running
+    client = Connection(server)
+    assert client.call({"cmd": "volume", "volume": 0.25, "id": 7}) == {"id": 7, "ok": True}
+    assert app.main.volume == 0.25
+    assert client.call({"cmd": "play"}) == {"ok": True} and app.engine.state == PLAYING
+    assert client.call({"cmd": "pause"})["ok"] and app.engine.state == PAUSED
+    assert client.call({"cmd": "play"})["ok"] and app.engine.calls == [("play", None)]
+    client.call({"cmd": "seek", "position": -4})
+    client.call({"cmd": "next"})
+    assert app.main.calls == [("seek", 0), "next"]
+    assert client.call({"cmd": "repeat", "mode": "one"})["ok"] and app.main.repeat == "one"
+    assert client.call({"cmd": "shuffle"})["ok"] and app.main.shuffle is True
+
+    answer = client.call({"cmd": "enqueue", "paths": ["/m/a.mp3", "C:\\m\\b.mp3", "/m/c.mp3"], "play": True,
+                          "next": True})
+    assert answer["result"] == {"index": 0, "count": 3}
+    assert app.playlist == ["/m/a.mp3", "C:/m/b.mp3", "/m/c.mp3"]
+    assert app.engine.calls[-3:] == [("play", 0), ("play_next", 2), ("play_next", 1)]
+    client.close()
+
+
+def test_bad_requests_get_an_error_and_the_connection_stays(running):
+    app, server = running
+    client = Connection(server)
+    assert client.call("{not json") == {"ok": False, "error": "not JSON"}
+    assert client.call({"cmd": "volume", "volume": "loud", "id": "a"})["error"].startswith("volume has to be a number")
+    assert client.call({"cmd": "jump"})["error"] == "no command 'jump'"
+    assert "index has to be" in client.call({"cmd": "play", "index": 3})["error"]
+    assert client.call({"cmd": "repeat", "mode": "twice"})["ok"] is False
+    assert client.call(["nope", {"cmd": "volume", "volume": 0.5}]) == [
+        {"ok": False, "error": 'a request is an object with a "cmd"'}, {"ok": True}]
+    client.close()
+
+
+def test_status_never_waits_for_the_ui_thread(running):
+    app, server = running
+    app.engine.ready = False
+    client = Connection(server)
+    status = client.call({"cmd": "status"}, tick=False)["result"]
+    assert status["state"] == STOPPED and status["position"] == 1.25 and status["tracks"] == 0
+    # A command does wait, until the engine is ready
+    client.send({"cmd": "volume", "volume": 0.5})
+    with pytest.raises(TimeoutError):
+        client.receive(timeout=0.3)
+    app.engine.ready = True
+    app.engine.emit("on_ready")
+    assert client.receive() == {"ok": True}
+    client.close()
+
+
+def test_a_batch_runs_in_order_and_is_refused_whole(running, monkeypatch):
+    app, server = running
+    client = Connection(server)
+    answers = client.call([{"cmd": "volume", "volume": 0.5}, {"cmd": "shuffle", "on": True}, {"cmd": "status"}])
+    assert [answer["ok"] for answer in answers] == [True, True, True]
+    assert answers[2]["result"]["volume"] == 0.5 and answers[2]["result"]["shuffle"] is True
+
+    monkeypatch.setattr(control_server, "MAX_PENDING", 2)
+    answers = client.call([{"cmd": "volume", "volume": 0.1, "id": n} for n in range(3)])
+    assert answers == [{"id": n, "ok": False, "error": "busy"} for n in range(3)]
+    assert app.main.volume == 0.5
+    client.close()
+
+
+def test_the_ui_thread_runs_commands_for_the_budget_per_frame(running, monkeypatch):
+    app, server = running
+    monkeypatch.setattr(control_server, "DRAIN_BUDGET", -1)
+    client = Connection(server)
+    client.send([{"cmd": "volume", "volume": n / 10} for n in range(4)])
+    # Wait for all four to be queued, then one runs per tick
+    deadline = time.time() + 5
+    while len(server._pending) < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    volumes = []
+    for _ in range(4):
+        Clock.tick()
+        volumes.append(app.main.volume)
+    assert volumes == [0.0, 0.1, 0.2, 0.3]
+    assert len(client.receive()) == 4
+    client.close()
+
+
+def test_subscribers_get_the_events_they_asked_for(running):
+    app, server = running
+    client = Connection(server)
+    answer = client.call({"cmd": "subscribe", "events": ["state", "position"]})
+    assert answer["result"]["events"] == ["position", "state"]
+    app.engine.set_state(PLAYING)
+    app.engine.emit("on_position", 3.14159)
+    app.engine.emit("on_track_end", "/m/a.mp3")
+    assert client.receive() == {"event": "state", "state": PLAYING}
+    assert client.receive() == {"event": "position", "position": 3.142}
+    assert client.call({"cmd": "unsubscribe", "events": ["position"]})["result"]["events"] == ["state"]
+    # Nobody listens to positions anymore, the engine stops reporting them to the server
+    assert server._position_bound is False
+    assert client.call({"cmd": "subscribe", "events": ["loud"]})["ok"] is False
+    client.close()
+
+
+def test_http(running):
+    app, server = running
+    status, body = http(server, "GET /status HTTP/1.1\r\nHost: x\r\n\r\n")
+    assert status == 200 and body["result"]["state"] == STOPPED
+    command = json.dumps({"cmd": "volume", "volume": 0.75})
+    status, body = http(server, f"POST /command HTTP/1.1\r\nContent-Length: {len(command)}\r\n\r\n{command}")
+    assert (status, body) == (200, {"ok": True}) and app.main.volume == 0.75
+    status, body = http(server, 'POST /command HTTP/1.1\r\nContent-Length: 13\r\n\r\n{"cmd": "no"}')
+    assert status == 400
+    status, body = http(server, f"POST /command HTTP/1.1\r\nOrigin: http://evil\r\nContent-Length: {len(command)}"
+                                f"\r\n\r\n{command}")
+    assert status == 403
+    status, body = http(server, "GET /nothing HTTP/1.1\r\n\r\n")
+    assert status == 404
+
+
+def test_socket_left_behind_is_replaced_and_a_running_one_is_not(folder):
+    path = os.path.join(folder, "control.sock")
+    # A file from a player that crashed, nobody listens on it
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(path)
+    stale.close()
+    first = start_server(App(), path)
+    second = start_server(App(), path)
+    try:
+        assert first.addresses == [path]
+        assert second.addresses == [os.path.join(folder, f"control-{os.getpid()}.sock")]
+        assert oct(os.stat(path).st_mode & 0o777) == oct(0o600)
+    finally:
+        second.stop()
+        first.stop()
+    assert os.listdir(folder) == []
+
+
+def test_stopping_with_a_subscriber_connected(running, caplog):
+    app, server = running
+    client = Connection(server)
+    client.call({"cmd": "subscribe", "events": ["state"]})
+    server.stop()
+    assert server._thread is None
+    assert [record.getMessage() for record in caplog.records if record.levelname == "ERROR"] == []
+    with pytest.raises((ConnectionError, TimeoutError)):
+        client.receive(timeout=1)
+    client.close()
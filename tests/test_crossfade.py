@@ -0,0 +1,72 @@
+"""
+The prepared end of a track for a crossfade, on generated WAV files.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import wave
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("pygame")
+
+from audio_decode import init_worker_mixer
+from crossfade import load_tail, skip_start
+
+RATE = 44100
+
+
+@pytest.fixture(scope="module", autouse=True)
+def mixer():
+    init_worker_mixer()
+
+
+def write_wav(path, samples):
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(RATE)
+        f.writeframes(samples.tobytes())
+    return str(path)
+
+
+def constant(seconds, level=10000):
+    return np.full((int(seconds * RATE), 2), level, np.int16)
+
+
+def samples_of(sound):
+    from pygame import sndarray
+    return np.array(sndarray.samples(sound))
+
+
+def test_tail_is_the_end_of_the_track_fading_out(tmp_path):
+    path = write_wav(tmp_path / "a.wav", constant(6))
+    tail = samples_of(load_tail(path, 4.0, 6.0, None))
+    assert len(tail) == 2 * RATE
+    assert tail[0, 0] == 10000
+    # Equal power: half way through the level is cos(pi / 4)
+    assert tail[RATE, 0] == pytest.approx(10000 * np.cos(np.pi / 4), abs=2)
+    assert np.all(np.diff(tail[:, 0].astype(int)) <= 0)
+    assert abs(int(tail[-1, 0])) < 20
+
+
+def test_tail_starts_at_the_exact_frame(tmp_path):
+    # A ramp, every frame is its own number
+    ramp = np.repeat((np.arange(6 * RATE) % 30000).astype(np.int16)[:, None], 2, axis=1)
+    path = write_wav(tmp_path / "a.wav", ramp)
+    tail = samples_of(load_tail(path, 5.0, 6.0, None))
+    assert tail[0, 0] == ramp[5 * RATE, 0]
+
+
+def test_skip_start_drops_what_was_already_heard(tmp_path):
+    path = write_wav(tmp_path / "a.wav", constant(6))
+    sound = load_tail(path, 4.0, 6.0, None)
+    whole = samples_of(sound)
+    # The engine woke up 120 ms into the tail, the fade carries on from there instead of starting over
+    late = samples_of(skip_start(sound, 0.12))
+    assert np.array_equal(late, whole[int(0.12 * RATE):])
+    assert skip_start(sound, 2.5) is None
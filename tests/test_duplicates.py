@@ -0,0 +1,151 @@
+"""
+Duplicate finding: fingerprints of changed copies against unrelated audio, the fingerprint index, and DuplicateFinder
+on generated WAVs.
+
+    python -m pytest tests
+"""
+import os
+import shutil
+import sys
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+np = pytest.importorskip("numpy")
+
+import audio_decode
+from duplicates import (FINGERPRINT_SECONDS, DuplicateFinder, FingerprintIndex, bit_error_rate,
+                        fingerprint, fingerprint_file, length_bucket, same_recording)
+from metadata_index import MetadataIndex
+
+RATE = 44100
+
+
+def tones(seconds, seed, rate=RATE):
+    # Something with a spectrum that changes like music does: a few tones every 200 ms
+    rng = np.random.default_rng(seed)
+    step = rate // 5
+    t = np.arange(step) / rate
+    pieces = []
+    for _ in range(int(seconds * 5)):
+        piece = sum(np.sin(2 * np.pi * rng.uniform(300, 2000) * t) for _ in range(3))
+        pieces.append(piece * rng.uniform(0.3, 1.0))
+    mono = np.concatenate(pieces) * 7000
+    return np.stack([mono, mono], axis=1).astype(np.int16)
+
+
+def changed_copy(samples, seed=99):
+    # Quieter, a little noise on top, 100 ms more silence in front
+    rng = np.random.default_rng(seed)
+    quieter = samples * 0.5 + rng.normal(0, 300, samples.shape)
+    return np.concatenate([np.zeros((RATE // 10, 2)), quieter]).astype(np.int16)
+
+
+def write_wav(path, samples):
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(RATE)
+        f.writeframes(samples.tobytes())
+    return str(path)
+
+
+def test_a_changed_copy_keeps_most_bits_an_unrelated_track_doesnt():
+    original = fingerprint(tones(20, 1), RATE)
+    copy = fingerprint(changed_copy(tones(20, 1)), RATE)
+    other = fingerprint(tones(20, 2), RATE)
+    # 100 ms is a bit more than 2 frames of 46 ms
+    shifted = min(range(4), key=lambda offset: bit_error_rate(copy, original, offset))
+    assert shifted == 2
+    assert bit_error_rate(copy, original, shifted) < 0.2
+    assert same_recording(copy, original, shifted)
+    assert abs(bit_error_rate(other, original, 0) - 0.5) < 0.1
+    assert not same_recording(other, original, 0)
+    assert fingerprint(tones(1, 1), RATE) is None
+
+
+def test_index_finds_the_track_and_its_offset():
+    rng = np.random.default_rng(5)
+    index = FingerprintIndex()
+    tracks = [rng.integers(1, 1 << 32, 600, dtype=np.uint32) for _ in range(300)]
+    for track, prints in enumerate(tracks):
+        index.add(track, prints, length_bucket(200 + track % 7))
+    assert len(index) > 0
+
+    # Track 123 as a query, starting 10 frames in, with a fifth of the bits flipped
+    query = tracks[123][10:].copy()
+    flips = (rng.random((len(query), 32)) < 0.2) << np.arange(32)
+    query ^= flips.sum(axis=1).astype(np.uint32)
+    found = index.query(query, length_bucket(200 + 123 % 7))
+    assert max(found, key=lambda track: found[track][1]) == 123
+    assert found[123][0] == -10
+    assert same_recording(query, tracks[123], -10)
+    # Another length never meets it
+    assert 123 not in index.query(query, length_bucket(200 + 123 % 7) + 5)
+    assert index.query(rng.integers(1, 1 << 32, 600, dtype=np.uint32), length_bucket(200)) == {}
+
+
+def test_only_the_start_of_the_file_gets_decoded(tmp_path, monkeypatch):
+    pytest.importorskip("pygame")
+    samples = tones(FINGERPRINT_SECONDS * 3, 3)
+    path = write_wav(tmp_path / "long.wav", samples)
+    decoded = []
+    decode_chunks = audio_decode.decode_chunks
+
+    def counting(path, seconds=None):
+        for piece, rate in decode_chunks(path, seconds):
+            decoded.append(len(piece))
+            yield piece, rate
+
+    monkeypatch.setattr(audio_decode, "decode_chunks", counting)
+    row = fingerprint_file(path)
+    assert sum(decoded) == (FINGERPRINT_SECONDS + 1) * RATE
+    # The same fingerprint as from the whole track
+    assert row[0] == path and row[1:3] == (os.stat(path).st_mtime, os.stat(path).st_size)
+    assert np.array_equal(np.frombuffer(row[3], "<u4"), fingerprint(samples, RATE))
+
+
+def test_finder_groups_copies_and_changed_copies(tmp_path, monkeypatch):
+    pytest.importorskip("pygame")
+    index = MetadataIndex(str(tmp_path / "library.db"))
+    music = tmp_path / "music"
+    music.mkdir()
+    samples = tones(12, 1)
+    original = write_wav(music / "a.wav", samples)
+    copy = str(music / "b.wav")
+    shutil.copy(original, copy)
+    changed = write_wav(music / "c.wav", changed_copy(samples))
+    other = write_wav(music / "d.wav", tones(12, 2))
+    short = write_wav(music / "e.wav", tones(3, 4))
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    seen = []
+    finder = DuplicateFinder(index, on_change=seen.append)
+    monkeypatch.setattr(finder, "_get_pool", lambda: pool)
+
+    def wait_for(expected, timeout=20):
+        deadline = time.time() + timeout
+        while (not seen or seen[-1] != expected) and time.time() < deadline:
+            time.sleep(0.02)
+        return seen[-1] if seen else None
+
+    try:
+        finder.add([original, other, copy, changed, short])
+        assert wait_for({copy, changed}) == {copy, changed}
+        # The exact copy never got a fingerprint of its own, the one of a.wav stands for it
+        assert set(index.lookup_fingerprints([original, copy, changed, other])) == {original, changed, other}
+
+        # Without a.wav the copy is the original of the group
+        finder.remove(original)
+        assert wait_for({changed}) == {changed}
+        finder.add([original])
+        assert wait_for({changed, original}) == {changed, original}
+    finally:
+        finder.shutdown()
+        pool.shutdown()
+        index.close()
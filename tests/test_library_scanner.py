@@ -0,0 +1,79 @@
+"""
+LibraryScanner batches and order, on a folder of empty files the metadata index already knows.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kivy.clock import Clock
+
+from library_scanner import BATCH_SIZE, LibraryScanner, walk_audio_files
+from metadata_index import MetadataIndex, TrackInfo
+
+
+def make_library(root, folders, per_folder):
+    # Files with up to date rows in the index, so nothing gets probed and no worker process is needed
+    index = MetadataIndex(str(root / "library.db"))
+    infos = []
+    for folder in range(folders):
+        path = root / "music" / f"album {folder:02d}"
+        path.mkdir(parents=True)
+        for number in range(per_folder):
+            file_path = path / f"{number:03d}.mp3"
+            file_path.write_bytes(b"")
+            stat = os.stat(file_path)
+            infos.append(TrackInfo(str(file_path), stat.st_mtime, stat.st_size, 1.0, None, None, None, "MP3", 0))
+    index.store_many(infos)
+    return index, str(root / "music"), [info.path for info in infos]
+
+
+def run_until_done(scanner, root, timeout=30):
+    finished = []
+    scanner.on_done = finished.append
+    scanner.start(root)
+    deadline = time.time() + timeout
+    while not finished and time.time() < deadline:
+        Clock.tick()
+        time.sleep(0.005)
+    return finished
+
+
+def test_walk_is_in_folder_and_file_name_order(tmp_path):
+    index, root, paths = make_library(tmp_path, 3, 4)
+    (tmp_path / "music" / "album 01" / "notes.txt").write_bytes(b"")
+    assert [path for path, stat in walk_audio_files(root)] == paths
+    index.close()
+
+
+def test_batches_are_batch_size_across_chunks(tmp_path):
+    index, root, paths = make_library(tmp_path, 13, 100)
+    batches = []
+    scanner = LibraryScanner(index, on_batch=batches.append, workers=2)
+    assert run_until_done(scanner, root) == [False]
+    assert [len(batch) for batch in batches] == [BATCH_SIZE, BATCH_SIZE, len(paths) - 2 * BATCH_SIZE]
+    assert [info.path for batch in batches for info in batch] == paths
+    index.close()
+
+
+def test_nothing_is_added_after_a_cancel(tmp_path):
+    index, root, paths = make_library(tmp_path, 6, 100)
+    batches = []
+    scanner = LibraryScanner(index, on_batch=batches.append, workers=2)
+    scanner.start(root)
+    # The scan finishes with its batches waiting for the Kivy thread, then gets cancelled
+    deadline = time.time() + 30
+    while scanner.running and time.time() < deadline:
+        time.sleep(0.01)
+    assert scanner.done == len(paths)
+    scanner.cancel()
+    for _ in range(5):
+        Clock.tick()
+    assert batches == []
+    index.close()
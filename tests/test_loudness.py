@@ -0,0 +1,71 @@
+"""
+LoudnessMeter fed piece by piece against the same signal in one go.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loudness import FILTER_OVERLAP, FILTER_WINDOW, LoudnessMeter, integrated_loudness
+
+RATE = 44100
+
+
+def signal(seconds, seed=0):
+    # Noise that gets louder and quieter, with a quiet stretch the relative gate has to throw out
+    rng = np.random.default_rng(seed)
+    frames = int(seconds * RATE)
+    envelope = 0.2 + 0.15 * np.sin(np.linspace(0, 12, frames))
+    envelope[frames // 3:frames // 3 + RATE] = 0.002
+    noise = rng.standard_normal((frames, 2)) * envelope[:, None] * 8000
+    return np.clip(noise, -32768, 32767).astype(np.int16)
+
+
+def measure(samples, cuts):
+    meter = LoudnessMeter(RATE, samples.shape[1])
+    for start, end in zip([0] + cuts, cuts + [len(samples)]):
+        meter.add(samples[start:end])
+    return meter.result(), np.concatenate(meter.powers)
+
+
+def random_cuts(rng, frames, count):
+    return sorted(int(cut) for cut in rng.integers(1, frames, count))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_cut_pieces_measure_like_the_whole_track(seed):
+    samples = signal(12, seed)
+    rng = np.random.default_rng(seed)
+    whole, whole_powers = measure(samples, [])
+    cuts = random_cuts(rng, len(samples), 20)
+    # Pieces shorter than the filter overlap and cuts right at a window boundary too
+    cuts = sorted(set(cuts + [FILTER_WINDOW - FILTER_OVERLAP, FILTER_WINDOW - FILTER_OVERLAP + 7]))
+    chunked, chunked_powers = measure(samples, cuts)
+    assert chunked == pytest.approx(whole, abs=1e-8)
+    # Every 100 ms step (what the blocks and both gates are built from) comes out the same
+    assert len(chunked_powers) == len(whole_powers)
+    assert np.allclose(chunked_powers, whole_powers, rtol=1e-9, atol=0)
+
+
+def test_one_frame_at_a_time_at_the_start():
+    samples = signal(3)
+    cuts = list(range(1, 200))
+    assert measure(samples, cuts)[0] == pytest.approx(measure(samples, [])[0], abs=1e-8)
+
+
+def test_sine_at_a_known_level():
+    # A 1 kHz sine at -20 dBFS on both channels reads about -20 LUFS (EBU Tech 3341)
+    t = np.arange(10 * RATE) / RATE
+    tone = (np.sin(2 * np.pi * 1000 * t) * 0.1 * 32767).astype(np.int16)
+    samples = np.stack([tone, tone], axis=1)
+    assert integrated_loudness(samples, RATE) == pytest.approx(-20.0, abs=0.1)
+
+
+def test_silence_and_short_input_have_no_loudness():
+    assert integrated_loudness(np.zeros((5 * RATE, 2), np.int16), RATE) is None
+    assert integrated_loudness(signal(0.3), RATE) is None
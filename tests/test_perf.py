@@ -0,0 +1,131 @@
+"""
+PerfRecorder spans, summaries and exports, and the frame and animation timing behind the F12 overlay.
+
+    python -m pytest tests
+"""
+import json
+import os
+import sys
+import time
+
+import pytest
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import perf
+from perf import NO_SPAN, SAMPLES, TRACE_SPANS, PerfRecorder
+
+
+def test_nothing_is_recorded_while_off():
+    recorder = PerfRecorder()
+    assert recorder.span("load") is NO_SPAN
+    with recorder.span("load"):
+        pass
+
+    @recorder.timed("tick")
+    def tick(value):
+        return value * 2
+
+    assert tick(4) == 8 and tick.__wrapped__(1) == 2
+    recorder.record("import", time.perf_counter())
+    assert recorder.spans() == [] and recorder.summary() == {}
+
+
+def test_spans_and_timed_calls_are_recorded():
+    recorder = PerfRecorder(enabled=True)
+    with recorder.span("load"):
+        time.sleep(0.01)
+
+    @recorder.timed("tick")
+    def tick():
+        raise ValueError("still recorded")
+
+    with pytest.raises(ValueError):
+        tick()
+    start = time.perf_counter()
+    recorder.record("import", start - 2.0, start)
+    names = [span.name for span in recorder.spans()]
+    assert names == ["load", "tick", "import"]
+    load, tick_span, imported = recorder.spans()
+    assert load.duration >= 0.01 and load.thread == "MainThread"
+    assert imported.duration == pytest.approx(2.0)
+    assert recorder.summary()["import"]["max"] == pytest.approx(2000.0)
+
+
+def test_summary_percentiles_over_the_last_samples():
+    recorder = PerfRecorder(enabled=True)
+    # 1..SAMPLES ms first, then SAMPLES more of 1 s: the percentiles only see the newest, count and max see all
+    for number in range(1, SAMPLES + 1):
+        recorder.record("step", 0.0, number / 1000)
+    stats = recorder.summary()["step"]
+    assert stats["p50"] == pytest.approx(SAMPLES // 2 + 1)
+    assert stats["p95"] == pytest.approx(int(SAMPLES * 0.95) + 1)
+    assert stats["last"] == pytest.approx(SAMPLES) and stats["max"] == pytest.approx(SAMPLES)
+    assert stats["mean"] == pytest.approx((SAMPLES + 1) / 2)
+    for _ in range(SAMPLES):
+        recorder.record("step", 0.0, 1.0)
+    stats = recorder.summary()["step"]
+    assert stats["count"] == SAMPLES * 2 and stats["p50"] == pytest.approx(1000.0)
+
+
+def test_trace_keeps_the_newest_spans(tmp_path):
+    recorder = PerfRecorder(enabled=True)
+    for number in range(TRACE_SPANS + 10):
+        recorder.record(f"span {number % 3}", recorder.started + number * 1e-6, recorder.started + number * 1e-6 + 1e-3)
+    assert len(recorder.spans()) == TRACE_SPANS
+    assert recorder.summary()["span 0"]["count"] == len(range(0, TRACE_SPANS + 10, 3))
+
+    path = str(tmp_path / "out" / "trace.json")
+    recorder.export_trace(path)
+    with open(path, encoding="utf-8") as f:
+        trace = json.load(f)
+    events = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert len(events) == TRACE_SPANS
+    assert events[0]["ts"] == pytest.approx(10.0) and events[0]["dur"] == pytest.approx(1000.0)
+    assert [event["args"]["name"] for event in trace["traceEvents"] if event["ph"] == "M"] == ["MainThread"]
+    assert not os.path.exists(path + ".tmp")
+
+    recorder.export_json(str(tmp_path / "summary.json"))
+    with open(tmp_path / "summary.json", encoding="utf-8") as f:
+        assert set(json.load(f)["spans"]) == {"span 0", "span 1", "span 2"}
+    recorder.clear()
+    assert recorder.spans() == [] and recorder.summary() == {}
+
+
+@pytest.fixture
+def recording(monkeypatch):
+    monkeypatch.setattr(perf.recorder, "enabled", True)
+    perf.recorder.clear()
+    yield perf.recorder
+    perf.recorder.clear()
+
+
+def test_frame_watch_times_frames_and_animations_and_puts_kivy_back(recording):
+    pytest.importorskip("kivy")
+    from kivy.animation import Animation
+    from kivy.clock import Clock
+    from kivy.uix.widget import Widget
+    from perf_overlay import FrameWatch
+
+    original = Animation._update
+    watch = FrameWatch()
+    watch.start()
+    assert Animation._update is not original and Animation._update.__wrapped__ is original
+    widget = Widget(opacity=0)
+    Animation(opacity=1, duration=0.05).start(widget)
+    deadline = time.time() + 2
+    while widget.opacity < 1 and time.time() < deadline:
+        Clock.tick()
+    watch.stop()
+    assert widget.opacity == 1
+    names = {span.name for span in recording.spans()}
+    assert {"frame", "animation"} <= names
+
+    # Back to Kivy's own method, and a second start wraps that one, not the old wrapper
+    assert Animation._update is original
+    watch.start()
+    assert Animation._update.__wrapped__ is original
+    watch.stop()
+    watch.stop()
+    assert Animation._update is original
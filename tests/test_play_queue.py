@@ -0,0 +1,235 @@
+"""
+PlayQueue against a plain list, plus the cases that are easy to get wrong.
+
+    python -m pytest tests
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from play_queue import REPEAT_ALL, REPEAT_MODES, REPEAT_OFF, REPEAT_ONE, PlayQueue
+
+
+def check(queue, model):
+    # Everything the queue keeps next to the playlist has to agree with the plain list
+    assert queue._ids == model
+    assert len(queue) == len(model)
+    assert all(a < b for a, b in zip(queue._keys, queue._keys[1:]))
+    for position, track_id in enumerate(model):
+        assert queue.position(track_id) == position and queue.id_at(position) == track_id
+    assert queue.current is None or queue.current in queue
+    if queue.shuffle:
+        assert sorted(track_id for track_id in queue._order if track_id in queue) == sorted(model)
+        assert all(queue._order_index[track_id] == index for index, track_id in enumerate(queue._order))
+        if queue._anchor in queue:
+            assert queue._order[queue._cursor] == queue._anchor
+
+
+def expected_next(queue, model):
+    # What next() should return in playlist order when no "play next" track is waiting
+    if queue.current is None or queue.current != queue._anchor:
+        return None  # Not worked out here
+    position = model.index(queue.current) + 1
+    if position < len(model):
+        return model[position]
+    return model[0] if queue.repeat != REPEAT_OFF else None
+
+
+def make_queue(count, **options):
+    queue = PlayQueue(seed=1)
+    ids = queue.add([f"/music/{n}.mp3" for n in range(count)])
+    for name, value in options.items():
+        getattr(queue, f"set_{name}")(value)
+    return queue, ids
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_random_operations_agree_with_a_list(seed):
+    rng = random.Random(seed)
+    queue = PlayQueue(seed)
+    model = []
+    for step in range(300):
+        op = rng.random()
+        if op < 0.2 or not model:
+            model += queue.add([str(rng.random()) for _ in range(rng.randint(1, 20))])
+        elif op < 0.35:
+            track_id = rng.choice(model)
+            queue.remove(track_id)
+            model.remove(track_id)
+        elif op < 0.45:
+            track_id = rng.choice(model)
+            position = rng.randrange(len(model))
+            queue.move(track_id, position)
+            model.remove(track_id)
+            model.insert(position, track_id)
+        elif op < 0.55:
+            queue.jump(rng.choice(model))
+        elif op < 0.7:
+            auto = rng.random() < 0.5
+            peeked = queue.peek_next(auto)
+            expected = None
+            if not queue.shuffle and not (auto and queue.repeat == REPEAT_ONE) and \
+                    not any(track_id in queue for track_id in queue._up_next):
+                expected = expected_next(queue, model)
+            assert queue.next(auto) == peeked, f"step {step}: peek_next and next disagree"
+            if expected is not None:
+                assert peeked == expected, f"step {step}: not the next track in the list"
+        elif op < 0.78:
+            queue.previous()
+        elif op < 0.85:
+            queue.play_next(rng.choice(model))
+        elif op < 0.92:
+            queue.set_shuffle(not queue.shuffle)
+        else:
+            queue.set_repeat(rng.choice(REPEAT_MODES))
+        check(queue, model)
+
+
+def test_remove_current_makes_the_next_track_current():
+    queue, ids = make_queue(5)
+    queue.jump(ids[2])
+    queue.remove(ids[2])
+    assert queue.current == ids[3]
+    assert queue.next() == ids[4]
+    assert queue.previous() == ids[3]
+
+
+def test_remove_current_at_the_end_goes_back_one():
+    queue, ids = make_queue(3)
+    queue.jump(ids[2])
+    queue.remove(ids[2])
+    assert queue.current == ids[1]
+    assert queue.peek_next(auto=False) is None
+
+
+def test_remove_current_in_shuffle_keeps_the_order():
+    queue, ids = make_queue(20, shuffle=True)
+    queue.jump(ids[0])
+    played = [ids[0]] + [queue.next() for _ in range(4)]
+    # A track whose neighbour in the list hasn't been played either, that neighbour slides into its place
+    current = next(track_id for track_id in ids[:-1]
+                   if track_id not in played and track_id + 1 not in played)
+    queue.jump(current)
+    queue.remove(current)
+    assert queue.current == current + 1
+    rest = []
+    while (track_id := queue.next()) is not None:
+        rest.append(track_id)
+    # Everything still to come plays once, nothing that was played comes back
+    assert sorted(rest) == sorted(set(ids) - set(played) - {current, current + 1})
+
+
+def test_remove_while_a_play_next_track_plays_keeps_the_place_in_the_order():
+    queue, ids = make_queue(10)
+    queue.jump(ids[2])
+    queue.play_next(ids[7])
+    assert queue.next() == ids[7]
+    queue.remove(ids[7])
+    # The track that slid into its place shows as current, the order still carries on after the third track
+    assert queue.current == ids[8]
+    assert queue.next() == ids[3]
+
+
+def test_remove_while_a_play_next_track_plays_in_shuffle():
+    queue, ids = make_queue(10, shuffle=True)
+    first = queue.next()
+    expected = queue.peek_next()
+    extra = next(track_id for track_id in ids if track_id not in (first, expected))
+    queue.play_next(extra)
+    assert queue.next() == extra
+    queue.remove(extra)
+    assert queue.next() == expected
+
+
+def test_play_next_tracks_play_before_the_order():
+    queue, ids = make_queue(10)
+    queue.jump(ids[0])
+    queue.play_next(ids[5])
+    queue.play_next(ids[8])
+    assert [queue.next() for _ in range(4)] == [ids[8], ids[5], ids[1], ids[2]]
+
+
+def test_previous_in_shuffle_walks_back_through_what_was_played():
+    queue, ids = make_queue(20, shuffle=True)
+    queue.jump(ids[0])
+    played = [ids[0]] + [queue.next() for _ in range(6)]
+    assert len(set(played)) == len(played)
+    back = [queue.previous() for _ in range(6)]
+    assert back == played[-2::-1]
+    # Going forward again replays the same tracks
+    assert [queue.next() for _ in range(6)] == played[1:]
+
+
+def test_previous_in_shuffle_without_history_follows_the_order():
+    queue, ids = make_queue(20, shuffle=True)
+    queue.jump(ids[0])
+    played = [ids[0]] + [queue.next() for _ in range(4)]
+    queue._history.clear()
+    assert [queue.previous() for _ in range(4)] == played[-2::-1]
+    assert queue.previous() is None
+    assert not queue.has_previous()
+
+
+def test_repeat_all_wraps_around_in_list_order():
+    queue, ids = make_queue(4, repeat=REPEAT_ALL)
+    queue.jump(ids[3])
+    assert queue.peek_next() == ids[0]
+    assert queue.next() == ids[0]
+
+
+def test_repeat_all_in_shuffle_plays_every_track_each_round():
+    queue, ids = make_queue(8, shuffle=True, repeat=REPEAT_ALL)
+    for _ in range(3):
+        heard = [queue.next() for _ in range(8)]
+        assert sorted(heard) == ids
+    # peek_next and next agree on the first track of a new round too
+    assert queue.peek_next() == queue.next()
+
+
+def test_repeat_one_replays_only_at_the_end_of_the_track():
+    queue, ids = make_queue(3, repeat=REPEAT_ONE)
+    queue.jump(ids[1])
+    assert queue.next(auto=True) == ids[1]
+    assert queue.next() == ids[2]
+
+
+def test_repeat_off_stops_at_the_end():
+    queue, ids = make_queue(3)
+    queue.jump(ids[2])
+    assert queue.next() is None
+    assert not queue.has_next()
+    assert queue.current == ids[2]
+
+
+def test_adding_in_shuffle_keeps_what_was_coming():
+    queue, ids = make_queue(200, shuffle=True)
+    queue.jump(ids[0])
+    played = [ids[0]] + [queue.next() for _ in range(20)]
+    upcoming = queue._order[queue._cursor + 1:]
+    added = queue.add([f"/more/{n}.mp3" for n in range(5)])
+    after = queue._order[queue._cursor + 1:]
+    # Only the tracks that traded places with a new one moved, to the end
+    moved = [place for place, track_id in enumerate(upcoming) if after[place] != track_id]
+    assert len(moved) <= len(added)
+    assert sorted(after) == sorted(upcoming + added)
+    rest = []
+    while (track_id := queue.next()) is not None:
+        rest.append(track_id)
+    assert sorted(rest) == sorted(set(ids + added) - set(played))
+
+
+def test_added_tracks_land_anywhere_in_the_rest_of_the_shuffle():
+    places = []
+    for seed in range(200):
+        queue = PlayQueue(seed)
+        queue.set_shuffle(True)
+        queue.add([f"/music/{n}.mp3" for n in range(50)])
+        queue.next()
+        (added,) = queue.add(["/new.mp3"])
+        places.append(queue._order_index[added] - queue._cursor - 1)
+    # 50 places it can go to, every fifth of them gets used
+    assert {place * 5 // 50 for place in places} == set(range(5))
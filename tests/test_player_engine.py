@@ -0,0 +1,43 @@
+"""
+PlayerEngine without a sound card.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pygame = pytest.importorskip("pygame")
+
+from player_engine import PlayerEngine
+
+
+@pytest.fixture
+def no_sound_card(monkeypatch):
+    # What mixer.init() does on a machine without an audio device
+    def fail(*args, **kwargs):
+        raise pygame.error("No available audio device")
+    monkeypatch.setattr(pygame.mixer, "get_init", lambda: None)
+    monkeypatch.setattr(pygame.mixer, "init", fail)
+
+
+def test_commands_without_a_mixer_do_not_raise(no_sound_card):
+    engine = PlayerEngine()
+    engine.start()
+    # Before the mixer was even tried
+    engine.unload()
+    assert engine._ready.wait(5)
+    assert not engine.mixer_open
+    engine.set_volume(0.3)
+    engine.set_normalize(False)
+    engine.add(["/music/a.mp3"])
+    # Removing the last track, the main screen unloads then
+    engine.remove(0)
+    engine.unload()
+    # clear() unloads too
+    engine.clear()
+    assert engine.path == ""
+    engine.shutdown()
@@ -0,0 +1,115 @@
+"""
+Playlist files: the native format round trip, M3U paths, and what PlaylistLoader puts into the metadata index.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kivy.clock import Clock
+
+from metadata_index import MetadataIndex, TrackInfo
+from playlists import PlaylistLoader, escape, iter_playlist, parse_native_line, unescape, write_m3u, write_native
+
+
+@pytest.mark.parametrize("value", ["plain", "tab\there", "new\nline", "back\\slash", "\\t not a tab", "ends with \\",
+                                   "\\\\\t\n\\n", "", "Beyoncé"])
+def test_escape_round_trip(value):
+    escaped = escape(value)
+    assert "\t" not in escaped and "\n" not in escaped
+    assert unescape(escaped) == value
+
+
+def test_native_line_round_trip():
+    info = TrackInfo("/music/a\tb.mp3", 1700000000.123456, 1234, 215.5, "Title\nTwo", "Art\\ist", None, "MP3", 320)
+    line = "\t".join(escape(value) for value in info)
+    assert parse_native_line(line) == (info.path, info)
+    # Just a path, or a line from a newer version with more fields
+    assert parse_native_line(escape("/music/x\ty.mp3")) == ("/music/x\ty.mp3", None)
+    assert parse_native_line(line + "\textra") == (info.path, None)
+    assert parse_native_line("/a.mp3\tnot a time\t1\t1\t\t\t\t\t0") == ("/a.mp3", None)
+
+
+def test_native_file_round_trip(tmp_path):
+    paths = ["/music/one.mp3", "/music/two\tthree.flac", "http://radio.example/stream.mp3"]
+    infos = {paths[0]: TrackInfo(paths[0], 1.5, 10, 60.0, "One", None, "Album", "MP3", 128)}
+    file_path = str(tmp_path / "list.mpl")
+    write_native(file_path, paths, infos)
+    assert list(iter_playlist(file_path)) == [(paths[0], infos[paths[0]]), (paths[1], None), (paths[2], None)]
+    assert not os.path.exists(file_path + ".tmp")
+
+
+def test_m3u_paths_are_relative_to_the_playlist(tmp_path):
+    folder = tmp_path / "lists"
+    folder.mkdir()
+    file_path = folder / "mix.m3u8"
+    file_path.write_bytes("﻿#EXTM3U\r\n#EXTINF:10,Some - Song\r\nsongs/a.mp3\r\n..\\other\\b.mp3\r\n\r\n"
+                          "/abs/c.mp3\r\nhttp://radio.example/d.mp3\r\n".encode("utf-8"))
+    base = str(folder).replace("\\", "/")
+    assert [path for path, info in iter_playlist(str(file_path))] == [
+        base + "/songs/a.mp3",
+        os.path.normpath(os.path.join(str(tmp_path), "other/b.mp3")).replace("\\", "/"),
+        "/abs/c.mp3",
+        "http://radio.example/d.mp3",
+    ]
+
+
+def test_m3u_written_and_read_back(tmp_path):
+    paths = [str(tmp_path / "a.mp3"), str(tmp_path / "b.mp3")]
+    infos = {paths[0]: TrackInfo(paths[0], 1.0, 1, 61.9, "Song", "Artist", None, "MP3", 0)}
+    file_path = str(tmp_path / "out.m3u")
+    write_m3u(file_path, paths, infos)
+    with open(file_path, encoding="utf-8") as f:
+        assert f.read().splitlines()[:2] == ["#EXTM3U", "#EXTINF:61,Artist - Song"]
+    assert [path for path, info in iter_playlist(file_path)] == paths
+
+
+def load(loader, file_path, timeout=10):
+    finished = []
+    loader.on_done = finished.append
+    loader.start(file_path)
+    deadline = time.time() + timeout
+    while not finished and time.time() < deadline:
+        Clock.tick()
+        time.sleep(0.005)
+    return finished
+
+
+def test_only_rows_that_still_fit_the_file_go_into_the_index(tmp_path):
+    index = MetadataIndex(str(tmp_path / "library.db"))
+    fresh, changed, gone = (str(tmp_path / name) for name in ("fresh.mp3", "changed.mp3", "gone.mp3"))
+    stream = "http://radio.example/stream.mp3"
+    infos = {}
+    for path in (fresh, changed):
+        with open(path, "wb") as f:
+            f.write(b"x" * 100)
+        stat = os.stat(path)
+        infos[path] = TrackInfo(path, stat.st_mtime, stat.st_size, 1.0, "Saved", None, None, "MP3", 0)
+    infos[gone] = TrackInfo(gone, 1.0, 100, 1.0, "Saved", None, None, "MP3", 0)
+    infos[stream] = TrackInfo(stream, 0.0, 0, 1.0, "Saved", None, None, "MP3", 0)
+    file_path = str(tmp_path / "list.mpl")
+    write_native(file_path, [fresh, changed, gone, stream], infos)
+
+    # Retagged after the playlist was saved, the index already has the new tags
+    with open(changed, "ab") as f:
+        f.write(b"more")
+    stat = os.stat(changed)
+    index.store_many([TrackInfo(changed, stat.st_mtime, stat.st_size, 1.0, "Retagged", None, None, "MP3", 0)])
+
+    batches = []
+    loader = PlaylistLoader(index, on_batch=lambda paths, known: batches.append((paths, known)))
+    assert load(loader, file_path) == [False]
+    [(paths, known)] = batches
+    assert paths == [fresh, changed, gone, stream]
+    assert known[fresh].title == "Saved" and known[changed].title == "Retagged"
+    assert gone not in known and stream not in known
+    assert index.lookup(changed).title == "Retagged"
+    assert index.lookup(fresh).title == "Saved"
+    assert index.lookup(gone) is None and index.lookup(stream) is None
+    index.close()
@@ -0,0 +1,129 @@
+"""
+SearchIndex against a plain scan over the same playlist, while tracks get added and popped.
+
+    python -m pytest tests
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metadata_index import TrackInfo
+from search_index import INDEX_CHUNK, SearchIndex, search_text, words
+
+
+def info(path, title=None, artist=None, album=None):
+    return TrackInfo(path, 0, 0, 1.0, title, artist, album, "MP3", 0)
+
+
+def plain_search(rows, query):
+    # What search() has to come up with: every query word starts some word of the row
+    terms = words(query)
+    if not terms:
+        return None
+    return [position for position, row_words in enumerate(rows)
+            if all(any(word.startswith(term) for word in row_words) for term in terms)]
+
+
+NAMES = ["Daft Punk", "Daft Punk - Da Funk", "Beyoncé", "The Beatles", "Beach House", "Boards of Canada",
+         "Dubstar", "Punk Rock", "a", "ab", "Ólafur Arnalds"]
+
+
+def random_paths(rng, count, first=0):
+    return [f"/music/{rng.choice(NAMES)} {rng.choice(NAMES)} {first + n:05d}.mp3" for n in range(count)]
+
+
+def test_tags_and_file_name_both_match():
+    index = SearchIndex()
+    paths = ["/music/01 track.mp3", "/music/02 around the world.mp3", "/music/03 untagged.mp3"]
+    index.add(paths, {paths[0]: info(paths[0], "One More Time", "Daft Punk", "Discovery"),
+                      paths[1]: info(paths[1], "Around the World", "Daft Punk", "Homework")})
+    assert index.search("daft") == [0, 1]
+    # A word from the tags and one from the file name in the same query
+    assert index.search("daft track") == [0]
+    assert index.search("homework around") == [1]
+    assert index.search("untag") == [2]
+    # The extension isn't part of what a row is found by
+    assert index.search("mp3") == []
+    assert search_text(None, paths[2]) == "03 untagged"
+
+
+def test_accents_case_and_prefixes():
+    index = SearchIndex()
+    index.add(["/music/Beyoncé - Halo.mp3", "/music/BEATLES.mp3"])
+    assert index.search("beyonce") == [0]
+    assert index.search("BEYONCÉ halo") == [0]
+    assert index.search("b") == [0, 1]
+    assert index.search("be") == [0, 1]
+    assert index.search("bea") == [1]
+    # Only starts of words, not the middle of one
+    assert index.search("eatles") == []
+    assert index.search("  ") is None
+
+
+def test_pending_entries_are_indexed_before_a_search():
+    index = SearchIndex()
+    paths = [f"/music/song {n}.mp3" for n in range(INDEX_CHUNK * 3 + 5)]
+    index.add(paths)
+    assert len(index) == len(paths) and index.pending == len(paths)
+    # No time at all still gets through one chunk
+    assert index.index_pending(budget=0) is False
+    assert index.pending == len(paths) - INDEX_CHUNK
+    assert index.search("song") == list(range(len(paths)))
+    assert index.pending == 0
+
+
+def test_positions_shift_after_a_pop():
+    index = SearchIndex()
+    index.add(["/a/red one.mp3", "/a/blue two.mp3", "/a/red three.mp3", "/a/green four.mp3", "/a/red five.mp3"])
+    assert index.search("red") == [0, 2, 4]
+    index.pop(1)
+    assert index.search("red") == [0, 1, 3]
+    assert index.search("green") == [2]
+    # The last row with a word takes the word with it
+    assert index.search("blue") == []
+    index.pop(0)
+    assert index.search("red") == [0, 2]
+    assert index.search("r") == [0, 2]
+    # Added after a pop, the new row still comes last
+    index.add(["/a/red six.mp3"])
+    assert index.search("red") == [0, 2, 3]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_adds_and_pops_agree_with_a_plain_scan(seed):
+    rng = random.Random(seed)
+    index = SearchIndex()
+    rows = []
+    queries = ["daft", "daft pu", "b", "bea", "be", "punk da", "ola", "a", "ab", "zzz", "00", "da funk"]
+    added = 0
+    for _ in range(40):
+        if rows and rng.random() < 0.4:
+            for _ in range(rng.randint(1, 10)):
+                if rows:
+                    position = rng.randrange(len(rows))
+                    index.pop(position)
+                    del rows[position]
+        else:
+            paths = random_paths(rng, rng.randint(1, 150), added)
+            added += len(paths)
+            index.add(paths)
+            rows += [words(search_text(None, path)) for path in paths]
+            if rng.random() < 0.5:
+                index.index_pending(budget=0)
+        assert len(index) == len(rows)
+        for query in queries:
+            assert index.search(query) == plain_search(rows, query), query
+
+
+def test_match_from_only_looks_at_the_new_rows():
+    index = SearchIndex()
+    index.add(["/m/daft punk.mp3", "/m/beach house.mp3"])
+    index.pop(0)
+    index.add(["/m/daft punk live.mp3", "/m/punk daft.mp3", "/m/other.mp3"])
+    assert index.search("daft pu") == [1, 2]
+    assert index.match_from("daft pu", 2) == [2]
+    assert index.match_from("daft pu", 0) == index.search("daft pu")
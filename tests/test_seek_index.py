@@ -0,0 +1,243 @@
+"""
+Seek tables: storing them, the MP3 and FLAC scanners on generated files, and FLAC tables for web tracks.
+
+    python -m pytest tests
+"""
+import functools
+import os
+import struct
+import sys
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metadata_index import MetadataIndex
+from seek_index import SEEK_POINT_SPACING, SeekIndex, SeekTable, SpliceReader, build_seek_table
+
+RATE = 44100
+
+
+def test_table_round_trip():
+    table = SeekTable("flac", b"fLaC\x80\x00\x00\x22" + bytes(34), [0.0, 0.5, 1.25], [8342, 9000, 123456789012])
+    again = SeekTable.from_bytes(table.to_bytes())
+    assert (again.kind, again.header) == (table.kind, table.header)
+    assert list(again.times) == list(table.times) and list(again.offsets) == list(table.offsets)
+
+
+def test_find_takes_the_point_at_or_before():
+    table = SeekTable("mp3", b"", [0.0, 0.5, 1.0], [10, 20, 30])
+    assert table.find(0.0) == (0.0, 10)
+    assert table.find(0.99) == (0.5, 20)
+    assert table.find(60.0) == (1.0, 30)
+    assert SeekTable("mp3", b"", [0.5], [20]).find(0.1) is None
+
+
+# MP3: MPEG 1 layer III at 128 kbit/s and 44.1 kHz, 417 bytes a frame, 418 with the padding bit
+FRAME_SAMPLES = 1152
+
+
+def mp3_frame(padding, fill=b"\x00"):
+    header = bytes([0xFF, 0xFB, 0x90 | (padding << 1), 0x00])
+    return header + fill * (417 + padding - 4)
+
+
+def write_mp3(path, count, id3=True, info_frame=True, garbage=b""):
+    # Returns the offset of every audio frame
+    data = bytearray()
+    if id3:
+        # Syncsafe size of 300
+        data += b"ID3\x03\x00\x00" + bytes([0, 0, 2, 44]) + b"\xFF\xFB" * 150
+    if info_frame:
+        frame = bytearray(mp3_frame(0))
+        frame[36:40] = b"Info"
+        data += frame
+    data += garbage
+    offsets = []
+    for number in range(count):
+        offsets.append(len(data))
+        data += mp3_frame(number % 3 == 0)
+    with open(path, "wb") as f:
+        f.write(data)
+    return offsets
+
+
+def expected_points(count, samples_per_frame, rate):
+    points = []
+    next_point = 0.0
+    for number in range(count):
+        seconds = number * samples_per_frame / rate
+        if seconds >= next_point:
+            points.append(number)
+            next_point = seconds + SEEK_POINT_SPACING
+    return points
+
+
+@pytest.mark.parametrize("id3,info_frame,garbage", [(True, True, b""), (False, False, b""), (True, False, b"\xFF\xE0junk")])
+def test_mp3_points_are_frame_starts(tmp_path, id3, info_frame, garbage):
+    path = str(tmp_path / "a.mp3")
+    offsets = write_mp3(path, 500, id3, info_frame, garbage)
+    table = build_seek_table(path)
+    assert table.kind == "mp3" and table.header == b""
+    points = expected_points(500, FRAME_SAMPLES, RATE)
+    # The Info frame and the tag in front don't count, the first point is the first audio frame at 0 s
+    assert list(table.offsets) == [offsets[number] for number in points]
+    assert list(table.times) == [number * FRAME_SAMPLES / RATE for number in points]
+    assert table.times[0] == 0.0
+    gaps = np.diff(table.times)
+    assert gaps.min() >= SEEK_POINT_SPACING and gaps.max() < SEEK_POINT_SPACING + FRAME_SAMPLES / RATE
+
+
+def test_not_a_seekable_file(tmp_path):
+    (tmp_path / "a.mp3").write_bytes(b"no frames in here" * 100)
+    (tmp_path / "b.flac").write_bytes(b"fLaC" + bytes(10))
+    (tmp_path / "c.ogg").write_bytes(b"OggS" + bytes(100))
+    for name in ("a.mp3", "b.flac", "c.ogg", "missing.mp3"):
+        assert build_seek_table(str(tmp_path / name)) is None
+
+
+# FLAC: verbatim subframes (the samples as they are), a SEEKTABLE point every `seek_every` seconds
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def crc16(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005) & 0xFFFF if crc & 0x8000 else (crc << 1) & 0xFFFF
+    return crc
+
+
+def write_flac(path, samples, block=4096, seek_every=2):
+    # Returns [(first sample, offset in the file)] of the seek points
+    frames = []
+    for number, start in enumerate(range(0, len(samples), block)):
+        chunk = samples[start:start + block]
+        code = 12 if len(chunk) == 4096 else 7
+        # 44.1 kHz, left/right, 16 bit, then the frame number as UTF-8
+        header = bytes([0xFF, 0xF8, (code << 4) | 9, (1 << 4) | (4 << 1)]) + chr(number).encode("utf-8")
+        if code == 7:
+            header += struct.pack(">H", len(chunk) - 1)
+        header += bytes([crc8(header)])
+        frame = header + b"".join(b"\x02" + chunk[:, channel].astype(">i2").tobytes() for channel in range(2))
+        frames.append((start, frame + struct.pack(">H", crc16(frame))))
+
+    points = []
+    offset = 0
+    for start, frame in frames:
+        if start % (seek_every * RATE) < block:
+            points.append((start, offset))
+        offset += len(frame)
+    seektable = b"".join(struct.pack(">QQH", start, offset, block) for start, offset in points)
+    # A placeholder point at the end, scanners skip it
+    seektable += struct.pack(">QQH", 0xFFFFFFFFFFFFFFFF, 0, 0)
+
+    streaminfo = struct.pack(">HH", block, block) + bytes(6)
+    streaminfo += ((RATE << 44) | (1 << 41) | (15 << 36) | len(samples)).to_bytes(8, "big") + b"\x11" * 16
+    head = b"fLaC" + b"\x00" + len(streaminfo).to_bytes(3, "big") + streaminfo
+    head += b"\x83" + len(seektable).to_bytes(3, "big") + seektable
+    with open(path, "wb") as f:
+        f.write(head + b"".join(frame for start, frame in frames))
+    return [(start, len(head) + offset) for start, offset in points]
+
+
+def flac_samples(seconds, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(-20000, 20000, (int(seconds * RATE), 2)).astype(np.int16)
+
+
+def test_flac_points_come_from_the_seektable(tmp_path):
+    path = str(tmp_path / "a.flac")
+    points = write_flac(path, flac_samples(7.3))
+    table = build_seek_table(path)
+    assert table.kind == "flac"
+    assert list(table.times) == [start / RATE for start, offset in points]
+    assert list(table.offsets) == [offset for start, offset in points]
+    # The header is a last STREAMINFO block with the total and the MD5 of the original file cleared
+    assert table.header[:8] == b"fLaC\x80\x00\x00\x22" and len(table.header) == 42
+    streaminfo = table.header[8:]
+    assert streaminfo[13] & 0x0F == 0 and streaminfo[14:18] == bytes(4) and streaminfo[18:] == bytes(16)
+
+
+def test_flac_spliced_at_a_point_decodes_to_the_rest_of_the_track(tmp_path):
+    pygame = pytest.importorskip("pygame")
+    from audio_decode import init_worker_mixer
+    init_worker_mixer()
+    if pygame.mixer.get_init()[0] != RATE:
+        pytest.skip("mixer doesn't run at 44.1 kHz")
+    path = str(tmp_path / "a.flac")
+    samples = flac_samples(5.1)
+    write_flac(path, samples)
+    table = build_seek_table(path)
+    seconds, offset = table.find(3.0)
+    reader = SpliceReader(table.header, path, offset)
+    try:
+        decoded = pygame.sndarray.samples(pygame.mixer.Sound(file=reader))
+    finally:
+        reader.close()
+    # The decoder drops the first frame or two of a spliced stream (audio_decode.py lines pieces up for that),
+    # everything after them is the track from the seek point on
+    rest = samples[round(seconds * RATE):]
+    assert len(rest) - 2 * 4096 <= len(decoded) <= len(rest)
+    assert np.array_equal(decoded, rest[len(rest) - len(decoded):])
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def web_folder(tmp_path):
+    folder = tmp_path / "web"
+    folder.mkdir()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=str(folder)))
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield folder, f"http://127.0.0.1:{httpd.server_address[1]}/"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_web_flac_gets_a_table_and_splices(tmp_path, web_folder):
+    folder, base = web_folder
+    points = write_flac(str(folder / "a.flac"), flac_samples(6.5))
+    write_mp3(str(folder / "b.mp3"), 100)
+    metadata = MetadataIndex(str(tmp_path / "library.db"))
+    index = SeekIndex(metadata)
+
+    index.load(base + "a.flac")
+    opened = index.open_at(base + "a.flac", 4.5)
+    assert opened is not None
+    reader, seconds, kind = opened
+    assert (seconds, kind) == (points[2][0] / RATE, "flac")
+    local = build_seek_table(str(folder / "a.flac"))
+    with open(folder / "a.flac", "rb") as f:
+        f.seek(points[2][1])
+        assert reader.read() == local.header + f.read()
+    reader.close()
+    # Cached in the database like the tables of local files
+    with metadata._lock:
+        assert metadata._conn.execute("SELECT COUNT(*) FROM seek_tables").fetchone()[0] == 1
+
+    # An MP3 table would take the whole file, web MP3s go without
+    index.load(base + "b.mp3")
+    assert index.open_at(base + "b.mp3", 1.0) is None
+    metadata.close()
+
+
+def test_splice_reader_of_a_missing_web_track(web_folder):
+    folder, base = web_folder
+    with pytest.raises(OSError):
+        SpliceReader(b"", base + "gone.flac", 0)
@@ -0,0 +1,101 @@
+"""
+StreamSource over a local file and over HTTP, with and without Range support on the server.
+
+    python -m pytest tests
+"""
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streaming import BLOCK_SIZE, open_source
+
+RANGE = re.compile(r"bytes=(\d+)-(\d*)")
+DATA = os.urandom(BLOCK_SIZE * 9 + 1234)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    ranges = True  # Set per server
+    sent = None  # Bytes of body sent, per server
+
+    def do_GET(self):
+        start, end = 0, len(DATA) - 1
+        wanted = RANGE.match(self.headers.get("Range", "")) if self.ranges else None
+        if wanted:
+            start = int(wanted.group(1))
+            end = min(int(wanted.group(2) or end), end)
+        body = DATA[start:end + 1]
+        self.send_response(206 if wanted else 200)
+        if wanted:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            for first in range(0, len(body), 65536):
+                self.wfile.write(body[first:first + 65536])
+                self.server.sent += min(65536, len(body) - first)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(params=[True, False], ids=["ranges", "no ranges"])
+def server(request):
+    handler = type("Handler", (Handler,), {"ranges": request.param})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    httpd.sent = 0
+    httpd.daemon_threads = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/track.mp3"
+
+
+def test_reading_front_to_back(server):
+    source = open_source(url(server), prefetch=BLOCK_SIZE * 2)
+    assert source.length == len(DATA) and source.namehint == "mp3"
+    assert source.read() == DATA
+    source.close()
+    # Every byte comes over the wire once, whether the server does ranges or not
+    assert server.sent <= len(DATA) + BLOCK_SIZE
+
+
+def test_reading_all_over_the_place(server):
+    # Tags at the end, a seek back to the start, a jump into the middle, like mutagen and a decoder do it
+    source = open_source(url(server), prefetch=BLOCK_SIZE)
+    for offset, size in [(len(DATA) - 128, 128), (0, 10), (BLOCK_SIZE * 4 + 17, BLOCK_SIZE + 3), (5, 1000)]:
+        source.seek(offset)
+        assert source.read(size) == DATA[offset:offset + size]
+    source.close()
+    if not server.RequestHandlerClass.ranges:
+        # The whole file once, not the file up to every block that was asked for
+        assert server.sent <= len(DATA)
+
+
+def test_local_file(tmp_path):
+    path = tmp_path / "a.flac"
+    path.write_bytes(DATA)
+    source = open_source(str(path))
+    assert source.stat().st_size == len(DATA) and source.namehint == "flac"
+    source.seek(BLOCK_SIZE * 3 - 5)
+    assert source.read(10) == DATA[BLOCK_SIZE * 3 - 5:BLOCK_SIZE * 3 + 5]
+    source.seek(0)
+    assert source.read() == DATA
+    source.close()
+
+
+def test_missing_file_gives_no_source(tmp_path):
+    assert open_source(str(tmp_path / "gone.mp3")) is None
@@ -0,0 +1,156 @@
+"""
+PeakBuilder fed piece by piece against a plain min/max over the whole track, and the peak files made from it.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from waveform import BASE_BUCKETS, MIN_BUCKETS, PeakBuilder, read_peak_file, write_peak_file
+
+
+def samples(frames, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(-32768, 32767, (frames, 2)).astype(np.int16)
+
+
+def build(data, cuts):
+    builder = PeakBuilder()
+    for start, end in zip([0] + cuts, cuts + [len(data)]):
+        builder.add(data[start:end])
+    return builder
+
+
+def expected_finest(data, size):
+    # Buckets of `size` frames from the start, the last one may be short, spread over BASE_BUCKETS like levels() does
+    mins = [data[start:start + size].min() for start in range(0, len(data), size)]
+    maxs = [data[start:start + size].max() for start in range(0, len(data), size)]
+    mins, maxs = np.array(mins, np.int16), np.array(maxs, np.int16)
+    if len(mins) > BASE_BUCKETS:
+        starts = np.arange(BASE_BUCKETS) * len(mins) // BASE_BUCKETS
+        mins, maxs = np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts)
+    return mins, maxs
+
+
+def assert_same_levels(first, second):
+    assert len(first) == len(second)
+    for (mins_a, maxs_a), (mins_b, maxs_b) in zip(first, second):
+        assert np.array_equal(mins_a, mins_b) and np.array_equal(maxs_a, maxs_b)
+
+
+@pytest.mark.parametrize("frames", [1, 100, BASE_BUCKETS * 2, BASE_BUCKETS * 2 + 1, 1_000_003])
+def test_whole_track_matches_a_plain_min_max(frames):
+    data = samples(frames)
+    builder = build(data, [])
+    mins, maxs = builder.levels()[0]
+    expected_mins, expected_maxs = expected_finest(data, builder.size)
+    assert np.array_equal(mins, expected_mins) and np.array_equal(maxs, expected_maxs)
+    assert mins.min() == data.min() and maxs.max() == data.max()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_cut_pieces_give_the_same_levels(seed):
+    rng = np.random.default_rng(seed)
+    data = samples(int(rng.integers(200_000, 2_000_000)), seed)
+    cuts = sorted(set(int(cut) for cut in rng.integers(1, len(data), 40)))
+    # A run of single frames too, they only ever fill the partial bucket
+    cuts = sorted(set(cuts + list(range(cuts[0], cuts[0] + 50))))
+    assert_same_levels(build(data, cuts).levels(), build(data, []).levels())
+
+
+def test_levels_halve_down_to_min_buckets():
+    levels = build(samples(3_000_000), []).levels()
+    assert len(levels[0][0]) == BASE_BUCKETS
+    assert [len(mins) for mins, maxs in levels] == [BASE_BUCKETS >> n for n in range(len(levels))]
+    assert len(levels[-1][0]) >= MIN_BUCKETS
+    for (mins, maxs), (coarse_mins, coarse_maxs) in zip(levels, levels[1:]):
+        assert np.array_equal(coarse_mins, mins.reshape(-1, 2).min(axis=1))
+        assert np.array_equal(coarse_maxs, maxs.reshape(-1, 2).max(axis=1))
+
+
+def test_peak_file_round_trip(tmp_path):
+    levels = build(samples(500_000), []).levels()
+    path = str(tmp_path / "a.peaks")
+    write_peak_file(path, levels)
+    assert_same_levels(read_peak_file(path).levels, levels)
+
+
+def test_peak_file_of_a_track_longer_than_one_piece(tmp_path):
+    # build_peak_file() goes through decode_chunks(), CHUNK_SECONDS at a time
+    pytest.importorskip("pygame")
+    import wave
+    from audio_decode import CHUNK_SECONDS
+    from waveform import build_peak_file
+    data = samples(44100 * (CHUNK_SECONDS * 2 + 5))
+    path = str(tmp_path / "a.wav")
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+        f.writeframes(data.tobytes())
+    peaks = read_peak_file(build_peak_file(path, str(tmp_path / "a.peaks")))
+    assert_same_levels(peaks.levels, build(data, []).levels())
+
+
+def test_only_the_latest_request_gets_decoded(tmp_path, monkeypatch):
+    # While one track is being decoded the user skips past three more, only the last of them is decoded next
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    import waveform
+    from kivy.clock import Clock
+
+    started = threading.Event()
+    release = threading.Event()
+    built = []
+
+    def fake_build(path, out_path):
+        built.append(path)
+        started.set()
+        release.wait(5)
+        write_peak_file(out_path, build(samples(1000), []).levels())
+        return out_path
+
+    monkeypatch.setattr(waveform, "build_peak_file", fake_build)
+    cache = waveform.PeakCache(str(tmp_path / "peaks"))
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(cache, "_get_pool", lambda: pool)
+    tracks = []
+    for name in "abcd":
+        (tmp_path / name).write_bytes(b"x")
+        tracks.append(str(tmp_path / name))
+
+    ready = []
+    cache.request(tracks[0], lambda path, peaks: ready.append(("first", path)))
+    assert started.wait(5)
+    for path in tracks[1:]:
+        cache.request(path, lambda path, peaks: ready.append(("later", path)))
+    release.set()
+    deadline = time.time() + 5
+    while len(ready) < 2 and time.time() < deadline:
+        Clock.tick()
+        time.sleep(0.01)
+    cache.shutdown()
+    pool.shutdown()
+    assert built == [tracks[0], tracks[3]]
+    # Each callback with its own track, even when both wait for the same Clock tick
+    assert ready == [("first", tracks[0]), ("later", tracks[3])]
+
+
+def test_trim_keeps_the_newest_files(tmp_path, monkeypatch):
+    import waveform
+    monkeypatch.setattr(waveform, "DISK_ITEMS", 3)
+    cache = waveform.PeakCache(str(tmp_path))
+    for number in range(5):
+        path = tmp_path / f"{number}.peaks"
+        path.write_bytes(b"PEAK")
+        os.utime(path, (1000 + number, 1000 + number))
+    cache._trim_disk()
+    assert sorted(os.listdir(tmp_path)) == ["2.peaks", "3.peaks", "4.peaks"]
@@ -0,0 +1,331 @@
+import hashlib
+import importlib.util
+import os
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from kivy.clock import Clock
+from kivy.graphics import Color, Mesh
+from kivy.properties import ListProperty, ObjectProperty
+from kivy.uix.slider import Slider
+
+import perf
+
+# Waveforms are optional, the slider just stays plain without NumPy.
+# Only checked here, NumPy itself is imported by the code that needs it, it is too slow for the start up path
+HAVE_NUMPY = importlib.util.find_spec("numpy") is not None
+
+# Finest level of the overview, every coarser level halves it down to MIN_BUCKETS
+BASE_BUCKETS = 4096
+MIN_BUCKETS = 64
+
+# Peak files kept on disk (about 32 KB each), every TRIM_EVERY new files the oldest ones over that go
+DISK_ITEMS = 2000
+TRIM_EVERY = 100
+
+PEAK_MAGIC = b"PEAK"
+PEAK_VERSION = 1
+
+
+def peak_file_name(path):
+    # Same idea as the metadata index, a changed file gets a new name and is decoded again
+    stat = os.stat(path)
+    key = f"{path}|{stat.st_mtime}|{stat.st_size}".encode()
+    return hashlib.sha1(key).hexdigest() + ".peaks"
+
+
+class PeakBuilder:
+    """
+    Min/max overview of a track that comes in piece by piece through add(), levels() once it is all there.
+
+    How long the track is only shows at the end, so buckets start out one frame wide and neighbours get merged whenever there are 2 * BASE_BUCKETS of them. A 3 minute song and a 3 hour mix need the same few KB, levels() spreads what is there over BASE_BUCKETS.
+    """
+
+    def __init__(self):
+        import numpy as np
+        self.size = 1  # Frames per bucket
+        self.mins = np.zeros(0, dtype=np.int16)
+        self.maxs = np.zeros(0, dtype=np.int16)
+        # The bucket that is still filling up, with its frame count
+        self.partial = None
+        self.partial_frames = 0
+
+    def add(self, samples):
+        # samples is (frames, channels) int16. Min/max over all channels at once, so there is no mono mixdown pass
+        import numpy as np
+        mins = samples.min(axis=1)
+        maxs = samples.max(axis=1)
+        if self.partial_frames:
+            need = self.size - self.partial_frames
+            low, high = self.partial
+            low = min(low, mins[:need].min()) if len(mins) else low
+            high = max(high, maxs[:need].max()) if len(maxs) else high
+            if len(mins) < need:
+                self.partial = low, high
+                self.partial_frames += len(mins)
+                return
+            self.mins = np.append(self.mins, np.int16(low))
+            self.maxs = np.append(self.maxs, np.int16(high))
+            self.partial_frames = 0
+            mins, maxs = mins[need:], maxs[need:]
+
+        full = len(mins) // self.size * self.size
+        self.mins = np.concatenate([self.mins, mins[:full].reshape(-1, self.size).min(axis=1)])
+        self.maxs = np.concatenate([self.maxs, maxs[:full].reshape(-1, self.size).max(axis=1)])
+        if full < len(mins):
+            self.partial = mins[full:].min(), maxs[full:].max()
+            self.partial_frames = len(mins) - full
+
+        while len(self.mins) >= BASE_BUCKETS * 2:
+            if len(self.mins) % 2:
+                # The odd one out goes back to filling up, together with what is already there
+                low, high = self.mins[-1], self.maxs[-1]
+                if self.partial_frames:
+                    low, high = min(low, self.partial[0]), max(high, self.partial[1])
+                self.partial = low, high
+                self.partial_frames += self.size
+                self.mins, self.maxs = self.mins[:-1], self.maxs[:-1]
+            self.mins = self.mins.reshape(-1, 2).min(axis=1)
+            self.maxs = self.maxs.reshape(-1, 2).max(axis=1)
+            self.size *= 2
+
+    def levels(self):
+        # Finest level first, every coarser level halves it down to MIN_BUCKETS
+        import numpy as np
+        mins, maxs = self.mins, self.maxs
+        if self.partial_frames:
+            mins = np.append(mins, np.int16(self.partial[0]))
+            maxs = np.append(maxs, np.int16(self.partial[1]))
+        if not len(mins):
+            mins = maxs = np.zeros(1, dtype=np.int16)
+        if len(mins) > BASE_BUCKETS:
+            starts = np.arange(BASE_BUCKETS) * len(mins) // BASE_BUCKETS
+            mins = np.minimum.reduceat(mins, starts)
+            maxs = np.maximum.reduceat(maxs, starts)
+        mins = mins.astype(np.int16)
+        maxs = maxs.astype(np.int16)
+
+        levels = [(mins, maxs)]
+        while len(mins) >= MIN_BUCKETS * 2 and len(mins) % 2 == 0:
+            mins = mins.reshape(-1, 2).min(axis=1)
+            maxs = maxs.reshape(-1, 2).max(axis=1)
+            levels.append((mins, maxs))
+        return levels
+
+
+def write_peak_file(out_path, levels):
+    # Header, then for every level its bucket count followed by the mins and maxs as int16
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(PEAK_MAGIC + struct.pack("<HH", PEAK_VERSION, len(levels)))
+        for mins, maxs in levels:
+            f.write(struct.pack("<I", len(mins)))
+            f.write(mins.astype("<i2").tobytes())
+            f.write(maxs.astype("<i2").tobytes())
+    # Rename last, a half written file never looks like a finished one
+    os.replace(tmp_path, out_path)
+
+
+def read_peak_file(peak_path):
+    import numpy as np
+    with open(peak_path, 'rb') as f:
+        data = f.read()
+    if data[:4] != PEAK_MAGIC:
+        return None
+    version, count = struct.unpack_from("<HH", data, 4)
+    if version != PEAK_VERSION:
+        return None
+
+    levels = []
+    pos = 8
+    for _ in range(count):
+        (buckets,) = struct.unpack_from("<I", data, pos)
+        pos += 4
+        mins = np.frombuffer(data, dtype="<i2", count=buckets, offset=pos)
+        pos += buckets * 2
+        maxs = np.frombuffer(data, dtype="<i2", count=buckets, offset=pos)
+        pos += buckets * 2
+        levels.append((mins, maxs))
+    return PeakData(levels)
+
+
+def build_peak_file(path, out_path):
+    # Runs in a worker process: decode piece by piece, reduce with NumPy, write the small result
+    from audio_decode import decode_chunks
+    builder = PeakBuilder()
+    for samples, sample_rate in decode_chunks(path):
+        builder.add(samples)
+    write_peak_file(out_path, builder.levels())
+    return out_path
+
+
+class PeakData:
+    # All resolutions of one track, finest first
+
+    def __init__(self, levels):
+        self.levels = levels
+
+    def for_width(self, width):
+        # Coarsest level that still has a bucket for every pixel
+        for mins, maxs in reversed(self.levels):
+            if len(mins) >= width:
+                return mins, maxs
+        return self.levels[0]
+
+
+class PeakCache:
+    """
+    Waveform overviews on disk, one small .peaks file per track.
+
+    Tracks that already have a file are just read back. Everything else is decoded once in a single low-key worker process, so a big library is never decoded twice and the UI never waits on it.
+    Only the latest request counts, like with ArtCache: skipping through ten songs decodes at most the one that was in the works and the one that plays. The oldest files go once there are more than DISK_ITEMS.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.enabled = HAVE_NUMPY
+        self._pool = None
+        self._lock = threading.Lock()
+        self._wanted = None  # (path, callback) of the latest request
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._written = 0
+        if self.enabled:
+            os.makedirs(folder, exist_ok=True)
+
+    def request(self, path, callback):
+        # callback(path, PeakData) is called on the Kivy thread once the peaks are there
+        if not self.enabled:
+            return
+        with self._lock:
+            self._wanted = (path, callback)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._stopped:
+                return
+            with self._lock:
+                wanted, self._wanted = self._wanted, None
+            if wanted is None:
+                continue
+
+            path, callback = wanted
+            peaks = self._load(path)
+            if peaks is not None:
+                Clock.schedule_once(lambda dt, path=path, peaks=peaks, callback=callback: callback(path, peaks), 0)
+
+    def _load(self, path):
+        try:
+            peak_path = os.path.join(self.folder, peak_file_name(path))
+        except OSError:
+            return None
+
+        if os.path.exists(peak_path):
+            # Reading a file touches it, the trim goes by that
+            try:
+                os.utime(peak_path)
+            except OSError:
+                pass
+        else:
+            try:
+                self._get_pool().submit(build_peak_file, path, peak_path).result()
+            except Exception:
+                return None
+            self._written += 1
+            if self._written % TRIM_EVERY == 0:
+                self._trim_disk()
+
+        try:
+            return read_peak_file(peak_path)
+        except (OSError, struct.error):
+            return None
+
+    def _trim_disk(self):
+        # Oldest files go first
+        try:
+            with os.scandir(self.folder) as it:
+                files = [(entry.stat().st_mtime, entry.path) for entry in it if entry.is_file()]
+        except OSError:
+            return
+        if len(files) <= DISK_ITEMS:
+            return
+        files.sort()
+        for mtime, file_path in files[:len(files) - DISK_ITEMS]:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+    def _get_pool(self):
+        # Started on first use, most sessions only ever read cached files
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=1)
+            return self._pool
+
+    def shutdown(self):
+        self._stopped = True
+        self._wake.set()
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+class WaveformSlider(Slider):
+    """
+    Slider with the track's waveform drawn behind the thumb.
+
+    The whole overview is one Mesh. Its vertices are only rebuilt when the peaks or the slider size change, never while the thumb moves.
+    """
+
+    peaks = ObjectProperty(None, allownone=True)
+    waveform_color = ListProperty([1, 1, 1, 0.25])
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        with self.canvas.before:
+            self._waveform_color = Color(*self.waveform_color)
+            self._waveform = Mesh(mode='triangle_strip')
+        self.bind(peaks=self.redraw_waveform, size=self.redraw_waveform, pos=self.redraw_waveform)
+
+    def on_waveform_color(self, instance, value):
+        if hasattr(self, "_waveform_color"):
+            self._waveform_color.rgba = value
+
+    @perf.timed("redraw_waveform")
+    def redraw_waveform(self, *args):
+        width = int(self.width)
+        if self.peaks is None or width < 2:
+            self._waveform.vertices = []
+            self._waveform.indices = []
+            return
+        # Peaks only ever arrive when NumPy is there, so this import never fails
+        import numpy as np
+
+        # 1. One min/max pair per pixel column, reduced straight from the closest level
+        mins, maxs = self.peaks.for_width(width)
+        edges = (np.arange(width) * len(mins) // width).astype(np.intp)
+        column_min = np.minimum.reduceat(mins, edges) / 32768.0
+        column_max = np.maximum.reduceat(maxs, edges) / 32768.0
+
+        # 2. Two vertices per column (bottom, top), x y u v each, drawn as one triangle strip
+        xs = self.x + self.padding + np.arange(width) * (self.width - 2 * self.padding) / width
+        mid = self.center_y
+        half = self.height / 2
+        vertices = np.zeros((width, 2, 4), dtype=np.float32)
+        vertices[:, 0, 0] = xs
+        vertices[:, 0, 1] = mid + column_min * half
+        vertices[:, 1, 0] = xs
+        vertices[:, 1, 1] = mid + column_max * half
+
+        self._waveform.vertices = vertices.ravel().tolist()
+        self._waveform.indices = list(range(width * 2))